@@ -0,0 +1,165 @@
+from collections import OrderedDict, namedtuple
+import gc
+import hashlib
+import io
+import os
+import pickle
+import sys
+import parser as lox_parser
+from parser import AST, Stmt
+from lexer import FileSource, Source, Token
+
+CACHE_VERSION = 1
+MAGIC = b"LOXC"
+
+NODE_CLASSES = {
+    name: cls
+    for name, cls in vars(lox_parser).items()
+    if isinstance(cls, type) and issubclass(cls, (AST, Stmt))
+}
+
+# Any change to the node classes or their fields changes every cache key
+SCHEMA = repr(
+    (
+        CACHE_VERSION,
+        sys.version_info[:2],
+        sorted((name, cls.__slots__) for name, cls in NODE_CLASSES.items()),
+        Token.__slots__,
+    )
+).encode()
+
+
+def source_digest(text):
+    digest = hashlib.sha256(SCHEMA)
+    digest.update(text.encode("utf-8", "surrogatepass"))
+    return digest.hexdigest()
+
+
+def file_digest(path, chunk_size=1 << 16):
+    digest = hashlib.sha256(SCHEMA)
+    with open(path, "r") as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return digest.hexdigest()
+            digest.update(chunk.encode("utf-8", "surrogatepass"))
+
+
+def load_source():
+    # Stands for the source the tokens belong to; TreeUnpickler replaces
+    # it with the source of the program being loaded
+    raise pickle.UnpicklingError("load_source is only valid inside TreeUnpickler")
+
+
+def reduce_source(source):
+    return load_source, ()
+
+
+class TreePickler(pickle.Pickler):
+    # The source text is not stored; every token refers to load_source()
+    dispatch_table = {Source: reduce_source, FileSource: reduce_source}
+
+
+class TreeUnpickler(pickle.Unpickler):
+    def __init__(self, file, source):
+        super().__init__(file)
+        self.source = source
+
+    def find_class(self, module, name):
+        if module == __name__ and name == "load_source":
+            return lambda: self.source
+        if module == "lexer" and name == "Token":
+            return Token
+        if module == "parser" and name in NODE_CLASSES:
+            return NODE_CLASSES[name]
+        if module == "copyreg" and name == "__newobj__":
+            return super().find_class(module, name)
+        raise pickle.UnpicklingError(f"{module}.{name} is not part of a Lox AST")
+
+
+class DiskCache:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest + ".loxc")
+
+    def load(self, digest, source):
+        header = MAGIC + digest.encode()
+        try:
+            with open(self.path(digest), "rb") as file:
+                if file.read(len(header)) != header:
+                    return None
+                # Every loaded object is fresh and acyclic, so collections
+                # triggered by the allocations would only waste time
+                gc_enabled = gc.isenabled()
+                gc.disable()
+                try:
+                    return TreeUnpickler(file, source).load()
+                finally:
+                    if gc_enabled:
+                        gc.enable()
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # A truncated or otherwise corrupt entry is treated as a miss
+            return None
+
+    def store(self, digest, tree):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(digest)
+        buffer = io.BytesIO()
+        TreePickler(buffer, protocol=pickle.HIGHEST_PROTOCOL).dump(tree)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(MAGIC + digest.encode())
+            file.write(buffer.getvalue())
+        os.replace(temp_path, path)
+
+
+CacheInfo = namedtuple("CacheInfo", "hits misses evictions entries size")
+
+
+class MemoryCache:
+    # Least recently used programs are evicted first once either limit is
+    # exceeded; an entry's size is the length of its source text
+    def __init__(self, max_entries=128, max_size=8 << 20):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        program = self.entries.get(key)
+        if program is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return program
+
+    def put(self, key, program):
+        size = len(key[1])
+        if size > self.max_size or self.max_entries <= 0:
+            return
+        if key in self.entries:
+            self.size -= len(key[1])
+        self.entries[key] = program
+        self.entries.move_to_end(key)
+        self.size += size
+        while len(self.entries) > self.max_entries or self.size > self.max_size:
+            evicted_key, _ = self.entries.popitem(last=False)
+            self.size -= len(evicted_key[1])
+            self.evictions += 1
+
+    def info(self):
+        return CacheInfo(
+            self.hits, self.misses, self.evictions, len(self.entries), self.size
+        )
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
@@ -0,0 +1,794 @@
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from environment import Environment
+from interpreter import Interpreter
+from lexer import Lexer, RegexLexer, TT_EOF, TT_IDENTIFIER
+from lox import BACKENDS, Lox
+from lox_callable import MEMO_ENTRIES
+from parser import AST, Parser, PrattParser, Stmt
+
+
+def generate_program(functions=200):
+    lines = []
+    for i in range(functions):
+        lines.append(f"// generated function {i}")
+        lines.append(f"fun function_{i}(a, b) {{")
+        lines.append(f'    var label = "function number {i}";')
+        lines.append(f"    if (a <= b and b != {i}.5) {{")
+        lines.append(f"        return a * {i} + b / 2.25 - (a - b);")
+        lines.append("    }")
+        lines.append("    return a >= b or !(a == b);")
+        lines.append("}")
+        lines.append(f"for (var i = 0; i < {i}; i = i + 1) print function_{i}(i, 1);")
+    return "\n".join(lines) + "\n"
+
+
+def timed(fn, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def lex_all(lexer_class, text):
+    lexer = lexer_class("<bench>", text)
+    count = 0
+    while lexer.get_next_token().type != TT_EOF:
+        count += 1
+    return count
+
+
+def bench_lexer():
+    text = generate_program(2000)
+    tokens = lex_all(Lexer, text)
+    print(f"lexer: {len(text)} chars, {tokens} tokens")
+    for name, lexer_class in (("classic", Lexer), ("regex", RegexLexer)):
+        elapsed = timed(lambda: lex_all(lexer_class, text), repeat=3)
+        print(f"  {name:<8} {elapsed * 1000:8.1f} ms  {tokens / elapsed:12.0f} tokens/s")
+
+
+def bench_token_memory():
+    text = generate_program(500)
+    for name, lexer_class in (("classic", Lexer), ("regex", RegexLexer)):
+        lexer = lexer_class("<bench>", text)
+        tracemalloc.start()
+        tokens = []
+        while True:
+            token = lexer.get_next_token()
+            tokens.append(token)
+            if token.type == TT_EOF:
+                break
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"token memory ({name}): {size / len(tokens):.1f} bytes/token")
+
+
+def bench_phases():
+    text = generate_program(2000)
+    interleaved = timed(lambda: Parser(RegexLexer("<bench>", text)).parse(), repeat=3)
+    lex = timed(lambda: RegexLexer("<bench>", text).tokenize(), repeat=3)
+    tokens = RegexLexer("<bench>", text).tokenize()
+
+    def parse_buffer():
+        tokens.cursor = 0
+        Parser(tokens).parse()
+
+    parse = timed(parse_buffer, repeat=3)
+    print(f"phases: {len(tokens)} tokens")
+    print(f"  interleaved lex+parse {interleaved * 1000:8.1f} ms")
+    print(f"  buffered lex          {lex * 1000:8.1f} ms")
+    print(f"  buffered parse        {parse * 1000:8.1f} ms")
+    print(f"  buffered total        {(lex + parse) * 1000:8.1f} ms")
+
+
+def bench_file_input():
+    lines = [f"var v{i} = {i} * 2 + 1;" for i in range(20000)]
+    with tempfile.NamedTemporaryFile("w", suffix=".lox", delete=False) as f:
+        f.write("\n".join(lines))
+    try:
+        size = os.path.getsize(f.name)
+        print(f"file input: {size / 1e6:.1f} MB script")
+
+        def read_whole():
+            with open(f.name, "r") as file:
+                Lox().run(file.read(), f.name)
+
+        for name, run in (
+            ("read+run", read_whole),
+            ("run_file", lambda: Lox().run_file(f.name)),
+        ):
+            tracemalloc.start()
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"  {name:<9} {elapsed * 1000:8.1f} ms  peak {peak / 1e6:8.1f} MB")
+    finally:
+        os.unlink(f.name)
+
+
+class NoInterning(dict):
+    def __missing__(self, value):
+        return value
+
+
+def generate_identifier_program(names=50, statements=4000):
+    lines = [f"var identifier_number_{i} = {i};" for i in range(names)]
+    lines.append("var status;")
+    for i in range(statements):
+        a = f"identifier_number_{i % names}"
+        b = f"identifier_number_{(i * 7) % names}"
+        lines.append(f'{a} = {b} + {a} - {b}; status = "status {i % 5}";')
+    return "\n".join(lines)
+
+
+def bench_interning():
+    text = generate_identifier_program()
+    print("interning:")
+    for name, table in (("plain", NoInterning), ("interned", dict)):
+        interned = None if table is dict else table()
+
+        tracemalloc.start()
+        lexer = RegexLexer("<bench>", text, interned)
+        tokens = []
+        while True:
+            token = lexer.get_next_token()
+            tokens.append(token)
+            if token.type == TT_EOF:
+                break
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        names = [t.value for t in tokens if t.type == TT_IDENTIFIER]
+        environment = Environment()
+        for var_name in names:
+            if var_name not in environment.values:
+                environment.define(var_name, 1.0, None)
+
+        def lookups():
+            for _ in range(20):
+                for var_name in names:
+                    environment.get(None, var_name)
+
+        lookup = timed(lookups)
+        run = timed(
+            lambda: Interpreter().interpret(
+                Parser(RegexLexer("<bench>", text, None if table is dict else table()))
+            ),
+            repeat=3,
+        )
+        distinct = len({id(value) for value in names})
+        print(
+            f"  {name:<9} tokens {size / 1e3:8.1f} kB  {distinct:6} name objects  "
+            f"lookups {lookup * 1000:6.1f} ms  run {run * 1000:6.1f} ms"
+        )
+
+
+def bench_parser():
+    text = generate_program(2000)
+    tokens = RegexLexer("<bench>", text).tokenize()
+    print(f"parser: {len(tokens)} tokens")
+    for name, parser_class in (("recursive", Parser), ("pratt", PrattParser)):
+
+        def parse():
+            tokens.cursor = 0
+            parser_class(tokens).parse()
+
+        elapsed = timed(parse, repeat=3)
+        print(f"  {name:<10} {elapsed * 1000:8.1f} ms")
+
+
+def bench_disk_cache():
+    text = "\n".join(
+        line for line in generate_program(2000).splitlines() if not line.startswith("for")
+    )
+    print(f"disk cache: {len(text)} chars")
+    with tempfile.TemporaryDirectory() as cache_dir:
+
+        def cold():
+            for entry in os.listdir(cache_dir):
+                os.unlink(os.path.join(cache_dir, entry))
+            Lox(cache_dir=cache_dir).run(text)
+
+        uncached = timed(lambda: Lox().run(text), repeat=3)
+        cold_time = timed(cold, repeat=3)
+        Lox(cache_dir=cache_dir).run(text)
+        warm_time = timed(lambda: Lox(cache_dir=cache_dir).run(text), repeat=3)
+        size = sum(os.path.getsize(os.path.join(cache_dir, e)) for e in os.listdir(cache_dir))
+    print(f"  no cache   {uncached * 1000:8.1f} ms")
+    print(f"  cold cache {cold_time * 1000:8.1f} ms")
+    print(f"  warm cache {warm_time * 1000:8.1f} ms  ({size / 1e3:.0f} kB .loxc)")
+
+
+def bench_program_cache():
+    snippets = [
+        "var total = 0; for (var i = 0; i < 3; i = i + 1) total = total + i;",
+        'var greeting = "hello" + " " + "world";',
+        "fun area(w, h) { return w * h; } var a = area(3, 4);",
+    ]
+    runs = 3000
+    print(f"program cache: {runs} runs over {len(snippets)} snippets")
+    for name, entries in (("uncached", 0), ("cached", 128)):
+
+        def run_all():
+            lox = Lox(cache_entries=entries)
+            for i in range(runs):
+                lox.interpreter = Interpreter()
+                lox.run(snippets[i % len(snippets)])
+            return lox
+
+        elapsed = timed(run_all, repeat=3)
+        info = run_all().cache_info()
+        print(
+            f"  {name:<9} {elapsed / runs * 1e6:8.1f} us/run  "
+            f"hits {info.hits} misses {info.misses}"
+        )
+
+
+def node_fields(node):
+    fields = []
+    for cls in type(node).__mro__:
+        fields.extend(getattr(cls, "__slots__", ()))
+    if hasattr(node, "__dict__"):
+        fields.extend(vars(node))
+    return [getattr(node, field) for field in fields if hasattr(node, field)]
+
+
+def walk(nodes):
+    stack = list(nodes)
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, (AST, Stmt)):
+            yield node
+            stack.extend(node_fields(node))
+
+
+def bench_node_memory():
+    text = generate_program(500)
+    lexer = RegexLexer("<bench>", text)
+    tracemalloc.start()
+    tree = Parser(lexer).parse()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    nodes = list(walk(tree))
+    node_bytes = sum(
+        sys.getsizeof(node)
+        + (sys.getsizeof(vars(node)) if hasattr(node, "__dict__") else 0)
+        for node in nodes
+    )
+    print(f"node memory: {len(nodes)} nodes")
+    print(f"  node objects  {node_bytes / len(nodes):6.1f} bytes/node")
+    print(f"  whole tree    {size / len(nodes):6.1f} bytes/node (with tokens)")
+
+
+def generate_nested_program(depth, iterations=20000):
+    # A loop at the bottom of depth nested blocks that reads and writes
+    # variables declared at the top
+    lines = ["{", "var total = 0;", "var step = 1;"]
+    lines.extend("{ var unused = nil;" for _ in range(depth))
+    lines.append(f"var i = 0; while (i < {iterations}) {{")
+    lines.append("total = total + step; i = i + 1; }")
+    lines.extend("}" for _ in range(depth))
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def bench_variable_lookup():
+    print("variable lookup: 20000 iterations")
+    for depth in (0, 4, 16, 64):
+        text = generate_nested_program(depth)
+        tree = Parser(RegexLexer("<bench>", text)).parse()
+        interpreter = Interpreter()
+        program = interpreter.prepare(tree)
+        elapsed = timed(lambda: interpreter.execute(program), repeat=3)
+        print(f"  depth {depth:<3} {elapsed * 1000:8.1f} ms")
+
+
+LOOP_PROGRAM = """
+var total = 0;
+for (var i = 0; i < 100000; i = i + 1) {
+    if (i / 2 > 10 and total != -1) total = total + i * 2 - 1;
+}
+"""
+
+COUNTED_LOOP_PROGRAM = """
+var total = 0;
+for (var i = 0; i < 100000; i = i + 1) total = total + i;
+"""
+
+FIB_PROGRAM = """
+fun fib(n) {
+    if (n < 2) return n;
+    return fib(n - 1) + fib(n - 2);
+}
+fib(18);
+"""
+
+
+BRANCH_PROGRAM = """
+var count = 0;
+var flag = false;
+for (var i = 0; i < 50000; i = i + 1) {
+    var odd = i / 2 != i / 2 - 0.5 + 0.5;
+    if (!flag and i > 10 or i == 3) count = count + 1;
+    if (nil) count = count - 1;
+    else if (odd and !(i < 100)) count = count + 2;
+    flag = !flag;
+}
+"""
+
+
+ARITHMETIC_PROGRAM = """
+var sum = 0;
+var x = 0.5;
+for (var i = 0; i < 40000; i = i + 1) {
+    x = 3.9 * x * (1 - x);
+    sum = sum + (x * x - x / 3) * 2 + i / 7;
+}
+"""
+
+
+def bench_arithmetic():
+    # Tree interpreter on a numeric kernel, where BinOp dispatch dominates
+    tree = PrattParser(RegexLexer("<bench>", ARITHMETIC_PROGRAM)).parse()
+
+    def run():
+        interpreter = Interpreter()
+        interpreter.execute(interpreter.prepare(tree))
+
+    elapsed = timed(run, repeat=3)
+    print(f"arithmetic: 40000 iterations  {elapsed * 1000:8.1f} ms")
+
+
+RECURSIVE_PROGRAMS = (
+    ("fib(20)", FIB_PROGRAM.replace("fib(18);", "fib(20);")),
+    (
+        "ackermann(2, 40)",
+        """
+fun ack(m, n) {
+    if (m == 0) return n + 1;
+    if (n == 0) return ack(m - 1, 1);
+    return ack(m - 1, ack(m, n - 1));
+}
+ack(2, 40);
+""",
+    ),
+    (
+        "nested returns",
+        """
+fun find(limit) {
+    var i = 0;
+    while (true) {
+        if (i >= limit) { { return i; } }
+        i = i + 1;
+    }
+}
+fun sum(n) {
+    if (n == 0) return 0;
+    return find(3) + sum(n - 1);
+}
+for (var i = 0; i < 300; i = i + 1) sum(50);
+""",
+    ),
+    (
+        "tail calls",
+        """
+fun count(n, total) {
+    if (n == 0) return total;
+    return count(n - 1, total + n);
+}
+for (var i = 0; i < 200; i = i + 1) count(150, 0);
+""",
+    ),
+)
+
+
+def bench_recursion():
+    for label, text in RECURSIVE_PROGRAMS:
+        tree = PrattParser(RegexLexer("<bench>", text)).parse()
+        print(f"recursion: {label}")
+        for name in ("tree", "closure"):
+
+            def run():
+                interpreter = BACKENDS[name](memo_entries=0)
+                interpreter.execute(interpreter.prepare(tree))
+
+            elapsed = timed(run, repeat=3)
+            print(f"  {name:<8} {elapsed * 1000:8.1f} ms")
+
+
+DEPTH_PROGRAM = """
+fun depth(n) {
+    if (n == 0) return 0;
+    return depth(n - 1) + 1;
+}
+for (var i = 0; i < REPEAT; i = i + 1) depth(DEPTH);
+"""
+
+
+def bench_deep_recursion():
+    # Per-call cost of non-tail recursion; only the vm gets past Python's
+    # recursion limit
+    cases = [(name, 100, 100) for name in BACKENDS] + [("vm", 5000, 3)]
+    print("deep recursion")
+    for name, depth, repeat in cases:
+        text = DEPTH_PROGRAM.replace("REPEAT", str(repeat)).replace("DEPTH", str(depth))
+        tree = PrattParser(RegexLexer("<bench>", text)).parse()
+
+        def run():
+            interpreter = BACKENDS[name](memo_entries=0)
+            interpreter.execute(interpreter.prepare(tree))
+
+        elapsed = timed(run, repeat=3)
+        per_call = elapsed / (depth * repeat) * 1e6
+        print(f"  {name:<8} depth {depth:<5} {per_call:6.2f} us/call")
+
+
+CALL_PROGRAMS = (
+    (
+        "lox function",
+        """
+fun add(a, b) { return a + b; }
+for (var i = 0; i < 50000; i = i + 1) add(i, 1);
+""",
+    ),
+    ("native function", "for (var i = 0; i < 50000; i = i + 1) clock();"),
+)
+
+EMPTY_LOOP_PROGRAM = "for (var i = 0; i < 50000; i = i + 1) i;"
+
+
+def time_backends(text, repeat=7):
+    # Benchmarks time the backends themselves, so recursive functions are
+    # not memoized, here and wherever else a program recurses
+    tree = PrattParser(RegexLexer("<bench>", text)).parse()
+    times = {}
+    for name, interpreter_class in BACKENDS.items():
+
+        def run():
+            interpreter = interpreter_class(memo_entries=0)
+            interpreter.execute(interpreter.prepare(tree))
+
+        times[name] = timed(run, repeat=repeat)
+    return times
+
+
+def bench_calls():
+    # Per-call latency, less the cost of the loop making the calls
+    print("calls: 50000 per program")
+    loop_times = time_backends(EMPTY_LOOP_PROGRAM)
+    for label, text in CALL_PROGRAMS:
+        print(f"  {label}")
+        for name, elapsed in time_backends(text).items():
+            per_call = (elapsed - loop_times[name]) / 50000 * 1e6
+            print(f"    {name:<8} {per_call:6.2f} us/call")
+
+
+def count_environments(tree):
+    # Runs tree on the tree interpreter, counting Environment allocations
+    # and the depth of every resolved local lookup
+    stats = {"environments": 0, "lookups": 0, "depth": 0}
+    init, get_at, assign_at = (
+        Environment.__init__,
+        Environment.get_at,
+        Environment.assign_at,
+    )
+
+    def counting_init(self, *args):
+        stats["environments"] += 1
+        init(self, *args)
+
+    def counting_get_at(self, depth, slot):
+        stats["lookups"] += 1
+        stats["depth"] += depth
+        return get_at(self, depth, slot)
+
+    def counting_assign_at(self, depth, slot, value):
+        stats["lookups"] += 1
+        stats["depth"] += depth
+        return assign_at(self, depth, slot, value)
+
+    Environment.__init__ = counting_init
+    Environment.get_at = counting_get_at
+    Environment.assign_at = counting_assign_at
+    try:
+        interpreter = Interpreter(memo_entries=0)
+        interpreter.execute(interpreter.prepare(tree))
+    finally:
+        Environment.__init__ = init
+        Environment.get_at = get_at
+        Environment.assign_at = assign_at
+    return stats
+
+
+def bench_environments():
+    programs = (
+        ("loop", LOOP_PROGRAM),
+        ("counted loop", COUNTED_LOOP_PROGRAM),
+        ("branches", BRANCH_PROGRAM),
+        ("fib(18)", FIB_PROGRAM),
+    )
+    print("environments (tree backend)")
+    for label, text in programs:
+        tree = PrattParser(RegexLexer("<bench>", text)).parse()
+        stats = count_environments(tree)
+
+        def run():
+            interpreter = Interpreter(memo_entries=0)
+            interpreter.execute(interpreter.prepare(tree))
+
+        elapsed = timed(run, repeat=3)
+        depth = stats["depth"] / max(stats["lookups"], 1)
+        print(
+            f"  {label:<13} {stats['environments']:7} environments"
+            f"  {depth:4.2f} avg lookup depth  {elapsed * 1000:8.1f} ms"
+        )
+
+
+def count_allocations(interpreter_class, tree):
+    # Runs tree, returning the interpreter and its Environment allocations
+    count = 0
+    init = Environment.__init__
+
+    def counting_init(self, *args, **kwargs):
+        nonlocal count
+        count += 1
+        init(self, *args, **kwargs)
+
+    Environment.__init__ = counting_init
+    try:
+        interpreter = interpreter_class(memo_entries=0)
+        interpreter.execute(interpreter.prepare(tree))
+    finally:
+        Environment.__init__ = init
+    return interpreter, count
+
+
+FRAME_PROGRAMS = (
+    ("calls", 50000, CALL_PROGRAMS[0][1]),
+    ("fib(18)", 8361, FIB_PROGRAM),
+)
+
+
+def bench_frame_pool():
+    # Environment allocations per Lox call with frames taken from the pool
+    print("frame pool")
+    for label, calls, text in FRAME_PROGRAMS:
+        tree = PrattParser(RegexLexer("<bench>", text)).parse()
+        print(f"  {label} ({calls} calls)")
+        for name in ("tree", "closure"):
+            interpreter_class = BACKENDS[name]
+            interpreter, count = count_allocations(interpreter_class, tree)
+            info = interpreter.pool.info()
+            hit_rate = info.hits / max(info.hits + info.misses, 1)
+
+            def run():
+                interpreter = interpreter_class(memo_entries=0)
+                interpreter.execute(interpreter.prepare(tree))
+
+            elapsed = timed(run, repeat=3)
+            print(
+                f"    {name:<8} {count / calls:6.4f} allocations/call"
+                f"  {hit_rate:6.1%} pool hits  {elapsed * 1000:8.1f} ms"
+            )
+
+
+CLOSURE_PROGRAMS = (
+    (
+        "counter",
+        """
+fun counter() { var n = 0; fun increment() { n = n + 1; } return increment; }
+var increment = counter();
+for (var i = 0; i < 20000; i = i + 1) increment();
+""",
+        """
+var n = 0;
+fun increment() { n = n + 1; }
+for (var i = 0; i < 20000; i = i + 1) increment();
+""",
+    ),
+    (
+        "callback",
+        """
+fun each(n, f) { for (var i = 0; i < n; i = i + 1) f(i); }
+fun sum(n) { var total = 0; fun add(x) { total = total + x; } each(n, add); }
+sum(20000);
+""",
+        """
+fun each(n, f) { for (var i = 0; i < n; i = i + 1) f(i); }
+var total = 0;
+fun add(x) { total = total + x; }
+fun sum(n) { each(n, add); }
+sum(20000);
+""",
+    ),
+)
+
+
+def generate_closure_chain(length):
+    # Keeps length closures alive, each capturing one of eight locals of the
+    # call that created it
+    return f"""
+fun link(previous) {{
+    var a = 1; var b = 2; var c = 3; var d = 4;
+    var e = 5; var f = 6; var g = 7; var h = 8;
+    fun get() {{ return previous; }}
+    return get;
+}}
+var chain = nil;
+for (var i = 0; i < {length}; i = i + 1) chain = link(chain);
+"""
+
+
+def traced_size(interpreter_class, text):
+    tree = PrattParser(RegexLexer("<bench>", text)).parse()
+    tracemalloc.start()
+    interpreter = interpreter_class()
+    interpreter.execute(interpreter.prepare(tree))
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size
+
+
+def bench_closures():
+    # Closures against the workaround of keeping their state in globals
+    for label, closure, hoisted in CLOSURE_PROGRAMS:
+        print(f"closures: {label}, 20000 calls")
+        closure_times = time_backends(closure, repeat=3)
+        hoisted_times = time_backends(hoisted, repeat=3)
+        for name in BACKENDS:
+            print(
+                f"  {name:<8} closure {closure_times[name] * 1000:7.1f} ms"
+                f"  globals {hoisted_times[name] * 1000:7.1f} ms"
+            )
+    print("closures: memory per live closure")
+    for name, interpreter_class in BACKENDS.items():
+        short = traced_size(interpreter_class, generate_closure_chain(10))
+        long = traced_size(interpreter_class, generate_closure_chain(2010))
+        print(f"  {name:<8} {(long - short) / 2000:7.1f} bytes")
+
+
+GLOBAL_PROGRAMS = (
+    (
+        "fib(20)",
+        21891,
+        """
+fun fib(n) {
+    if (n < 2) return n;
+    return fib(n - 1) + fib(n - 2);
+}
+fib(20);
+""",
+    ),
+    (
+        "global counter",
+        20000,
+        """
+var count = 0;
+fun bump() { count = count + 1; }
+for (var i = 0; i < 20000; i = i + 1) bump();
+""",
+    ),
+)
+
+
+def bench_globals():
+    # Calls of top-level functions, which look the function up as a global
+    # at every call
+    for label, calls, text in GLOBAL_PROGRAMS:
+        print(f"globals: {label}, {calls} calls")
+        for name, elapsed in time_backends(text, repeat=5).items():
+            print(
+                f"  {name:<8} {elapsed * 1000:7.1f} ms"
+                f"  {elapsed / calls * 1e6:6.2f} us/call"
+            )
+
+
+def bench_backends():
+    programs = (
+        ("loop", LOOP_PROGRAM),
+        ("counted loop", COUNTED_LOOP_PROGRAM),
+        ("branches", BRANCH_PROGRAM),
+        ("fib(18)", FIB_PROGRAM),
+    )
+    for label, text in programs:
+        tree = PrattParser(RegexLexer("<bench>", text)).parse()
+        print(f"backends: {label}")
+        baseline = None
+        for name, interpreter_class in BACKENDS.items():
+
+            def run():
+                interpreter = interpreter_class(memo_entries=0)
+                interpreter.execute(interpreter.prepare(tree))
+
+            elapsed = timed(run, repeat=3)
+            baseline = baseline or elapsed
+            print(f"  {name:<8} {elapsed * 1000:8.1f} ms  {baseline / elapsed:5.1f}x")
+
+
+MEMO_PROGRAMS = (
+    (
+        "fib(n)",
+        (10, 15, 20),
+        """
+fun fib(n) {
+    if (n < 2) return n;
+    return fib(n - 1) + fib(n - 2);
+}
+fib(SIZE);
+""",
+    ),
+    (
+        "paths(n, n)",
+        (4, 6, 8),
+        """
+fun paths(x, y) {
+    if (x == 0 or y == 0) return 1;
+    return paths(x - 1, y) + paths(x, y - 1);
+}
+paths(SIZE, SIZE);
+""",
+    ),
+)
+
+
+def bench_memoization():
+    # The same unchanged programs with automatic memoization off and on.
+    # Memoized, every distinct call runs once: fib makes n + 1 of them and
+    # paths (n + 1)^2, where the plain calls grow exponentially.
+    for label, sizes, text in MEMO_PROGRAMS:
+        print(f"memoization: {label}, ms without / with")
+        for size in sizes:
+            source = text.replace("SIZE", str(size))
+            tree = PrattParser(RegexLexer("<bench>", source)).parse()
+            row = []
+            for name, interpreter_class in BACKENDS.items():
+                times = []
+                for entries in (0, MEMO_ENTRIES):
+
+                    def run():
+                        interpreter = interpreter_class(memo_entries=entries)
+                        interpreter.execute(interpreter.prepare(tree))
+
+                    times.append(timed(run, repeat=3) * 1000)
+                row.append(f"{name} {times[0]:7.1f} / {times[1]:4.2f}")
+            print(f"  n = {size:<3} " + "  ".join(row))
+
+
+BENCHMARKS = {
+    "lexer": bench_lexer,
+    "token_memory": bench_token_memory,
+    "phases": bench_phases,
+    "file_input": bench_file_input,
+    "interning": bench_interning,
+    "node_memory": bench_node_memory,
+    "parser": bench_parser,
+    "disk_cache": bench_disk_cache,
+    "program_cache": bench_program_cache,
+    "variable_lookup": bench_variable_lookup,
+    "backends": bench_backends,
+    "arithmetic": bench_arithmetic,
+    "recursion": bench_recursion,
+    "deep_recursion": bench_deep_recursion,
+    "environments": bench_environments,
+    "calls": bench_calls,
+    "frame_pool": bench_frame_pool,
+    "closures": bench_closures,
+    "globals": bench_globals,
+    "memoization": bench_memoization,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
@@ -0,0 +1,412 @@
+from lexer import (
+    TT_BANG_EQUAL,
+    TT_EQUAL_EQUAL,
+    TT_KEYWORD,
+    TT_LESS,
+    TT_LESS_EQUAL,
+    TT_PLUS,
+    TT_MINUS,
+    TT_MUL,
+    TT_DIV,
+    TT_GREATER,
+    TT_GREATER_EQUAL,
+)
+from node_visitor import NodeVisitor
+from parser import AST
+from resolver import FrameLayout
+
+OP_CONSTANT = 0
+OP_POP = 1
+OP_GET_GLOBAL = 2
+OP_SET_GLOBAL = 3
+OP_DEFINE_GLOBAL = 4
+OP_GET_LOCAL = 5
+OP_SET_LOCAL = 6
+OP_STORE_LOCAL = 7
+OP_DEFINE_LOCAL = 8
+OP_ADD = 9
+OP_SUBTRACT = 10
+OP_MULTIPLY = 11
+OP_DIVIDE = 12
+OP_GREATER = 13
+OP_GREATER_EQUAL = 14
+OP_LESS = 15
+OP_LESS_EQUAL = 16
+OP_EQUAL = 17
+OP_NOT_EQUAL = 18
+OP_NEGATE = 19
+OP_NOT = 20
+OP_JUMP = 21
+OP_JUMP_IF_FALSE = 22
+OP_JUMP_IF_FALSE_OR_POP = 23
+OP_JUMP_IF_TRUE_OR_POP = 24
+OP_PRINT = 25
+OP_CALL = 26
+OP_FUNCTION = 27
+OP_RETURN = 28
+OP_HALT = 29
+OP_CHECK_CALLABLE = 30
+OP_TAIL_CALL = 31
+OP_GET_UPVALUE = 32
+OP_SET_UPVALUE = 33
+OP_GET_CELL = 34
+OP_SET_CELL = 35
+OP_BOX = 36
+
+OPCODE_NAMES = {
+    value: name[3:] for name, value in globals().items() if name.startswith("OP_")
+}
+
+# Number of operands following each opcode in Chunk.code
+OPERANDS = {op: 0 for op in OPCODE_NAMES}
+OPERANDS.update(
+    {
+        op: 1
+        for op in (
+            OP_CONSTANT,
+            OP_GET_GLOBAL,
+            OP_SET_GLOBAL,
+            OP_DEFINE_GLOBAL,
+            OP_GET_LOCAL,
+            OP_SET_LOCAL,
+            OP_STORE_LOCAL,
+            OP_DEFINE_LOCAL,
+            OP_JUMP,
+            OP_JUMP_IF_FALSE,
+            OP_JUMP_IF_FALSE_OR_POP,
+            OP_JUMP_IF_TRUE_OR_POP,
+            OP_CALL,
+            OP_TAIL_CALL,
+            OP_FUNCTION,
+            OP_GET_UPVALUE,
+            OP_SET_UPVALUE,
+            OP_GET_CELL,
+            OP_SET_CELL,
+        )
+    }
+)
+
+BINARY_OPS = {
+    TT_PLUS: OP_ADD,
+    TT_MINUS: OP_SUBTRACT,
+    TT_MUL: OP_MULTIPLY,
+    TT_DIV: OP_DIVIDE,
+    TT_GREATER: OP_GREATER,
+    TT_GREATER_EQUAL: OP_GREATER_EQUAL,
+    TT_LESS: OP_LESS,
+    TT_LESS_EQUAL: OP_LESS_EQUAL,
+    TT_EQUAL_EQUAL: OP_EQUAL,
+    TT_BANG_EQUAL: OP_NOT_EQUAL,
+}
+
+
+class Chunk:
+    # code holds opcodes and their operands in one flat list. tokens runs
+    # parallel to it as the line table: the entry at an opcode is the token
+    # a runtime error there is reported at. captures has a (local, index)
+    # pair per upvalue of a function: FUNCTION takes its cell from that
+    # frame index of the running frame when local is true, and from the
+    # running function's upvalues otherwise. caches runs parallel to code
+    # too: GET_GLOBAL and SET_GLOBAL keep the cell they found at their own
+    # index and the globals version it was found at at their operand's.
+    __slots__ = (
+        "name",
+        "declaration",
+        "code",
+        "tokens",
+        "constants",
+        "frame_size",
+        "captures",
+        "caches",
+    )
+
+    def __init__(self, name, declaration=None):
+        self.name = name
+        self.declaration = declaration
+        self.code = []
+        self.tokens = []
+        self.constants = []
+        self.frame_size = 0
+        self.captures = ()
+        self.caches = None
+
+
+class Compiler(NodeVisitor):
+    # Compiles resolved trees into Chunks, with one flat frame of local slots
+    # per function
+    def __init__(self):
+        self.chunk = None
+        self.constant_index = None
+        self.layout = None
+
+    def compile(self, declarations, name="<script>"):
+        enclosing = self.begin(Chunk(name))
+        try:
+            declarations = list(declarations)
+            for node in declarations[:-1]:
+                self.statement(node)
+            if declarations and isinstance(declarations[-1], AST):
+                self.visit(declarations[-1])
+            else:
+                if declarations:
+                    self.visit(declarations[-1])
+                self.emit_constant(None)
+            self.emit(OP_HALT)
+            self.chunk.frame_size = self.layout.size
+            self.chunk.caches = [None] * len(self.chunk.code)
+            return self.chunk
+        finally:
+            self.end(enclosing)
+
+    def begin(self, chunk):
+        enclosing = (self.chunk, self.constant_index, self.layout)
+        self.chunk = chunk
+        self.constant_index = {}
+        self.layout = FrameLayout()
+        return enclosing
+
+    def end(self, enclosing):
+        self.chunk, self.constant_index, self.layout = enclosing
+
+    def emit(self, op, token=None):
+        self.chunk.code.append(op)
+        self.chunk.tokens.append(token)
+        return len(self.chunk.code) - 1
+
+    def emit_operand(self, op, operand, token=None):
+        self.emit(op, token)
+        return self.emit(operand)
+
+    def emit_constant(self, value, token=None):
+        self.emit_operand(OP_CONSTANT, self.make_constant(value), token)
+
+    def make_constant(self, value):
+        key = (type(value), value)
+        index = self.constant_index.get(key)
+        if index is None:
+            index = self.constant_index[key] = len(self.chunk.constants)
+            self.chunk.constants.append(value)
+        return index
+
+    def patch_jump(self, operand):
+        self.chunk.code[operand] = len(self.chunk.code)
+
+    def declare(self, slot, token):
+        index, first = self.layout.declare(slot)
+        self.emit_operand(OP_STORE_LOCAL if first else OP_DEFINE_LOCAL, index, token)
+
+    def statement(self, node):
+        self.visit(node)
+        if isinstance(node, AST):
+            self.emit(OP_POP)
+
+    def visit_Num(self, node):
+        self.emit_constant(node.token.value, node.token)
+
+    visit_String = visit_Num
+
+    def visit_Nil(self, node):
+        self.emit_constant(None, node.token)
+
+    def visit_Boolean(self, node):
+        self.emit_constant(node.token.value == "true", node.token)
+
+    def visit_Identifier(self, node):
+        if node.upvalue is not None:
+            self.emit_operand(OP_GET_UPVALUE, node.upvalue, node.token)
+        elif node.depth is None:
+            name = self.make_constant(node.token.value)
+            self.emit_operand(OP_GET_GLOBAL, name, node.token)
+        else:
+            index = self.layout.index(node.depth, node.slot)
+            op = OP_GET_CELL if node.boxed else OP_GET_LOCAL
+            self.emit_operand(op, index, node.token)
+
+    def visit_Assign(self, node):
+        self.visit(node.right)
+        left = node.left
+        if left.upvalue is not None:
+            self.emit_operand(OP_SET_UPVALUE, left.upvalue, left.token)
+        elif left.depth is None:
+            name = self.make_constant(left.token.value)
+            self.emit_operand(OP_SET_GLOBAL, name, left.token)
+        else:
+            index = self.layout.index(left.depth, left.slot)
+            op = OP_SET_CELL if left.boxed else OP_SET_LOCAL
+            self.emit_operand(op, index, left.token)
+
+    def visit_BinOp(self, node):
+        self.visit(node.left)
+        self.visit(node.right)
+        self.emit(BINARY_OPS[node.op.type], node.token)
+
+    def visit_UnaryOp(self, node):
+        self.visit(node.expr)
+        if node.op.type == TT_MINUS:
+            self.emit(OP_NEGATE, node.expr.token)
+        else:
+            self.emit(OP_NOT)
+
+    def visit_Logical(self, node):
+        self.visit(node.left)
+        if node.op.matches(TT_KEYWORD, "or"):
+            jump = self.emit_operand(OP_JUMP_IF_TRUE_OR_POP, None)
+        else:
+            jump = self.emit_operand(OP_JUMP_IF_FALSE_OR_POP, None)
+        self.visit(node.right)
+        self.patch_jump(jump)
+
+    def visit_Call(self, node, op=OP_CALL):
+        self.visit(node.callee)
+        # The callee is checked before any argument runs, as in the tree walker
+        self.emit(OP_CHECK_CALLABLE, node.callee.token)
+        for argument in node.arguments:
+            self.visit(argument)
+        arity_token = node.arguments[0].token if node.arguments else node.paren
+        self.emit_operand(op, len(node.arguments), arity_token)
+
+    def visit_PrintStmt(self, node):
+        self.visit(node.expr)
+        self.emit(OP_PRINT)
+
+    def visit_VarStmt(self, node):
+        if node.expr:
+            self.visit(node.expr)
+        else:
+            self.emit_constant(None, node.token)
+        if node.slot is None:
+            name = self.make_constant(node.token.value)
+            self.emit_operand(OP_DEFINE_GLOBAL, name, node.token)
+        else:
+            if node.boxed:
+                self.emit(OP_BOX)
+            self.declare(node.slot, node.token)
+
+    def visit_Block(self, node):
+        if node.size:
+            self.layout.push(node.size)
+        for stmt in node.statements:
+            self.statement(stmt)
+        if node.size:
+            self.layout.pop()
+
+    def visit_IfStmt(self, node):
+        self.visit(node.condition)
+        else_jump = self.emit_operand(OP_JUMP_IF_FALSE, None)
+        self.statement(node.then_stmt)
+        if node.else_stmt is not None:
+            end_jump = self.emit_operand(OP_JUMP, None)
+            self.patch_jump(else_jump)
+            self.statement(node.else_stmt)
+            self.patch_jump(end_jump)
+        else:
+            self.patch_jump(else_jump)
+
+    def visit_WhileStmt(self, node):
+        start = len(self.chunk.code)
+        self.visit(node.condition)
+        exit_jump = self.emit_operand(OP_JUMP_IF_FALSE, None)
+        self.statement(node.body)
+        self.emit_operand(OP_JUMP, start)
+        self.patch_jump(exit_jump)
+
+    def visit_ForStmt(self, node):
+        if node.size:
+            self.layout.push(node.size)
+        if node.initializer is not None:
+            self.statement(node.initializer)
+        start = len(self.chunk.code)
+        exit_jump = None
+        if node.condition is not None:
+            self.visit(node.condition)
+            exit_jump = self.emit_operand(OP_JUMP_IF_FALSE, None)
+        self.statement(node.body)
+        if node.increment is not None:
+            self.statement(node.increment)
+        self.emit_operand(OP_JUMP, start)
+        if exit_jump is not None:
+            self.patch_jump(exit_jump)
+        if node.size:
+            self.layout.pop()
+
+    def visit_ReturnStmt(self, node):
+        if node.tail_call:
+            # TAIL_CALL replaces the current frame when calling Lox code; a
+            # native callee returns to the RETURN below
+            self.visit_Call(node.value, OP_TAIL_CALL)
+        elif node.value is not None:
+            self.visit(node.value)
+        else:
+            self.emit_constant(None)
+        self.emit(OP_RETURN)
+
+    def visit_Function(self, node):
+        chunk = Chunk(node.name.value, node)
+        enclosing = self.begin(chunk)
+        try:
+            self.layout.push(node.size, node.param_slots)
+            # Parameters are the first slots of the frame
+            for slot in node.boxed_params:
+                self.emit_operand(OP_GET_LOCAL, slot)
+                self.emit(OP_BOX)
+                self.emit_operand(OP_STORE_LOCAL, slot)
+            for stmt in node.body:
+                self.statement(stmt)
+            self.emit_constant(None)
+            self.emit(OP_RETURN)
+            chunk.frame_size = self.layout.size
+            chunk.caches = [None] * len(chunk.code)
+        finally:
+            self.end(enclosing)
+        chunk.captures = tuple(
+            (False, slot) if depth is None else (True, self.layout.index(depth, slot))
+            for _, depth, slot in node.upvalues
+        )
+
+        if node.slot is None:
+            self.emit_operand(OP_FUNCTION, self.make_constant(chunk), node.name)
+            name = self.make_constant(node.name.value)
+            self.emit_operand(OP_DEFINE_GLOBAL, name, node.name)
+        elif node.boxed:
+            # The cell exists before the closure, which may capture it
+            self.emit_constant(None)
+            self.emit(OP_BOX)
+            self.declare(node.slot, node.name)
+            self.emit_operand(OP_FUNCTION, self.make_constant(chunk), node.name)
+            index = self.layout.index(0, node.slot)
+            self.emit_operand(OP_SET_CELL, index)
+            self.emit(OP_POP)
+        else:
+            self.emit_operand(OP_FUNCTION, self.make_constant(chunk), node.name)
+            self.declare(node.slot, node.name)
+
+
+def disassemble(chunk):
+    lines = [f"== {chunk.name} =="]
+    functions = []
+    code = chunk.code
+    ip = 0
+    previous_line = None
+    while ip < len(code):
+        op = code[ip]
+        token = chunk.tokens[ip]
+        # Instructions without a token of their own belong to the line above
+        line = token.pos_start.ln + 1 if token is not None else previous_line
+        column = "   |" if line == previous_line else f"{line:4}"
+        previous_line = line
+        text = f"{ip:04} {column} {OPCODE_NAMES[op]}"
+        if OPERANDS[op]:
+            operand = code[ip + 1]
+            text = f"{text:<30} {operand}"
+            if op in (OP_CONSTANT, OP_GET_GLOBAL, OP_SET_GLOBAL, OP_DEFINE_GLOBAL):
+                text += f" ({chunk.constants[operand]!r})"
+            elif op == OP_FUNCTION:
+                function = chunk.constants[operand]
+                text += f" (<fn {function.name}>)"
+                functions.append(function)
+        lines.append(text)
+        ip += 1 + OPERANDS[op]
+    for function in functions:
+        lines.append("")
+        lines.append(disassemble(function))
+    return "\n".join(lines)
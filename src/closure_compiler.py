@@ -0,0 +1,582 @@
+import operator
+from environment import UNDEFINED, Cell
+from interpreter import (
+    EQUALITY_TYPES,
+    Interpreter,
+    arithmetic_error,
+    arity_error,
+    stack_overflow,
+    stringify,
+)
+from lexer import (
+    TT_EQUAL_EQUAL,
+    TT_KEYWORD,
+    TT_LESS,
+    TT_LESS_EQUAL,
+    TT_PLUS,
+    TT_MINUS,
+    TT_MUL,
+    TT_DIV,
+    TT_GREATER,
+    TT_GREATER_EQUAL,
+    RETURN,
+    ErrorDetails,
+    RTError,
+)
+from lox_callable import (
+    MEMO_ENTRIES,
+    LoxCallable,
+    LoxFunction,
+    MemoizedFunction,
+    NativeFunction,
+)
+from node_visitor import NodeVisitor
+
+COMPARISONS = {
+    TT_GREATER: operator.gt,
+    TT_GREATER_EQUAL: operator.ge,
+    TT_LESS: operator.lt,
+    TT_LESS_EQUAL: operator.le,
+}
+
+
+class CompiledFunction(LoxFunction):
+    def __init__(self, declaration, body, upvalues=()):
+        super().__init__(declaration, upvalues)
+        self.body = body
+
+    def call(self, interpreter, arguments):
+        function = self
+        pool = interpreter.pool
+        upvalues = interpreter.upvalues
+        try:
+            while True:
+                padding = function.padding
+                if padding is not None:
+                    slots = arguments + padding
+                    environment = pool.acquire(interpreter.globals, slots)
+                else:
+                    environment = function.bind_parameters(interpreter, arguments)
+                    slots = environment.slots
+                for slot in function.declaration.boxed_params:
+                    slots[slot] = Cell(slots[slot])
+                interpreter.upvalues = function.upvalues
+                for stmt in function.body:
+                    if stmt(environment) is RETURN:
+                        pool.release(environment)
+                        break
+                else:
+                    pool.release(environment)
+                    return None
+                if interpreter.tail_call is None:
+                    return interpreter.return_value
+                function, arguments = interpreter.tail_call
+                interpreter.tail_call = None
+        finally:
+            interpreter.upvalues = upvalues
+
+
+class ClosureCompiler(NodeVisitor):
+    # Turns each resolved node into a Python closure taking the current
+    # Environment. Operators, variable addresses and constants are looked at
+    # once here, so running the closures does no dispatch on node types.
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.globals = interpreter.globals
+
+    def compile_block(self, statements):
+        return tuple(self.visit(stmt) for stmt in statements)
+
+    def visit_Num(self, node):
+        value = node.token.value
+        return lambda env: value
+
+    visit_String = visit_Num
+
+    def visit_Nil(self, node):
+        return lambda env: None
+
+    def visit_Boolean(self, node):
+        value = node.token.value == "true"
+        return lambda env: value
+
+    def visit_Identifier(self, node):
+        token = node.token
+        slot = node.slot
+        depth = node.depth
+
+        if node.upvalue is not None:
+            index = node.upvalue
+            interpreter = self.interpreter
+            return lambda env: interpreter.upvalues[index].value
+
+        if node.boxed:
+
+            def load_cell(env):
+                for _ in range(depth):
+                    env = env.enclosing
+                return env.slots[slot].value
+
+            return load_cell
+
+        if depth is None:
+            name = token.value
+            table = self.globals
+            cell = version = None
+
+            def load_global(env):
+                nonlocal cell, version
+                if version != table.version:
+                    cell = table.cell(token, name)
+                    version = table.version
+                return cell.value
+
+            return load_global
+
+        if depth == 0:
+            return lambda env: env.slots[slot]
+
+        def load_enclosing(env):
+            for _ in range(depth):
+                env = env.enclosing
+            return env.slots[slot]
+
+        return load_enclosing
+
+    def visit_Assign(self, node):
+        right = self.visit(node.right)
+        token = node.left.token
+        slot = node.left.slot
+        depth = node.left.depth
+
+        if node.left.upvalue is not None:
+            index = node.left.upvalue
+            interpreter = self.interpreter
+
+            def store_upvalue(env):
+                value = right(env)
+                interpreter.upvalues[index].value = value
+                return value
+
+            return store_upvalue
+
+        if node.left.boxed:
+
+            def store_cell(env):
+                value = right(env)
+                for _ in range(depth):
+                    env = env.enclosing
+                env.slots[slot].value = value
+                return value
+
+            return store_cell
+
+        if depth is None:
+            name = token.value
+            table = self.globals
+            cell = version = None
+
+            def store_global(env):
+                nonlocal cell, version
+                value = right(env)
+                if version != table.version:
+                    cell = table.cell(token, name)
+                    version = table.version
+                cell.value = value
+                return value
+
+            return store_global
+
+        def store_local(env):
+            value = right(env)
+            for _ in range(depth):
+                env = env.enclosing
+            env.slots[slot] = value
+            return value
+
+        return store_local
+
+    def visit_BinOp(self, node):
+        left = self.visit(node.left)
+        right = self.visit(node.right)
+        token = node.token
+        op = node.op.type
+        check_types = self.interpreter.check_types
+
+        if op == TT_PLUS:
+
+            def add(env):
+                a = left(env)
+                b = right(env)
+                if type(a) is type(b) and (type(a) is float or type(a) is str):
+                    return a + b
+                check_types(token, a, b)
+                return a + b
+
+            return add
+
+        if op == TT_MINUS:
+
+            def subtract(env):
+                a = left(env)
+                b = right(env)
+                if type(a) is not float or type(b) is not float:
+                    raise arithmetic_error(token)
+                return a - b
+
+            return subtract
+
+        if op == TT_MUL:
+
+            def multiply(env):
+                a = left(env)
+                b = right(env)
+                if type(a) is not float or type(b) is not float:
+                    raise arithmetic_error(token)
+                return a * b
+
+            return multiply
+
+        if op == TT_DIV:
+
+            def divide(env):
+                a = left(env)
+                b = right(env)
+                if type(a) is not float or type(b) is not float:
+                    raise arithmetic_error(token)
+                if b == 0:
+                    raise RTError(
+                        token.pos_start, token.pos_end, ErrorDetails.DIVISION_BY_ZERO
+                    )
+                return a / b
+
+            return divide
+
+        if op in COMPARISONS:
+            compare = COMPARISONS[op]
+
+            def comparison(env):
+                a = left(env)
+                b = right(env)
+                if type(a) is not float or type(b) is not float:
+                    raise arithmetic_error(token)
+                return compare(a, b)
+
+            return comparison
+
+        equal = op == TT_EQUAL_EQUAL
+
+        def equality(env):
+            a = left(env)
+            b = right(env)
+            if type(a) is not type(b):
+                check_types(token, a, b, True)
+                return not equal
+            if type(a) not in EQUALITY_TYPES:
+                check_types(token, a, b, True)
+            return (a == b) is equal
+
+        return equality
+
+    def visit_UnaryOp(self, node):
+        expr = self.visit(node.expr)
+
+        if node.op.type == TT_MINUS:
+            token = node.expr.token
+
+            def negate(env):
+                value = expr(env)
+                if type(value) is not float:
+                    raise arithmetic_error(token)
+                return -value
+
+            return negate
+
+        def logical_not(env):
+            value = expr(env)
+            return value is None or value is False
+
+        return logical_not
+
+    def visit_Logical(self, node):
+        left = self.visit(node.left)
+        right = self.visit(node.right)
+
+        if node.op.matches(TT_KEYWORD, "or"):
+
+            def logical_or(env):
+                value = left(env)
+                if value is not None and value is not False:
+                    return value
+                return right(env)
+
+            return logical_or
+
+        def logical_and(env):
+            value = left(env)
+            if value is None or value is False:
+                return value
+            return right(env)
+
+        return logical_and
+
+    def visit_Call(self, node, tail=False):
+        callee = self.visit(node.callee)
+        arguments = self.compile_block(node.arguments)
+        callee_token = node.callee.token
+        error_token = node.arguments[0].token if node.arguments else node.paren
+        interpreter = self.interpreter
+
+        def call(env):
+            function = callee(env)
+            if type(function) is not CompiledFunction and not isinstance(
+                function, LoxCallable
+            ):
+                raise RTError(
+                    callee_token.pos_start,
+                    callee_token.pos_end,
+                    ErrorDetails.CALLS_RESTRICTION,
+                )
+            values = [argument(env) for argument in arguments]
+            if len(values) != function.param_count:
+                raise arity_error(error_token, function.param_count, len(values))
+            try:
+                if type(function) is CompiledFunction:
+                    return function.call(interpreter, values)
+                if isinstance(function, NativeFunction):
+                    return function.function(*values)
+                return function.call(interpreter, values)
+            except RecursionError:
+                raise stack_overflow(error_token) from None
+
+        def tail_call(env):
+            function = callee(env)
+            if type(function) is not CompiledFunction and not isinstance(
+                function, LoxCallable
+            ):
+                raise RTError(
+                    callee_token.pos_start,
+                    callee_token.pos_end,
+                    ErrorDetails.CALLS_RESTRICTION,
+                )
+            values = [argument(env) for argument in arguments]
+            if len(values) != function.param_count:
+                raise arity_error(error_token, function.param_count, len(values))
+            if type(function) is MemoizedFunction:
+                function = function.function
+            if type(function) is CompiledFunction:
+                interpreter.tail_call = (function, values)
+            else:
+                try:
+                    interpreter.return_value = function.call(interpreter, values)
+                except RecursionError:
+                    raise stack_overflow(error_token) from None
+            return RETURN
+
+        return tail_call if tail else call
+
+    def visit_PrintStmt(self, node):
+        expr = self.visit(node.expr)
+
+        def print_stmt(env):
+            print(stringify(expr(env)))
+
+        return print_stmt
+
+    def visit_VarStmt(self, node):
+        expr = self.visit(node.expr) if node.expr else (lambda env: None)
+        token = node.token
+
+        if node.slot is None:
+            name = token.value
+            environment = self.globals
+
+            def define_global(env):
+                environment.define(name, expr(env), token)
+
+            return define_global
+
+        slot = node.slot
+
+        if node.boxed:
+
+            def define_cell(env):
+                env.define_at(slot, Cell(expr(env)), token)
+
+            return define_cell
+
+        def define_local(env):
+            env.define_at(slot, expr(env), token)
+
+        return define_local
+
+    def visit_Block(self, node):
+        statements = self.compile_block(node.statements)
+        size = node.size
+
+        if not size:
+
+            def unscoped_block(env):
+                for stmt in statements:
+                    if stmt(env) is RETURN:
+                        return RETURN
+
+            return unscoped_block
+
+        pool = self.interpreter.pool
+
+        def block(env):
+            env = pool.acquire(env, [UNDEFINED] * size)
+            for stmt in statements:
+                if stmt(env) is RETURN:
+                    pool.release(env)
+                    return RETURN
+            pool.release(env)
+
+        return block
+
+    def visit_IfStmt(self, node):
+        condition = self.visit(node.condition)
+        then_stmt = self.visit(node.then_stmt)
+        else_stmt = self.visit(node.else_stmt) if node.else_stmt else None
+
+        def if_stmt(env):
+            value = condition(env)
+            if value is not None and value is not False:
+                if then_stmt(env) is RETURN:
+                    return RETURN
+            elif else_stmt is not None:
+                if else_stmt(env) is RETURN:
+                    return RETURN
+
+        return if_stmt
+
+    def visit_WhileStmt(self, node):
+        condition = self.visit(node.condition)
+        body = self.visit(node.body)
+
+        def while_stmt(env):
+            while True:
+                value = condition(env)
+                if value is None or value is False:
+                    break
+                if body(env) is RETURN:
+                    return RETURN
+
+        return while_stmt
+
+    def visit_ForStmt(self, node):
+        initializer = self.visit(node.initializer) if node.initializer else None
+        condition = self.visit(node.condition) if node.condition else None
+        increment = self.visit(node.increment) if node.increment else None
+        body = self.visit(node.body)
+        size = node.size
+        pool = self.interpreter.pool
+
+        def for_stmt(env):
+            completion = None
+            if size:
+                env = pool.acquire(env, [UNDEFINED] * size)
+            if initializer is not None:
+                initializer(env)
+            while True:
+                if condition is not None:
+                    value = condition(env)
+                    if value is None or value is False:
+                        break
+                if body(env) is RETURN:
+                    completion = RETURN
+                    break
+                if increment is not None:
+                    increment(env)
+            if size:
+                pool.release(env)
+            return completion
+
+        return for_stmt
+
+    def visit_ReturnStmt(self, node):
+        if node.tail_call:
+            return self.visit_Call(node.value, tail=True)
+
+        value = self.visit(node.value) if node.value is not None else None
+        interpreter = self.interpreter
+
+        def return_stmt(env):
+            interpreter.return_value = value(env) if value is not None else None
+            return RETURN
+
+        return return_stmt
+
+    def visit_Function(self, node):
+        token = node.name
+        slot = node.slot
+        body = self.compile_block(node.body)
+
+        if slot is None:
+            name = token.value
+            environment = self.globals
+            interpreter = self.interpreter
+
+            def define_global(env):
+                function = interpreter.memoized(CompiledFunction(node, body))
+                environment.define(name, function, token)
+
+            return define_global
+
+        capture = self.capture(node)
+
+        if node.boxed:
+
+            def define_cell(env):
+                # The cell exists before the closure, which may capture it
+                cell = Cell(None)
+                env.define_at(slot, cell, token)
+                cell.value = CompiledFunction(node, body, capture(env))
+
+            return define_cell
+
+        def define_local(env):
+            env.define_at(slot, CompiledFunction(node, body, capture(env)), token)
+
+        return define_local
+
+    def capture(self, node):
+        # Returns a closure copying the cells a new function uses from the
+        # running scope
+        upvalues = node.upvalues
+        interpreter = self.interpreter
+
+        if not upvalues:
+            return lambda env: ()
+
+        def capture(env):
+            cells = interpreter.upvalues
+            return [
+                cells[slot] if depth is None else env.ancestor(depth).slots[slot]
+                for _, depth, slot in upvalues
+            ]
+
+        return capture
+
+
+class ClosureInterpreter(Interpreter):
+    def __init__(self, memo_entries=MEMO_ENTRIES):
+        super().__init__(memo_entries)
+        self.compiler = ClosureCompiler(self)
+
+    def interpret_declarations(self, declarations):
+        result = None
+        for node in declarations:
+            self.resolver.visit(node)
+            result = self.complete(self.compiler.visit(node)(self.globals))
+        return result
+
+    def prepare(self, tree):
+        return self.compiler.compile_block(self.resolver.resolve(tree))
+
+    def execute(self, program):
+        result = None
+        for node in program:
+            result = self.complete(node(self.globals))
+        return result
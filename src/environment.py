@@ -1,31 +1,139 @@
+from collections import namedtuple
+from itertools import count
 from lexer import ErrorDetails, RTError
 
 
+class Undefined:
+    __slots__ = ()
+
+    def __repr__(self):
+        return "<undefined>"
+
+
+# Marks a slot whose declaration has not run yet; None is Lox's nil
+UNDEFINED = Undefined()
+
+
+class Cell:
+    # Holds a local captured by a closure. The declaring scope and every
+    # closure over the variable share the cell, never the environment.
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __repr__(self):
+        return f"<cell {self.value!r}>"
+
+
+# Versions of global tables all come from this counter, so no two tables
+# ever share a version
+VERSIONS = count()
+
+
 class Environment:
-    def __init__(self, enclosing=None):
-        self.values = dict()
+    __slots__ = ("values", "enclosing", "slots", "version")
+
+    def __init__(self, enclosing=None, size=0, slots=None):
+        # Globals are kept by name in values, locals live in slots at the
+        # index the resolver gave them and have no values dict. Calls pass
+        # in slots already holding the arguments.
+        self.values = dict() if enclosing is None else None
         self.enclosing = enclosing
+        self.slots = [UNDEFINED] * size if slots is None else slots
+        self.version = next(VERSIONS) if enclosing is None else None
 
-    def define(self, name, value, pos_start, pos_end):
-        if name in self.values:
-            raise RTError(pos_start, pos_end, f"Variable '{name}' already defined")
-        self.values[name] = value
+    # The methods by name are for the globals, which hold a Cell per name.
+    # version changes whenever a global is defined, so a use of a global
+    # can keep the cell it found along with the version it found it at,
+    # and read the cell directly for as long as the version matches.
+    # Positions for errors are taken from the token only when an error is
+    # raised, so successful lookups allocate nothing
 
-    def assign(self, name, value, pos_start, pos_end):
+    def define(self, name, value, token):
         if name in self.values:
-            self.values[name] = value
-            return
-        if self.enclosing is not None:
-            self.enclosing.assign(name, value, pos_start, pos_end)
-            return
-        raise RTError(pos_start, pos_end, f"{ErrorDetails.UNDEFINED_VARIABLE.value} '{name}'")
-
-    def get(self, pos_start, pos_end, name):
-        if self.values.get(name) is not None:
-            return self.values[name]
-        if self.enclosing is not None:
-            return self.enclosing.get(pos_start, pos_end, name)
-        raise RTError(pos_start, pos_end, f"{ErrorDetails.UNDEFINED_VARIABLE.value} '{name}'")
+            raise RTError(
+                token.pos_start, token.pos_end, f"Variable '{name}' already defined"
+            )
+        self.values[name] = Cell(value)
+        self.version = next(VERSIONS)
+
+    def assign(self, name, value, token):
+        self.cell(token, name).value = value
+
+    def get(self, token, name):
+        return self.cell(token, name).value
+
+    def cell(self, token, name):
+        cell = self.values.get(name)
+        if cell is None:
+            raise RTError(
+                token.pos_start,
+                token.pos_end,
+                f"{ErrorDetails.UNDEFINED_VARIABLE.value} '{name}'",
+            )
+        return cell
+
+    def ancestor(self, depth):
+        environment = self
+        for _ in range(depth):
+            environment = environment.enclosing
+        return environment
+
+    def define_at(self, slot, value, token):
+        if self.slots[slot] is not UNDEFINED:
+            raise RTError(
+                token.pos_start,
+                token.pos_end,
+                f"Variable '{token.value}' already defined",
+            )
+        self.slots[slot] = value
+
+    def assign_at(self, depth, slot, value):
+        self.ancestor(depth).slots[slot] = value
+
+    def get_at(self, depth, slot):
+        # The resolver only binds a name to a slot after its declaration, so
+        # a resolved read never finds the slot undefined
+        return self.ancestor(depth).slots[slot]
 
     def __repr__(self):
-        return str(self.values)
+        return str({name: cell.value for name, cell in self.values.items()})
+
+
+PoolInfo = namedtuple("PoolInfo", "hits misses free")
+
+
+class EnvironmentPool:
+    # Free list of local environments. Nothing in Lox can keep a reference
+    # to an Environment once its scope exits: functions run on the globals
+    # and capture the Cells of the variables they use, never the
+    # environment they are declared in. So every block and call frame is
+    # released when its scope completes normally; frames abandoned by a
+    # runtime error are left to the garbage collector.
+    def __init__(self, limit=256):
+        self.free = []
+        self.limit = limit
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, enclosing, slots):
+        free = self.free
+        if free:
+            self.hits += 1
+            environment = free.pop()
+            environment.enclosing = enclosing
+            environment.slots = slots
+            return environment
+        self.misses += 1
+        return Environment(enclosing, slots=slots)
+
+    def release(self, environment):
+        if len(self.free) < self.limit:
+            # Drop the values so pooled frames do not keep them alive
+            environment.enclosing = None
+            environment.slots = None
+            self.free.append(environment)
+
+    def info(self):
+        return PoolInfo(self.hits, self.misses, len(self.free))
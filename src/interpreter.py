@@ -1,4 +1,5 @@
-from environment import Environment
+import operator
+from environment import UNDEFINED, Cell, Environment, EnvironmentPool
 from lexer import (
     TT_BANG,
     TT_BANG_EQUAL,
@@ -15,122 +16,303 @@ from lexer import (
     ErrorDetails,
 )
 
-from lexer import RTError, Return
-from lox_callable import LoxCallable, LoxFunction, Clock
+from lexer import RETURN, RTError, Return
+from lox_callable import (
+    MEMO_ENTRIES,
+    Clock,
+    LoxCallable,
+    LoxFunction,
+    MemoizedFunction,
+    NativeFunction,
+)
+from node_visitor import NodeVisitor
+from resolver import Resolver
 
+# Lox values are Python values: numbers are floats, strings are str, nil is
+# None and booleans are True and False
+NIL_OR_BOOL = (type(None), bool)
+EQUALITY_TYPES = frozenset((float, str, bool, type(None)))
 
-class NodeVisitor(object):
-    def visit(self, node):
-        method_name = "visit_" + type(node).__name__
-        visitor = getattr(self, method_name, self.generic_visit)
-        return visitor(node)
 
-    def generic_visit(self, node):
-        raise Exception(f"No visit_{type(node).__name__} method")
+def stringify(value):
+    if value is None:
+        return "nil"
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    return str(value)
 
 
-class Interpreter(NodeVisitor):
-    def __init__(self):
-        self.globals = Environment()
-        # TODO position for native functions: None?
-        self.globals.define("clock", Clock(), None, None)
-        self.environment = self.globals
+def is_equal(a, b):
+    # True == 1.0 in Python, so values of different types are never equal
+    return type(a) is type(b) and a == b
 
-    def is_truthy(self, value):
-        if value == None or value == "nil" or value == "false":
-            return False
+
+def undefined_variable(token):
+    return RTError(
+        token.pos_start,
+        token.pos_end,
+        f"{ErrorDetails.UNDEFINED_VARIABLE.value} '{token.value}'",
+    )
+
+
+def already_defined(token):
+    return RTError(
+        token.pos_start, token.pos_end, f"Variable '{token.value}' already defined"
+    )
+
+
+def arithmetic_error(token):
+    return RTError(
+        token.pos_start,
+        token.pos_end,
+        ErrorDetails.CAN_APPLY_ARITHMETIC_OPERATIONS_ONLY_TO_NUMBERS,
+    )
+
+
+def arity_error(token, expected, got):
+    return RTError(
+        token.pos_start,
+        token.pos_end,
+        f"Expected {expected} arguments, but got {got}.",
+    )
+
+
+def stack_overflow(token):
+    return RTError(token.pos_start, token.pos_end, ErrorDetails.STACK_OVERFLOW)
+
+
+def check_types(token, v1, v2, equality_operation=False):
+    # Numbers and strings combine with their own type; equality also
+    # accepts nil and booleans against numbers, strings, nil and booleans
+    t1 = type(v1)
+    t2 = type(v2)
+    if t1 is t2 and (t1 is float or t1 is str):
+        return True
+    if (
+        equality_operation
+        and t1 in EQUALITY_TYPES
+        and t2 in EQUALITY_TYPES
+        and (t1 in NIL_OR_BOOL or t2 in NIL_OR_BOOL)
+    ):
         return True
 
-    def check_types(self, pos_start, pos_end, v1, v2, equality_operation=False):
-        allowed_types = ["nil", "false", "true"]
+    raise RTError(token.pos_start, token.pos_end, ErrorDetails.BINARY_OPS_TYPE_ERROR)
+
+
+# Binary operators in the tree interpreter are quickened per BinOp site. A
+# site starts with the generic handler of its operator, which checks types
+# like check_types does. After QUICKEN_THRESHOLD runs in a row with the same
+# operand type the site switches to a handler specialised for that type, and
+# a specialised handler that sees other types switches back. Sites that keep
+# changing types stay generic after MAX_DEOPTS switches back.
+QUICKEN_THRESHOLD = 8
+MAX_DEOPTS = 4
+
+
+def record(node, operand_type):
+    if node.seen is operand_type:
+        node.hits += 1
+        if node.hits >= QUICKEN_THRESHOLD and node.deopts < MAX_DEOPTS:
+            handler = SPECIALIZED_HANDLERS[node.op.type].get(operand_type)
+            if handler is not None:
+                node.handler = handler
+    else:
+        node.seen = operand_type
+        node.hits = 1
+
+
+def deoptimize(node, a, b):
+    handler = node.handler = GENERIC_HANDLERS[node.op.type]
+    node.seen = None
+    node.deopts += 1
+    return handler(node, a, b)
+
+
+def add(node, a, b):
+    check_types(node.op, a, b)
+    record(node, type(a))
+    return a + b
+
+
+def numeric(operate):
+    def handler(node, a, b):
+        if type(a) is not float or type(b) is not float:
+            raise arithmetic_error(node.op)
+        record(node, float)
+        return operate(a, b)
+
+    return handler
+
+
+def divide(node, a, b):
+    if type(a) is not float or type(b) is not float:
+        raise arithmetic_error(node.op)
+    if b == 0:
+        raise RTError(node.op.pos_start, node.op.pos_end, ErrorDetails.DIVISION_BY_ZERO)
+    record(node, float)
+    return a / b
+
+
+def equal(node, a, b):
+    check_types(node.op, a, b, True)
+    record(node, type(a) if type(a) is type(b) else None)
+    return is_equal(a, b)
+
+
+def not_equal(node, a, b):
+    check_types(node.op, a, b, True)
+    record(node, type(a) if type(a) is type(b) else None)
+    return not is_equal(a, b)
+
+
+def add_numbers(node, a, b):
+    if type(a) is float and type(b) is float:
+        return a + b
+    return deoptimize(node, a, b)
+
+
+def add_strings(node, a, b):
+    if type(a) is str and type(b) is str:
+        return a + b
+    return deoptimize(node, a, b)
+
+
+def subtract_numbers(node, a, b):
+    if type(a) is float and type(b) is float:
+        return a - b
+    return deoptimize(node, a, b)
+
+
+def multiply_numbers(node, a, b):
+    if type(a) is float and type(b) is float:
+        return a * b
+    return deoptimize(node, a, b)
+
+
+def divide_numbers(node, a, b):
+    if type(a) is float and type(b) is float and b != 0:
+        return a / b
+    return deoptimize(node, a, b)
+
+
+def greater_numbers(node, a, b):
+    if type(a) is float and type(b) is float:
+        return a > b
+    return deoptimize(node, a, b)
+
+
+def greater_equal_numbers(node, a, b):
+    if type(a) is float and type(b) is float:
+        return a >= b
+    return deoptimize(node, a, b)
+
 
-        if isinstance(v1, float):
-            if isinstance(v2, float):
-                return True
-            if equality_operation and v2 in allowed_types:
-                return True
+def less_numbers(node, a, b):
+    if type(a) is float and type(b) is float:
+        return a < b
+    return deoptimize(node, a, b)
 
-        if isinstance(v2, float):
-            if equality_operation and v1 in allowed_types:
-                return True
 
-        if isinstance(v1, str):
-            if isinstance(v2, str):
-                return True
-            if equality_operation and v2 in allowed_types:
-                return True
+def less_equal_numbers(node, a, b):
+    if type(a) is float and type(b) is float:
+        return a <= b
+    return deoptimize(node, a, b)
 
-        if isinstance(v2, str):
-            if equality_operation and v1 in allowed_types:
-                return True
 
-        if equality_operation and v1 in allowed_types and v2 in allowed_types:
-            return True
+def equal_numbers(node, a, b):
+    if type(a) is float and type(b) is float:
+        return a == b
+    return deoptimize(node, a, b)
 
-        raise RTError(pos_start, pos_end, ErrorDetails.BINARY_OPS_TYPE_ERROR)
+
+def equal_strings(node, a, b):
+    if type(a) is str and type(b) is str:
+        return a == b
+    return deoptimize(node, a, b)
+
+
+def not_equal_numbers(node, a, b):
+    if type(a) is float and type(b) is float:
+        return a != b
+    return deoptimize(node, a, b)
+
+
+def not_equal_strings(node, a, b):
+    if type(a) is str and type(b) is str:
+        return a != b
+    return deoptimize(node, a, b)
+
+
+GENERIC_HANDLERS = {
+    TT_PLUS: add,
+    TT_MINUS: numeric(operator.sub),
+    TT_MUL: numeric(operator.mul),
+    TT_DIV: divide,
+    TT_GREATER: numeric(operator.gt),
+    TT_GREATER_EQUAL: numeric(operator.ge),
+    TT_LESS: numeric(operator.lt),
+    TT_LESS_EQUAL: numeric(operator.le),
+    TT_EQUAL_EQUAL: equal,
+    TT_BANG_EQUAL: not_equal,
+}
+
+SPECIALIZED_HANDLERS = {
+    TT_PLUS: {float: add_numbers, str: add_strings},
+    TT_MINUS: {float: subtract_numbers},
+    TT_MUL: {float: multiply_numbers},
+    TT_DIV: {float: divide_numbers},
+    TT_GREATER: {float: greater_numbers},
+    TT_GREATER_EQUAL: {float: greater_equal_numbers},
+    TT_LESS: {float: less_numbers},
+    TT_LESS_EQUAL: {float: less_equal_numbers},
+    TT_EQUAL_EQUAL: {float: equal_numbers, str: equal_strings},
+    TT_BANG_EQUAL: {float: not_equal_numbers, str: not_equal_strings},
+}
+
+
+class Interpreter(NodeVisitor):
+    def __init__(self, memo_entries=MEMO_ENTRIES):
+        self.globals = Environment()
+        self.pool = EnvironmentPool()
+        # Results kept per memoized function; 0 turns memoization off
+        self.memo_entries = memo_entries
+        # TODO position for native functions: None?
+        self.globals.define("clock", Clock(), None)
+        self.globals.define("memoize", NativeFunction(self.memoize, 1), None)
+        self.environment = self.globals
+        # The upvalue cells of the running function
+        self.upvalues = ()
+        self.resolver = Resolver()
+        self.return_value = None
+        # The function and arguments of a pending call in tail position
+        self.tail_call = None
+
+    def is_truthy(self, value):
+        return value is not None and value is not False
+
+    check_types = staticmethod(check_types)
 
     def visit_BinOp(self, node):
         left = self.visit(node.left)
         right = self.visit(node.right)
-        pos_start = node.token.pos_start
-        pos_end = node.token.pos_end
-
-        if node.op.type == TT_PLUS:
-            self.check_types(pos_start, pos_end, left, right)
-            return left + right
-
-        if node.op.type in (
-            TT_MINUS,
-            TT_MUL,
-            TT_DIV,
-            TT_GREATER,
-            TT_GREATER_EQUAL,
-            TT_LESS,
-            TT_LESS_EQUAL,
-        ):
-            if not isinstance(left, float) or not isinstance(right, float):
-                raise RTError(
-                    pos_start,
-                    pos_end,
-                    ErrorDetails.CAN_APPLY_ARITHMETIC_OPERATIONS_ONLY_TO_NUMBERS,
-                )
-
-            if node.op.type == TT_MINUS:
-                return left - right
-            elif node.op.type == TT_MUL:
-                return left * right
-            elif node.op.type == TT_DIV:
-                if right == 0:
-                    raise RTError(pos_start, pos_end, ErrorDetails.DIVISION_BY_ZERO)
-                else:
-                    return left / right
-            elif node.op.type == TT_GREATER:
-                return "true" if left > right else "false"
-            elif node.op.type == TT_GREATER_EQUAL:
-                return "true" if left >= right else "false"
-            elif node.op.type == TT_LESS:
-                return "true" if left < right else "false"
-            elif node.op.type == TT_LESS_EQUAL:
-                return "true" if left <= right else "false"
-
-        self.check_types(pos_start, pos_end, left, right, True)
-
-        if node.op.type == TT_EQUAL_EQUAL:
-            return "true" if left == right else "false"
-        if node.op.type == TT_BANG_EQUAL:
-            return "true" if left != right else "false"
+        handler = node.handler
+        if handler is None:
+            handler = node.handler = GENERIC_HANDLERS[node.op.type]
+        return handler(node, left, right)
 
     def visit_Num(self, node):
-        return node.value
+        return node.token.value
 
     def visit_String(self, node):
-        return node.value
+        return node.token.value
 
     def visit_Nil(self, node):
-        return node.value
+        return None
 
     def visit_Boolean(self, node):
-        return node.value
+        return node.token.value == "true"
 
     def visit_UnaryOp(self, node):
         op = node.op.type
@@ -145,7 +327,7 @@ class Interpreter(NodeVisitor):
                 )
             return -result
         if op == TT_BANG:
-            return "true" if not self.is_truthy(result) else "false"
+            return not self.is_truthy(result)
 
     def visit_Logical(self, node):
         left = self.visit(node.left)
@@ -159,102 +341,236 @@ class Interpreter(NodeVisitor):
 
     def visit_PrintStmt(self, node):
         result = self.visit(node.expr)
-        print(result)
+        print(stringify(result))
         return None
 
     def visit_VarStmt(self, stmt):
-        value = "nil"
+        value = None
         if stmt.expr:
             value = self.visit(stmt.expr)
-        self.environment.define(
-            stmt.token.value, value, stmt.token.pos_start, stmt.token.pos_end
-        )
+        if stmt.slot is None:
+            self.globals.define(stmt.token.value, value, stmt.token)
+        else:
+            if stmt.boxed:
+                value = Cell(value)
+            self.environment.define_at(stmt.slot, value, stmt.token)
         return None
 
     def visit_IfStmt(self, node):
         condition = self.visit(node.condition)
         if self.is_truthy(condition):
-            self.visit(node.then_stmt)
+            if self.visit(node.then_stmt) is RETURN:
+                return RETURN
         elif node.else_stmt is not None:
-            self.visit(node.else_stmt)
+            if self.visit(node.else_stmt) is RETURN:
+                return RETURN
         return None
 
     def visit_WhileStmt(self, node):
         while self.is_truthy(self.visit(node.condition)):
-            self.visit(node.body)
+            if self.visit(node.body) is RETURN:
+                return RETURN
         return None
 
+    def visit_ForStmt(self, node):
+        # At most one environment for the whole loop, holding the
+        # initializer's variable; the body gets its own only if it declares
+        previous_env = environment = self.environment
+        completion = None
+        try:
+            if node.size:
+                environment = self.pool.acquire(previous_env, [UNDEFINED] * node.size)
+                self.environment = environment
+            if node.initializer is not None:
+                self.visit(node.initializer)
+            condition = node.condition
+            increment = node.increment
+            body = node.body
+            while condition is None or self.is_truthy(self.visit(condition)):
+                if self.visit(body) is RETURN:
+                    completion = RETURN
+                    break
+                if increment is not None:
+                    self.visit(increment)
+        finally:
+            self.environment = previous_env
+        if environment is not previous_env:
+            self.pool.release(environment)
+        return completion
+
     def visit_ReturnStmt(self, node):
         value = None
-        if node.value is not None:
+        if node.tail_call:
+            function, arguments = self.evaluate_call(node.value)
+            if type(function) is MemoizedFunction:
+                # A tail call runs in place, without the memo table
+                function = function.function
+            if type(function) is LoxFunction:
+                # The returning LoxFunction.call runs the callee in its place
+                self.tail_call = (function, arguments)
+                return RETURN
+            value = function.call(self, arguments)
+        elif node.value is not None:
             value = self.visit(node.value)
-        raise Return(value)
+        self.return_value = value
+        return RETURN
 
     def execute_Block(self, statements, environment):
         previous_env = self.environment
         try:
             self.environment = environment
             for stmt in statements:
-                self.visit(stmt)
+                if self.visit(stmt) is RETURN:
+                    return RETURN
+            return None
         finally:
             self.environment = previous_env
 
     def visit_Block(self, node):
-        self.execute_Block(node.statements, Environment(self.environment))
-        return None
+        if not node.size:
+            for stmt in node.statements:
+                if self.visit(stmt) is RETURN:
+                    return RETURN
+            return None
+        environment = self.pool.acquire(self.environment, [UNDEFINED] * node.size)
+        completion = self.execute_Block(node.statements, environment)
+        self.pool.release(environment)
+        return completion
 
     def visit_Assign(self, node):
-        var_name = node.left.value
+        left = node.left
         value = self.visit(node.right)
-        self.environment.assign(
-            var_name, value, node.left.token.pos_start, node.left.token.pos_end
-        )
+        if left.depth is None:
+            if left.upvalue is not None:
+                self.upvalues[left.upvalue].value = value
+            elif left.version == self.globals.version:
+                left.cell.value = value
+            else:
+                self.global_cell(left).value = value
+        elif left.boxed:
+            self.environment.get_at(left.depth, left.slot).value = value
+        else:
+            self.environment.assign_at(left.depth, left.slot, value)
         return value
 
     def visit_Identifier(self, node):
-        return self.environment.get(
-            node.token.pos_start, node.token.pos_end, node.value
-        )
+        if node.depth is None:
+            if node.upvalue is not None:
+                return self.upvalues[node.upvalue].value
+            if node.version == self.globals.version:
+                return node.cell.value
+            return self.global_cell(node).value
+        if node.boxed:
+            return self.environment.get_at(node.depth, node.slot).value
+        return self.environment.get_at(node.depth, node.slot)
+
+    def global_cell(self, node):
+        # Looks a global up by name and caches its cell at the use; the
+        # cache holds until the next global is defined
+        globals = self.globals
+        node.cell = globals.cell(node.token, node.token.value)
+        node.version = globals.version
+        return node.cell
 
     def visit_Call(self, node):
+        function, arguments = self.evaluate_call(node)
+        try:
+            if type(function) is LoxFunction:
+                return function.call(self, arguments)
+            if isinstance(function, NativeFunction):
+                return function.function(*arguments)
+            return function.call(self, arguments)
+        except RecursionError:
+            # Lox calls nest Python calls here, so Python's recursion limit
+            # is the Lox stack limit
+            raise stack_overflow(
+                node.arguments[0].token if node.arguments else node.paren
+            ) from None
+
+    def evaluate_call(self, node):
         function = self.visit(node.callee)
-        if not isinstance(function, LoxCallable):
+        if type(function) is not LoxFunction and not isinstance(function, LoxCallable):
             raise RTError(
                 node.callee.token.pos_start,
                 node.callee.token.pos_end,
                 ErrorDetails.CALLS_RESTRICTION,
             )
-        arguments = []
-        for argument in node.arguments:
-            arguments.append(self.visit(argument))
-        if len(arguments) != function.arity():
-            if node.arguments:
-                raise RTError(
-                    node.arguments[0].token.pos_start,
-                    node.arguments[0].token.pos_end,
-                    f"Expected {function.arity()} arguments, but got {len(arguments)}.",
-                )
-            else:
-                raise RTError(
-                    node.paren.pos_start,
-                    node.paren.pos_end,
-                    f"Expected {function.arity()} arguments, but got {len(arguments)}.",
-                )
-        return function.call(self, arguments)
+        visit = self.visit
+        arguments = [visit(argument) for argument in node.arguments]
+        if len(arguments) != function.param_count:
+            token = node.arguments[0].token if node.arguments else node.paren
+            raise arity_error(token, function.param_count, len(arguments))
+        return function, arguments
 
     def visit_Function(self, stmt):
-        function = LoxFunction(stmt)
-        self.environment.define(
-            stmt.name.value, function, stmt.name.pos_start, stmt.name.pos_end
-        )
+        if stmt.slot is None:
+            function = self.memoized(LoxFunction(stmt))
+            self.globals.define(stmt.name.value, function, stmt.name)
+        elif stmt.boxed:
+            # The cell exists before the closure, which may capture it
+            cell = Cell(None)
+            self.environment.define_at(stmt.slot, cell, stmt.name)
+            cell.value = LoxFunction(stmt, self.capture(stmt))
+        else:
+            function = LoxFunction(stmt, self.capture(stmt))
+            self.environment.define_at(stmt.slot, function, stmt.name)
         return None
 
+    def memoized(self, function):
+        # Global functions the resolver found pure cache their results once
+        # they turn out to be recursive, which a function calling nothing
+        # never is
+        declaration = function.declaration
+        if not self.memo_entries or not declaration.pure or not declaration.calls:
+            return function
+        return MemoizedFunction(function, self.memo_entries, automatic=True)
+
+    def memoize(self, function):
+        # The memoize native. Anything but a function is returned as it is,
+        # so calling it fails where it would have without memoize.
+        if not isinstance(function, LoxCallable):
+            return function
+        return MemoizedFunction(function, self.memo_entries)
+
+    def capture(self, stmt):
+        # Copies the cells a new closure uses from the running scope
+        if not stmt.upvalues:
+            return ()
+        upvalues = self.upvalues
+        environment = self.environment
+        return [
+            upvalues[slot] if depth is None else environment.get_at(depth, slot)
+            for _, depth, slot in stmt.upvalues
+        ]
+
     def interpret(self, parser):
         self.parser = parser
 
         tree = self.parser.parse()
-        if not tree:
-            return None
+        return self.interpret_declarations(tree)
+
+    def interpret_declarations(self, declarations):
+        # Top-level declarations resolve independently of each other, so a
+        # streamed program can be resolved one declaration at a time
+        result = None
+        for node in declarations:
+            self.resolver.visit(node)
+            result = self.complete(self.visit(node))
+        return result
+
+    def prepare(self, tree):
+        # Turns a parsed program into what execute runs; compiling backends
+        # return their compiled form so cached programs compile only once
+        return self.resolver.resolve(tree)
+
+    def execute(self, tree):
+        result = None
         for node in tree:
-            result = self.visit(node)
+            result = self.complete(self.visit(node))
+        return result
+
+    def complete(self, result):
+        # A return outside any function ends the script with Return
+        if result is RETURN:
+            raise Return(self.return_value)
         return result
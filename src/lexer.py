@@ -1,5 +1,9 @@
+from array import array
+from bisect import bisect_right
 from enum import Enum
+import re
 import string
+import sys
 
 DIGITS = "1234567890"
 LETTERS = string.ascii_letters
@@ -30,6 +34,67 @@ TT_GREATER = "GREATER"
 TT_EQUAL_EQUAL = "EQUAL_EQUAL"
 TT_COMMA = "COMMA"
 
+# Token types by their one-byte code in a TokenBuffer
+TOKEN_TYPES = (
+    TT_NUMBER,
+    TT_STRING,
+    TT_PLUS,
+    TT_MINUS,
+    TT_MUL,
+    TT_DIV,
+    TT_EQ,
+    TT_LPAREN,
+    TT_RPAREN,
+    TT_LBRACE,
+    TT_RBRACE,
+    TT_EOF,
+    TT_KEYWORD,
+    TT_SEMI,
+    TT_IDENTIFIER,
+    TT_BANG_EQUAL,
+    TT_BANG,
+    TT_LESS_EQUAL,
+    TT_LESS,
+    TT_GREATER_EQUAL,
+    TT_GREATER,
+    TT_EQUAL_EQUAL,
+    TT_COMMA,
+)
+TOKEN_KINDS = {tok_type: kind for kind, tok_type in enumerate(TOKEN_TYPES)}
+
+OPERATORS = {
+    "+": TT_PLUS,
+    "-": TT_MINUS,
+    "*": TT_MUL,
+    "/": TT_DIV,
+    "(": TT_LPAREN,
+    ")": TT_RPAREN,
+    "{": TT_LBRACE,
+    "}": TT_RBRACE,
+    ";": TT_SEMI,
+    ",": TT_COMMA,
+    "=": TT_EQ,
+    "==": TT_EQUAL_EQUAL,
+    "!": TT_BANG,
+    "!=": TT_BANG_EQUAL,
+    "<": TT_LESS,
+    "<=": TT_LESS_EQUAL,
+    ">": TT_GREATER,
+    ">=": TT_GREATER_EQUAL,
+}
+
+# Leading whitespace, then one alternative per token class
+WHITESPACE_REGEX = re.compile(r"[ \t\n]*")
+TOKEN_REGEX = re.compile(
+    r"[ \t\n]*(?:"
+    r"(?P<COMMENT>//[^\n]*)"
+    r"|(?P<NUMBER>[0-9][0-9.]*)"
+    r"|(?P<IDENTIFIER>[A-Za-z][A-Za-z0-9_]*)"
+    r'|(?P<STRING>"[^"]*"?)'
+    r"|(?P<OPERATOR>[=!<>]=?|[-+*/(){};,])"
+    r")"
+)
+
 KEYWORDS = {
     "print": True,
     "var": True,
@@ -72,6 +137,7 @@ class ErrorDetails(Enum):
     EXPECTED_FUNCTION_NAME =  "Expected function name"
     EXPECTED_PARAMETER_NAME = "Expected parameter name"
     EXPECTED_SEMICOLON = "Expected ';'"
+    STACK_OVERFLOW = "Stack overflow"
 
 
 class Error(Exception):
@@ -82,12 +148,12 @@ class Error(Exception):
         self.details = details
 
     def as_string(self):
-        input_as_rows = self.pos_start.ftxt.split("\n")
-        row_with_error = input_as_rows[self.pos_start.ln]
-        error_prefix = f"   {self.pos_start.ln+1} | "
+        ln, col = self.pos_start.line_col()
+        row_with_error = self.pos_start.source.line(ln)
+        error_prefix = f"   {ln+1} | "
         result = f"{self.error_name}: {self.details.value if isinstance(self.details, ErrorDetails) else self.details}\n\n"
         result += f"{error_prefix}{row_with_error}\n"
-        result += " " * len(error_prefix) + " " * self.pos_start.row_length + "^"
+        result += " " * len(error_prefix) + " " * col + "^"
         return result
 
 
@@ -111,45 +177,112 @@ class Return(Exception):
         self.value = value
 
 
+class ReturnCompletion:
+    __slots__ = ()
+
+    def __repr__(self):
+        return "<return>"
+
+
+# Statements complete with None, or with RETURN after a return statement has
+# stored its value on the interpreter. Blocks, ifs and loops pass RETURN up
+# to the function call instead of raising Return through every Python frame.
+RETURN = ReturnCompletion()
+
+
+class InternTable(dict):
+    # Maps every identifier and string literal to one shared str object,
+    # so names in the AST compare by identity in Environment lookups
+    def __missing__(self, value):
+        value = sys.intern(value)
+        self[value] = value
+        return value
+
+
+class Source:
+    __slots__ = ("fn", "text", "line_starts")
+
+    def __init__(self, fn, text):
+        self.fn = fn
+        self.text = text
+        self.line_starts = None
+
+    def get_line_starts(self):
+        # Built on the first request for a line or column, i.e. on error
+        if self.line_starts is None:
+            line_starts = [0]
+            text = self.text
+            idx = text.find("\n")
+            while idx != -1:
+                line_starts.append(idx + 1)
+                idx = text.find("\n", idx + 1)
+            self.line_starts = line_starts
+        return self.line_starts
+
+    def line_col(self, idx):
+        line_starts = self.get_line_starts()
+        ln = bisect_right(line_starts, idx) - 1
+        return ln, idx - line_starts[ln]
+
+    def line(self, ln):
+        line_starts = self.get_line_starts()
+        if ln + 1 < len(line_starts):
+            return self.text[line_starts[ln] : line_starts[ln + 1] - 1]
+        return self.text[line_starts[ln] :]
+
+
 class Position:
-    def __init__(self, idx, ln, col, fn, ftxt, row_length):
+    __slots__ = ("source", "idx")
+
+    def __init__(self, source, idx):
+        self.source = source
         self.idx = idx
-        self.ln = ln
-        self.col = col
-        self.fn = fn
-        self.ftxt = ftxt
-        self.row_length = row_length
 
-    def advance(self, current_char=None):
-        self.idx += 1
-        self.col += 1
-        self.row_length += 1
+    def line_col(self):
+        return self.source.line_col(self.idx)
 
-        if current_char == "\n":
-            self.ln += 1
-            self.col = 0
-            self.row_length = 0
+    @property
+    def ln(self):
+        return self.line_col()[0]
 
-        return self
+    @property
+    def col(self):
+        return self.line_col()[1]
 
-    def copy(self):
-        return Position(
-            self.idx, self.ln, self.col, self.fn, self.ftxt, self.row_length
-        )
+    @property
+    def row_length(self):
+        return self.col
+
+    @property
+    def fn(self):
+        return self.source.fn
+
+    @property
+    def ftxt(self):
+        return self.source.text
 
 
 class Token:
-    def __init__(self, type, value=None, pos_start=None, pos_end=None):
+    __slots__ = ("type", "value", "start", "end", "source")
+
+    def __init__(self, type, value=None, start=None, end=None, source=None):
         self.type = type
         self.value = value
-
-        if pos_start:
-            self.pos_start = pos_start.copy()
-            self.pos_end = pos_start.copy()
-            self.pos_end.advance()
-
-        if pos_end:
-            self.pos_end = pos_end
+        self.start = start
+        self.end = start + 1 if end is None and start is not None else end
+        self.source = source
+
+    @property
+    def pos_start(self):
+        if self.start is None:
+            return None
+        return Position(self.source, self.start)
+
+    @property
+    def pos_end(self):
+        if self.end is None:
+            return None
+        return Position(self.source, self.end)
 
     def matches(self, type_, value):
         return self.type == type_ and self.value == value
@@ -161,22 +294,35 @@ class Token:
 
 
 class Lexer:
-    def __init__(self, fn, text):
+    def __init__(self, fn, text, interned=None):
         self.fn = fn
         self.text = text
-        self.pos = Position(0, 0, 0, fn, text, 0)
-        self.current_char = self.text[self.pos.idx]
+        self.source = Source(fn, text)
+        self.interned = InternTable() if interned is None else interned
+        self.idx = 0
+        self.current_char = self.text[self.idx]
+
+    def position(self, idx):
+        return Position(self.source, idx)
+
+    def tokenize(self):
+        tokens = TokenBuffer(self.source)
+        try:
+            while True:
+                token = self.get_next_token()
+                tokens.append(token.type, token.value, token.start, token.end)
+                if token.type == TT_EOF:
+                    break
+        except Error as e:
+            tokens.error = e
+        return tokens
 
     def advance(self):
-        self.pos.advance(self.current_char)
-        self.current_char = (
-            self.text[self.pos.idx] if self.pos.idx < len(self.text) else None
-        )
+        self.idx += 1
+        self.current_char = self.text[self.idx] if self.idx < len(self.text) else None
 
     def peek(self):
-        return (
-            self.text[self.pos.idx + 1] if self.pos.idx + 1 < len(self.text) else None
-        )
+        return self.text[self.idx + 1] if self.idx + 1 < len(self.text) else None
 
     def get_next_token(self):
         while self.current_char != None:
@@ -185,17 +331,17 @@ class Lexer:
                 continue
 
             if self.current_char == "+":
-                token = Token(TT_PLUS, "+", self.pos)
+                token = Token(TT_PLUS, "+", self.idx, source=self.source)
                 self.advance()
                 return token
 
             if self.current_char == "-":
-                token = Token(TT_MINUS, "-", self.pos)
+                token = Token(TT_MINUS, "-", self.idx, source=self.source)
                 self.advance()
                 return token
 
             if self.current_char == "*":
-                token = Token(TT_MUL, "*", self.pos)
+                token = Token(TT_MUL, "*", self.idx, source=self.source)
                 self.advance()
                 return token
 
@@ -205,64 +351,66 @@ class Lexer:
                         self.advance()
                     continue
                 else:
-                    token = Token(TT_DIV, "/", self.pos)
+                    token = Token(TT_DIV, "/", self.idx, source=self.source)
                     self.advance()
                     return token
 
             if self.current_char == "(":
-                token = Token(TT_LPAREN, "(", self.pos)
+                token = Token(TT_LPAREN, "(", self.idx, source=self.source)
                 self.advance()
                 return token
 
             if self.current_char == ")":
-                token = Token(TT_RPAREN, ")", self.pos)
+                token = Token(TT_RPAREN, ")", self.idx, source=self.source)
                 self.advance()
                 return token
 
             if self.current_char == "{":
-                token = Token(TT_LBRACE, "{", self.pos)
+                token = Token(TT_LBRACE, "{", self.idx, source=self.source)
                 self.advance()
                 return token
 
             if self.current_char == "}":
-                token = Token(TT_RBRACE, "}", self.pos)
+                token = Token(TT_RBRACE, "}", self.idx, source=self.source)
                 self.advance()
                 return token
 
             if self.current_char == ";":
-                token = Token(TT_SEMI, ";", self.pos)
+                token = Token(TT_SEMI, ";", self.idx, source=self.source)
                 self.advance()
                 return token
 
             if self.current_char == "=":
-                token = Token(TT_EQ, "=", self.pos)
+                token = Token(TT_EQ, "=", self.idx, source=self.source)
                 if self.peek() == "=":
                     self.advance()
-                    token = Token(TT_EQUAL_EQUAL, "==", self.pos)
+                    token = Token(TT_EQUAL_EQUAL, "==", self.idx, source=self.source)
                 self.advance()
                 return token
 
             if self.current_char == "!":
-                token = Token(TT_BANG, "!", self.pos)
+                token = Token(TT_BANG, "!", self.idx, source=self.source)
                 if self.peek() == "=":
                     self.advance()
-                    token = Token(TT_BANG_EQUAL, "!=", self.pos)
+                    token = Token(TT_BANG_EQUAL, "!=", self.idx, source=self.source)
                 self.advance()
                 return token
 
             if self.current_char == "<":
-                token = Token(TT_LESS, "<", self.pos)
+                token = Token(TT_LESS, "<", self.idx, source=self.source)
                 if self.peek() == "=":
                     self.advance()
-                    token = Token(TT_LESS_EQUAL, "<=", self.pos)
+                    token = Token(TT_LESS_EQUAL, "<=", self.idx, source=self.source)
                 self.advance()
                 return token
 
             if self.current_char == ">":
-                token = Token(TT_GREATER, ">", self.pos)
+                token = Token(TT_GREATER, ">", self.idx, source=self.source)
                 if self.peek() == "=":
                     self.advance()
-                    token = Token(TT_GREATER_EQUAL, ">=", self.pos)
+                    token = Token(
+                        TT_GREATER_EQUAL, ">=", self.idx, source=self.source
+                    )
                 self.advance()
                 return token
 
@@ -272,7 +420,7 @@ class Lexer:
 
             if self.current_char == ",":
                 self.advance()
-                return Token(TT_COMMA, ",", self.pos)
+                return Token(TT_COMMA, ",", self.idx, source=self.source)
 
             if self.current_char in DIGITS:
                 number_token, error = self.make_number()
@@ -284,33 +432,41 @@ class Lexer:
                 token = self.make_identifier()
                 return token
 
-            pos_start = self.pos.copy()
+            idx_start = self.idx
             invalid_char = self.current_char
             self.advance()
-            raise IllegalCharError(pos_start, self.pos, "'" + invalid_char + "'")
+            raise IllegalCharError(
+                self.position(idx_start),
+                self.position(self.idx),
+                "'" + invalid_char + "'",
+            )
 
-        return Token(TT_EOF, pos_start=self.pos)
+        return Token(TT_EOF, None, self.idx, source=self.source)
 
     def make_number(self):
         num_str = ""
         dot_count = 0
-        pos_start = self.pos.copy()
+        idx_start = self.idx
 
         while self.current_char != None and self.current_char in DIGITS + ".":
             if self.current_char == ".":
                 if dot_count == 1:
                     # error: too many dots
-                    pos_start = self.pos.copy()
+                    idx_start = self.idx
                     self.advance()
                     return None, InvalidSyntaxError(
-                        pos_start, self.pos, ErrorDetails.TOO_MANY_DOTS
+                        self.position(idx_start),
+                        self.position(self.idx),
+                        ErrorDetails.TOO_MANY_DOTS,
                     )
                 elif len(num_str) == 0:
                     # error: leading dot
-                    pos_start = self.pos.copy()
+                    idx_start = self.idx
                     self.advance()
                     return None, InvalidSyntaxError(
-                        pos_start, self.pos, ErrorDetails.LEADING_DOT
+                        self.position(idx_start),
+                        self.position(self.idx),
+                        ErrorDetails.LEADING_DOT,
                     )
                 else:
                     dot_count += 1
@@ -321,36 +477,297 @@ class Lexer:
 
         if num_str[-1] == ".":
             # error: trailing dot
-            pos_start = self.pos.copy()
+            idx_start = self.idx
             self.advance()
             return None, InvalidSyntaxError(
-                pos_start, self.pos, ErrorDetails.TRAILING_DOT
+                self.position(idx_start),
+                self.position(self.idx),
+                ErrorDetails.TRAILING_DOT,
             )
-        return Token(TT_NUMBER, float(num_str), pos_start, self.pos), None
+        return Token(TT_NUMBER, float(num_str), idx_start, self.idx, self.source), None
 
     def make_identifier(self):
         id_str = ""
-        pos_start = self.pos.copy()
+        idx_start = self.idx
 
         while self.current_char != None and self.current_char in LETTERS_DIGITS + "_":
             id_str += self.current_char
             self.advance()
 
+        id_str = self.interned[id_str]
         tok_type = TT_KEYWORD if KEYWORDS.get(id_str) else TT_IDENTIFIER
-        return Token(tok_type, id_str, pos_start, self.pos)
+        return Token(tok_type, id_str, idx_start, self.idx, self.source)
 
     def make_string(self):
-        pos_start = self.pos.copy()
+        idx_start = self.idx
         while self.current_char not in ['"', None]:
             self.advance()
 
         if self.current_char is None:
-            pos_start = self.pos.copy()
             raise InvalidSyntaxError(
-                pos_start, self.pos, ErrorDetails.UNTERMINATED_STRING
+                self.position(self.idx),
+                self.position(self.idx),
+                ErrorDetails.UNTERMINATED_STRING,
             )
 
         self.advance()
         return Token(
-            TT_STRING, self.text[pos_start.idx : self.pos.idx - 1], pos_start, self.pos
+            TT_STRING,
+            self.interned[self.text[idx_start : self.idx - 1]],
+            idx_start,
+            self.idx,
+            self.source,
+        )
+
+
+class TokenBuffer:
+    def __init__(self, source):
+        self.source = source
+        self.kinds = array("B")
+        self.starts = array("l")
+        self.ends = array("l")
+        self.value_ids = array("l")
+        self.values = [None]
+        self.value_index = {None: 0}
+        self.error = None
+        self.cursor = 0
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def append(self, type_, value, start, end):
+        value_id = self.value_index.get(value)
+        if value_id is None:
+            value_id = self.value_index[value] = len(self.values)
+            self.values.append(value)
+        self.kinds.append(TOKEN_KINDS[type_])
+        self.starts.append(start)
+        self.ends.append(end)
+        self.value_ids.append(value_id)
+
+    def type_at(self, idx):
+        return TOKEN_TYPES[self.kinds[idx]]
+
+    def token_at(self, idx):
+        return Token(
+            TOKEN_TYPES[self.kinds[idx]],
+            self.values[self.value_ids[idx]],
+            self.starts[idx],
+            self.ends[idx],
+            self.source,
         )
+
+    def peek_type(self, offset=0):
+        idx = self.cursor + offset
+        if idx >= len(self.kinds):
+            if self.error is not None:
+                return None
+            idx = len(self.kinds) - 1
+        return TOKEN_TYPES[self.kinds[idx]]
+
+    def get_next_token(self):
+        idx = self.cursor
+        if idx < len(self.kinds):
+            self.cursor = idx + 1
+        elif self.error is not None:
+            # A lexing error is raised only when the parser reaches it, so
+            # syntax errors before it are reported first as with Lexer
+            raise self.error
+        else:
+            idx -= 1
+        return Token(
+            TOKEN_TYPES[self.kinds[idx]],
+            self.values[self.value_ids[idx]],
+            self.starts[idx],
+            self.ends[idx],
+            self.source,
+        )
+
+
+class RegexLexer:
+    def __init__(self, fn, text, interned=None):
+        self.fn = fn
+        self.text = text
+        self.source = Source(fn, text)
+        self.interned = InternTable() if interned is None else interned
+        self.idx = 0
+        # Offset of self.text in the whole input
+        self.base = 0
+        self.scanner = self.scan()
+
+    def position(self, idx):
+        return Position(self.source, idx)
+
+    def get_next_token(self):
+        tok_type, value, start, end = next(self.scanner)
+        return Token(tok_type, value, start, end, self.source)
+
+    def tokenize(self):
+        tokens = TokenBuffer(self.source)
+        add_kind = tokens.kinds.append
+        add_start = tokens.starts.append
+        add_end = tokens.ends.append
+        add_value_id = tokens.value_ids.append
+        values = tokens.values
+        value_index = tokens.value_index
+        try:
+            for tok_type, value, start, end in self.scanner:
+                value_id = value_index.get(value)
+                if value_id is None:
+                    value_id = value_index[value] = len(values)
+                    values.append(value)
+                add_kind(TOKEN_KINDS[tok_type])
+                add_start(start)
+                add_end(end)
+                add_value_id(value_id)
+                if tok_type == TT_EOF:
+                    break
+        except Error as e:
+            tokens.error = e
+        return tokens
+
+    def fill(self):
+        # Extends self.text with more input; in-memory sources have none
+        return False
+
+    def scan(self):
+        interned = self.interned
+        while True:
+            text = self.text
+            match = TOKEN_REGEX.match(text, self.idx)
+            if match is None:
+                self.idx = WHITESPACE_REGEX.match(text, self.idx).end()
+                if self.idx < len(text):
+                    raise IllegalCharError(
+                        self.position(self.base + self.idx),
+                        self.position(self.base + self.idx + 1),
+                        "'" + text[self.idx] + "'",
+                    )
+                if self.fill():
+                    continue
+                eof = self.base + self.idx
+                yield TT_EOF, None, eof, eof + 1
+                continue
+
+            # A token touching the end of the window may continue in the
+            # next chunk, so it is matched again once more input is read
+            if match.end() == len(text) and self.fill():
+                continue
+
+            kind = match.lastgroup
+            start, end = match.span(kind)
+            self.idx = end
+            start += self.base
+            end += self.base
+
+            if kind == "IDENTIFIER":
+                value = interned[match.group(kind)]
+                tok_type = TT_KEYWORD if KEYWORDS.get(value) else TT_IDENTIFIER
+                yield tok_type, value, start, end
+            elif kind == "OPERATOR":
+                value = match.group(kind)
+                # Two-character operators and commas are reported one
+                # character to the right, the same as in Lexer
+                if end - start == 2 or value == ",":
+                    start += 1
+                yield OPERATORS[value], value, start, start + 1
+            elif kind == "NUMBER":
+                yield TT_NUMBER, self.make_number(match.group(kind), start, end), start, end
+            elif kind == "STRING":
+                yield TT_STRING, self.make_string(match.group(kind), end), start + 1, end
+            # COMMENT produces no token
+
+    def make_number(self, num_str, start, end):
+        first_dot = num_str.find(".")
+        if first_dot != -1:
+            second_dot = num_str.find(".", first_dot + 1)
+            if second_dot != -1:
+                raise InvalidSyntaxError(
+                    self.position(start + second_dot),
+                    self.position(start + second_dot + 1),
+                    ErrorDetails.TOO_MANY_DOTS,
+                )
+            if first_dot == len(num_str) - 1:
+                raise InvalidSyntaxError(
+                    self.position(end),
+                    self.position(end + 1),
+                    ErrorDetails.TRAILING_DOT,
+                )
+        return float(num_str)
+
+    def make_string(self, string, end):
+        if len(string) < 2 or string[-1] != '"':
+            raise InvalidSyntaxError(
+                self.position(end), self.position(end), ErrorDetails.UNTERMINATED_STRING
+            )
+        return self.interned[string[1:-1]]
+
+
+class FileSource:
+    __slots__ = ("fn", "chunk_size")
+
+    def __init__(self, fn, chunk_size=1 << 16):
+        self.fn = fn
+        self.chunk_size = chunk_size
+
+    def chunks(self):
+        with open(self.fn, "r") as file:
+            offset = 0
+            while True:
+                chunk = file.read(self.chunk_size)
+                if not chunk:
+                    return
+                yield offset, chunk
+                offset += len(chunk)
+
+    # The file is scanned again on demand so that no line table or text
+    # has to be kept in memory while a large script runs
+
+    def line_col(self, idx):
+        ln = 0
+        line_start = 0
+        for offset, chunk in self.chunks():
+            end = min(len(chunk), idx - offset)
+            if end <= 0:
+                break
+            newlines = chunk.count("\n", 0, end)
+            if newlines:
+                ln += newlines
+                line_start = offset + chunk.rfind("\n", 0, end) + 1
+        return ln, idx - line_start
+
+    def line(self, ln):
+        parts = []
+        for offset, chunk in self.chunks():
+            start = 0
+            while ln > 0:
+                newline = chunk.find("\n", start)
+                if newline == -1:
+                    break
+                ln -= 1
+                start = newline + 1
+            if ln > 0:
+                continue
+            newline = chunk.find("\n", start)
+            if newline != -1:
+                parts.append(chunk[start:newline])
+                break
+            parts.append(chunk[start:])
+        return "".join(parts)
+
+
+class FileLexer(RegexLexer):
+    def __init__(self, fn, file, chunk_size=1 << 16, interned=None):
+        super().__init__(fn, "", interned)
+        self.source = FileSource(fn, chunk_size)
+        self.file = file
+        self.chunk_size = chunk_size
+
+    def fill(self):
+        chunk = self.file.read(self.chunk_size)
+        if not chunk:
+            return False
+        self.text = self.text[self.idx :] + chunk
+        self.base += self.idx
+        self.idx = 0
+        return True
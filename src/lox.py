@@ -1,13 +1,120 @@
+from ast_cache import DiskCache, MemoryCache, file_digest, source_digest
+from bytecode import Compiler, disassemble
+from closure_compiler import ClosureInterpreter
+from environment import UNDEFINED
 from interpreter import Interpreter
-from lexer import Lexer
-from parser import Parser
+from lexer import FileLexer, FileSource, Lexer, RegexLexer, Source
+from lox_callable import MEMO_ENTRIES, MemoizedFunction
+from parser import AST, Parser, PrattParser
+from transpiler import PythonInterpreter, Transpiler
+from vm import VM
+
+LEXERS = {"classic": Lexer, "regex": RegexLexer}
+PARSERS = {"recursive": Parser, "pratt": PrattParser}
+BACKENDS = {
+    "tree": Interpreter,
+    "closure": ClosureInterpreter,
+    "vm": VM,
+    "python": PythonInterpreter,
+}
 
 
 class Lox:
-    def __init__(self):
-        self.interpreter = Interpreter()
+    def __init__(
+        self,
+        lexer="regex",
+        parser="pratt",
+        backend="tree",
+        buffered=False,
+        cache_dir=None,
+        cache_entries=128,
+        cache_size=8 << 20,
+        max_depth=None,
+        memo_entries=MEMO_ENTRIES,
+    ):
+        options = {"memo_entries": memo_entries}
+        if max_depth is not None:
+            # Only the vm keeps Lox frames off the Python stack and takes a
+            # limit
+            options["max_depth"] = max_depth
+        self.interpreter = BACKENDS[backend](**options)
+        self.lexer_class = LEXERS[lexer]
+        self.parser_class = PARSERS[parser]
+        self.buffered = buffered
+        self.cache = DiskCache(cache_dir) if cache_dir is not None else None
+        self.programs = MemoryCache(cache_entries, cache_size)
+
+    def cache_info(self):
+        return self.programs.info()
+
+    def pool_info(self):
+        return self.interpreter.pool.info()
+
+    def memo_info(self, name):
+        # Table statistics of the memoized function in global name, or None
+        cell = self.interpreter.globals.values.get(name)
+        if cell is None or not isinstance(cell.value, MemoizedFunction):
+            return None
+        return cell.value.info()
+
+    def parse(self, text, fn="<stdin>"):
+        lexer = self.lexer_class(fn, text)
+        parser = self.parser_class(lexer.tokenize() if self.buffered else lexer)
+        return parser.parse()
+
+    def disassemble(self, text, fn="<stdin>"):
+        tree = self.interpreter.resolver.resolve(self.parse(text, fn))
+        return disassemble(Compiler().compile(tree))
+
+    def transpile(self, text, fn="<stdin>"):
+        tree = self.interpreter.resolver.resolve(self.parse(text, fn))
+        return Transpiler().generate(tree)
+
+    def run(self, text, fn="<stdin>"):
+        result = self.evaluate(text, fn)
+        return None if result is UNDEFINED else result
+
+    def evaluate(self, text, fn="<stdin>"):
+        # Like run, but a program ending in a statement returns UNDEFINED,
+        # so the REPL can tell a nil result from no result
+        key = (fn, text)
+        entry = self.programs.get(key)
+        if entry is None:
+            tree = self.load(text, fn)
+            ends_in_expression = bool(tree) and isinstance(tree[-1], AST)
+            entry = (self.interpreter.prepare(tree), ends_in_expression)
+            self.programs.put(key, entry)
+        program, ends_in_expression = entry
+        result = self.interpreter.execute(program)
+        return result if ends_in_expression else UNDEFINED
+
+    def load(self, text, fn):
+        if self.cache is None:
+            return self.parse(text, fn)
+        digest = source_digest(text)
+        tree = self.cache.load(digest, Source(fn, text))
+        if tree is None:
+            tree = self.parse(text, fn)
+            self.cache.store(digest, tree)
+        return tree
+
+    def run_file(self, path):
+        if self.lexer_class is not RegexLexer or self.buffered:
+            with open(path, "r") as file:
+                text = file.read()
+            return self.run(text, path) if text else None
+
+        if self.cache is None:
+            # Top-level declarations run as soon as they are parsed, while
+            # the lexer reads the file chunk by chunk
+            with open(path, "r") as file:
+                parser = self.parser_class(FileLexer(path, file))
+                return self.interpreter.interpret_declarations(parser.declarations())
 
-    def run(self, text):
-        lexer = Lexer("<stdin>", text)
-        parser = Parser(lexer)
-        return self.interpreter.interpret(parser)
+        digest = file_digest(path)
+        tree = self.cache.load(digest, FileSource(path))
+        if tree is None:
+            with open(path, "r") as file:
+                tree = self.parser_class(FileLexer(path, file)).parse()
+            self.cache.store(digest, tree)
+        return self.interpreter.interpret_declarations(tree)
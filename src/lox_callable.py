@@ -1,16 +1,20 @@
 import time
-from typing import TYPE_CHECKING, Any
+from collections import OrderedDict, namedtuple
+from typing import TYPE_CHECKING, Any, Callable, Optional
 from abc import ABCMeta, abstractmethod
-from environment import Environment
+from environment import UNDEFINED, Cell, Environment
 from parser import Stmt
 
-from lexer import Return
+from lexer import RETURN
 
 if TYPE_CHECKING:
     from interpreter import Interpreter
 
 
 class LoxCallable(metaclass=ABCMeta):
+    # Callers check arguments against param_count instead of calling arity()
+    param_count = 0
+
     @abstractmethod
     def arity(self) -> int:
         pass
@@ -20,38 +24,218 @@ class LoxCallable(metaclass=ABCMeta):
         pass
 
 
+def frame_padding(param_slots: tuple, size: int) -> Optional[list]:
+    # Parameters fill slots 0 to n-1, so a frame is the arguments followed
+    # by this padding. A repeated parameter name shares a slot; such frames
+    # are bound one parameter at a time so the repeat is reported.
+    if len(set(param_slots)) != len(param_slots):
+        return None
+    return [UNDEFINED] * (size - len(param_slots))
+
+
 class LoxFunction(LoxCallable):
-    def __init__(self, declaration: Stmt) -> None:
+    def __init__(self, declaration: Stmt, upvalues: list = ()) -> None:
         self.declaration = declaration
+        # The cells of the captured variables, by upvalue index
+        self.upvalues = upvalues
+        self.param_count = len(declaration.params)
+        self.padding = frame_padding(declaration.param_slots, declaration.size)
 
     def arity(self) -> int:
-        return len(self.declaration.params)
+        return self.param_count
+
+    def bind_parameters(
+        self, interpreter: "Interpreter", arguments: list
+    ) -> Environment:
+        declaration = self.declaration
+        environment = Environment(interpreter.globals, declaration.size)
+        for slot, param, argument in zip(
+            declaration.param_slots, declaration.params, arguments
+        ):
+            environment.define_at(slot, argument, param)
+        return environment
 
     def call(self, interpreter: "Interpreter", arguments: list) -> Any:
-        environment = Environment(interpreter.globals)
-        for i in range(len(self.declaration.params)):
-            environment.define(
-                self.declaration.params[i].value,
-                arguments[i],
-                self.declaration.params[i].pos_start,
-                self.declaration.params[i].pos_end,
-            )
+        function = self
+        pool = interpreter.pool
+        upvalues = interpreter.upvalues
         try:
-            interpreter.execute_Block(self.declaration.body, environment)
-        except Return as return_value:
-            return return_value.value
-        return "nil"
+            while True:
+                padding = function.padding
+                declaration = function.declaration
+                if padding is not None:
+                    slots = arguments + padding
+                    environment = pool.acquire(interpreter.globals, slots)
+                else:
+                    environment = function.bind_parameters(interpreter, arguments)
+                    slots = environment.slots
+                for slot in declaration.boxed_params:
+                    slots[slot] = Cell(slots[slot])
+                interpreter.upvalues = function.upvalues
+                completion = interpreter.execute_Block(declaration.body, environment)
+                pool.release(environment)
+                if completion is not RETURN:
+                    return None
+                if interpreter.tail_call is None:
+                    return interpreter.return_value
+                # A call in tail position reuses this call instead of nesting
+                function, arguments = interpreter.tail_call
+                interpreter.tail_call = None
+        finally:
+            interpreter.upvalues = upvalues
 
     def __repr__(self):
         return f"<fn {self.declaration.name.value}>"
 
 
-class Clock(LoxCallable):
+class NativeFunction(LoxCallable):
+    # Wraps a Python function; calls pass the Lox arguments straight to it
+    def __init__(self, function: Callable, param_count: int) -> None:
+        self.function = function
+        self.param_count = param_count
+
     def arity(self) -> int:
-        return 0
+        return self.param_count
 
     def call(self, interpreter: "Interpreter", arguments: list) -> Any:
-        return time.time()
+        return self.function(*arguments)
 
     def __repr__(self):
         return f"<native fn>"
+
+
+class Clock(NativeFunction):
+    def __init__(self) -> None:
+        super().__init__(time.time, 0)
+
+
+# Default number of results kept per memoized function
+MEMO_ENTRIES = 1024
+
+MemoInfo = namedtuple("MemoInfo", "hits misses evictions entries")
+
+
+class MemoTable:
+    # Results of a function by argument key; the least recently used entry
+    # is evicted once there are more than max_entries
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple) -> Any:
+        # Results may be nil, so a miss returns UNDEFINED
+        value = self.entries.get(key, UNDEFINED)
+        if value is UNDEFINED:
+            self.misses += 1
+            return UNDEFINED
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: tuple, value: Any) -> None:
+        if self.max_entries <= 0:
+            return
+        self.entries[key] = value
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def info(self) -> MemoInfo:
+        return MemoInfo(self.hits, self.misses, self.evictions, len(self.entries))
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+def memo_key(arguments: list) -> tuple:
+    # Python has True == 1.0 and 0.0 == -0.0, which Lox tells apart, so
+    # numbers are keyed by their exact value and everything else by type
+    key = []
+    for argument in arguments:
+        if type(argument) is float:
+            key.append((float, argument.hex()))
+        else:
+            key.append((type(argument), argument))
+    return tuple(key)
+
+
+def is_pure(function: Any, globals: Environment, assigned: set, seen: dict) -> bool:
+    # A function is pure when its body is and every global it uses has
+    # been defined, is never assigned and, holding a function, is pure as
+    # well. Functions calling each other are pure unless one of them is
+    # not; seen maps each declaration checked to whether it was reached
+    # again, that is whether it is recursive.
+    if type(function) is MemoizedFunction:
+        function = function.function
+    if not isinstance(function, LoxFunction):
+        return False
+    declaration = function.declaration
+    if not declaration.pure:
+        return False
+    if declaration in seen:
+        seen[declaration] = True
+        return True
+    seen[declaration] = False
+    for name in declaration.globals:
+        cell = globals.values.get(name)
+        if name in assigned or cell is None:
+            return False
+        if isinstance(cell.value, LoxCallable) and not is_pure(
+            cell.value, globals, assigned, seen
+        ):
+            return False
+    return True
+
+
+class MemoizedFunction(LoxCallable):
+    # Calls function through a table of its results. An automatic one wraps
+    # a function the resolver found pure, and uses the table only while
+    # the globals the function depends on keep it pure and recursive: a
+    # lookup costs about as much as running a body that calls nothing.
+    def __init__(
+        self, function: LoxCallable, max_entries: int, automatic: bool = False
+    ) -> None:
+        self.function = function
+        self.param_count = function.param_count
+        self.table = MemoTable(max_entries)
+        self.automatic = automatic
+        # The globals version and count of assigned globals that active
+        # was last decided at
+        self.checked = None
+        self.active = False
+
+    def arity(self) -> int:
+        return self.param_count
+
+    def enabled(self, interpreter: "Interpreter") -> bool:
+        if not self.automatic:
+            return True
+        assigned = interpreter.resolver.assigned
+        state = (interpreter.globals.version, len(assigned))
+        if state != self.checked:
+            self.checked = state
+            seen = {}
+            pure = is_pure(self.function, interpreter.globals, assigned, seen)
+            self.active = pure and seen[self.function.declaration]
+            if not self.active:
+                self.table.clear()
+        return self.active
+
+    def call(self, interpreter: "Interpreter", arguments: list) -> Any:
+        if not self.enabled(interpreter):
+            return self.function.call(interpreter, arguments)
+        key = memo_key(arguments)
+        value = self.table.get(key)
+        if value is UNDEFINED:
+            value = self.function.call(interpreter, arguments)
+            self.table.put(key, value)
+        return value
+
+    def info(self) -> MemoInfo:
+        return self.table.info()
+
+    def __repr__(self):
+        return repr(self.function)
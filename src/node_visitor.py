@@ -0,0 +1,18 @@
+class NodeVisitor(object):
+    # visit methods by node class, looked up once per class
+    visitors = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.visitors = {}
+
+    def visit(self, node):
+        visitor = self.visitors.get(type(node))
+        if visitor is None:
+            cls = type(self)
+            visitor = getattr(cls, "visit_" + type(node).__name__, cls.generic_visit)
+            self.visitors[type(node)] = visitor
+        return visitor(self, node)
+
+    def generic_visit(self, node):
+        raise Exception(f"No visit_{type(node).__name__} method")
@@ -24,103 +24,154 @@ from lexer import (
     TT_COMMA,
     ErrorDetails,
     RTError,
-    Token,
 )
 from lexer import InvalidSyntaxError
 
 
 class AST(object):
-    pass
+    __slots__ = ()
 
 
 class BinOp(AST):
+    # handler, seen, hits and deopts are the tree interpreter's quickening
+    # state for this site
+    __slots__ = ("left", "op", "right", "handler", "seen", "hits", "deopts")
+
     def __init__(self, left, op, right):
         self.left = left
-        self.token = self.op = op
+        self.op = op
         self.right = right
+        self.handler = None
+        self.seen = None
+        self.hits = 0
+        self.deopts = 0
+
+    @property
+    def token(self):
+        return self.op
 
     def __repr__(self):
         return f"({self.left}, {self.op}, {self.right})"
 
 
 class UnaryOp(AST):
+    __slots__ = ("op", "expr")
+
     def __init__(self, op, expr):
-        self.token = self.op = op
+        self.op = op
         self.expr = expr
 
+    @property
+    def token(self):
+        return self.op
+
     def __repr__(self):
         return f"{self.token}, {self.expr}"
 
 
 class Logical(AST):
+    __slots__ = ("left", "op", "right")
+
     def __init__(self, left, op, right):
         self.left = left
-        self.token = self.op = op
+        self.op = op
         self.right = right
 
+    @property
+    def token(self):
+        return self.op
+
     def __repr__(self):
         return f"({self.left}, {self.op}, {self.right})"
 
 
 class Call(AST):
+    __slots__ = ("callee", "paren", "arguments")
+
     def __init__(self, callee, paren, arguments):
         self.callee = callee
         self.paren = paren
         self.arguments = arguments
 
+    @property
+    def token(self):
+        return self.paren
+
     def __repr__(self):
         return f"{self.callee} {self.arguments}"
 
 
 class Primary(AST):
+    __slots__ = ("token",)
+
     def __init__(self, token):
         self.token = token
-        self.value = token.value
+
+    @property
+    def value(self):
+        return self.token.value
 
     def __repr__(self):
         return f"{self.token}"
 
 
 class Nil(Primary):
-    def __init__(self, token):
-        super().__init__(token)
+    __slots__ = ()
 
 
 class Boolean(Primary):
-    def __init__(self, token):
-        super().__init__(token)
+    __slots__ = ()
 
 
 class Assign(AST):
+    __slots__ = ("left", "op", "right")
+
     def __init__(self, left, op, right):
         self.left = left
-        self.token = self.op = op
+        self.op = op
         self.right = right
 
+    @property
+    def token(self):
+        return self.op
+
     def __repr__(self):
         return f"{self.left}, {self.op}, {self.right}"
 
 
 class Num(Primary):
-    def __init__(self, token):
-        super().__init__(token)
+    __slots__ = ()
 
 
 class String(Primary):
-    def __init__(self, token):
-        super().__init__(token)
+    __slots__ = ()
 
 
 class Identifier(Primary):
+    # depth and slot are filled in by the resolver for locals, upvalue for
+    # locals of an enclosing function; all None means global. boxed marks a
+    # local captured by a closure, whose slot holds a Cell. cell and
+    # version cache the Cell of a global and the globals version it was
+    # found at.
+    __slots__ = ("depth", "slot", "upvalue", "boxed", "cell", "version")
+
     def __init__(self, token):
-        super().__init__(token)
+        self.token = token
+        self.depth = None
+        self.slot = None
+        self.upvalue = None
+        self.boxed = False
+        self.cell = None
+        self.version = None
 
 
 class Stmt(object):
-    pass
+    __slots__ = ()
 
 
 class PrintStmt(Stmt):
+    __slots__ = ("expr",)
+
     def __init__(self, expr):
         self.expr = expr
 
@@ -129,20 +180,31 @@ class PrintStmt(Stmt):
 
 
 class VarStmt(Stmt):
+    __slots__ = ("token", "expr", "slot", "boxed")
+
     def __init__(self, token, expr):
         self.token = token
         self.expr = expr
+        self.slot = None
+        self.boxed = False
 
     def __repr__(self):
         return f"{self.token}, {self.expr}"
 
 
 class Block(Stmt):
+    # size is filled in by the resolver; 0 means the block declares nothing
+    # and runs in the enclosing scope
+    __slots__ = ("statements", "size")
+
     def __init__(self, statements):
         self.statements = statements
+        self.size = 0
 
 
 class IfStmt(Stmt):
+    __slots__ = ("condition", "then_stmt", "else_stmt")
+
     def __init__(self, condition, then_stmt, else_stmt):
         self.condition = condition
         self.then_stmt = then_stmt
@@ -153,6 +215,8 @@ class IfStmt(Stmt):
 
 
 class WhileStmt(Stmt):
+    __slots__ = ("condition", "body")
+
     def __init__(self, condition, body):
         self.condition = condition
         self.body = body
@@ -161,20 +225,75 @@ class WhileStmt(Stmt):
         return f"{self.condition}, {self.body}"
 
 
+class ForStmt(Stmt):
+    # condition and increment are None when omitted. size is filled in by
+    # the resolver: the loop has its own scope, holding the initializer's
+    # variable, only when size is not 0.
+    __slots__ = ("initializer", "condition", "increment", "body", "size")
+
+    def __init__(self, initializer, condition, increment, body):
+        self.initializer = initializer
+        self.condition = condition
+        self.increment = increment
+        self.body = body
+        self.size = 0
+
+    def __repr__(self):
+        return (
+            f"{self.initializer}, {self.condition}, {self.increment}, {self.body}"
+        )
+
+
 class ReturnStmt(Stmt):
+    # tail_call is set by the resolver when value is a call in a function
+    __slots__ = ("keyword", "value", "tail_call")
+
     def __init__(self, keyword, value):
         self.keyword = keyword
         self.value = value
+        self.tail_call = False
 
     def __repr__(self):
         return f"{self.keyword}, {self.value}"
 
 
 class Function(Stmt):
+    # upvalues is filled in by the resolver with a (name, depth, slot) entry
+    # per captured variable, telling where a new closure finds its cell: a
+    # local of the enclosing scopes, or an upvalue of the enclosing function
+    # when depth is None and slot is its index. boxed_params are the slots
+    # of captured parameters. pure marks a body that prints nothing,
+    # declares no function, assigns no global or captured variable and
+    # calls only functions named by globals; globals lists the globals the
+    # body uses, and calls tells whether it calls anything.
+    __slots__ = (
+        "name",
+        "params",
+        "body",
+        "slot",
+        "boxed",
+        "param_slots",
+        "size",
+        "upvalues",
+        "boxed_params",
+        "pure",
+        "globals",
+        "calls",
+    )
+
     def __init__(self, name, params, body):
         self.name = name
         self.params = params
         self.body = body
+        self.slot = None
+        self.boxed = False
+        self.param_slots = tuple(range(len(params)))
+        self.size = len(params)
+        self.upvalues = ()
+        self.boxed_params = ()
+        self.pure = False
+        self.globals = ()
+        self.calls = False
 
     def __repr__(self):
         return f"{self.name}, {self.params}, {self.body}"
@@ -414,18 +533,7 @@ class Parser(object):
         self.eat(TT_RPAREN, error=ErrorDetails.EXPECTED_RPAREN)
 
         body = self.statement()
-
-        if increment is not None:
-            body = Block([body, increment])
-
-        if condition is None:
-            condition = Boolean(Token(TT_KEYWORD, "true"))
-        body = WhileStmt(condition, body)
-
-        if initializer is not None:
-            body = Block([initializer, body])
-
-        return body
+        return ForStmt(initializer, condition, increment, body)
 
     def while_stmt(self):
         self.eat(TT_LPAREN, error=ErrorDetails.EXPECTED_LPAREN)
@@ -528,12 +636,12 @@ class Parser(object):
         else:
             return self.statement()
 
-    def program(self):
-        declarations = []
+    def declarations(self):
         while self.current_token.type != TT_EOF:
-            declaration = self.declaration()
-            declarations.append(declaration)
-        return declarations
+            yield self.declaration()
+
+    def program(self):
+        return list(self.declarations())
 
     def parse(self):
         node = self.program()
@@ -544,3 +652,127 @@ class Parser(object):
                 ErrorDetails.EXPECTED_ARITHMETIC_OPERATOR,
             )
         return node
+
+
+# Binding powers of the left-associative binary operators, lowest first
+BINARY_BINDING_POWERS = {
+    TT_EQUAL_EQUAL: 3,
+    TT_BANG_EQUAL: 3,
+    TT_GREATER: 4,
+    TT_GREATER_EQUAL: 4,
+    TT_LESS: 4,
+    TT_LESS_EQUAL: 4,
+    TT_PLUS: 5,
+    TT_MINUS: 5,
+    TT_MUL: 6,
+    TT_DIV: 6,
+}
+LOGICAL_BINDING_POWERS = {"or": 1, "and": 2}
+
+LITERALS = {TT_NUMBER: Num, TT_STRING: String, TT_IDENTIFIER: Identifier}
+KEYWORD_LITERALS = {"nil": Nil, "true": Boolean, "false": Boolean}
+
+
+class PrattParser(Parser):
+    def __init__(self, lexer):
+        super().__init__(lexer)
+        self.statement_handlers = {
+            "print": self.print_stmt,
+            "if": self.if_stmt,
+            "while": self.while_stmt,
+            "for": self.for_stmt,
+            "return": self.return_stmt,
+        }
+        self.declaration_handlers = {
+            "var": self.var_decl,
+            "fun": self.function,
+        }
+
+    def expression(self):
+        expr = self.binary(0)
+        if self.current_token.type == TT_EQ:
+            op = self.current_token
+            self.eat(TT_EQ)
+            value = self.expression()
+            if expr.token.type == TT_IDENTIFIER:
+                return Assign(expr, op, value)
+            raise InvalidSyntaxError(
+                op.pos_start, op.pos_end, ErrorDetails.INVALID_ASSIGNMENT_TARGET
+            )
+        return expr
+
+    def binary(self, min_power):
+        node = self.operand()
+        while True:
+            token = self.current_token
+            if token.type == TT_KEYWORD:
+                power = LOGICAL_BINDING_POWERS.get(token.value)
+            else:
+                power = BINARY_BINDING_POWERS.get(token.type)
+            if power is None or power <= min_power:
+                return node
+            self.eat(token.type)
+            right = self.binary(power)
+            if token.type == TT_KEYWORD:
+                node = Logical(node, token, right)
+            else:
+                node = BinOp(node, token, right)
+
+    def operand(self):
+        # unary -> ( "!" | "-" ) unary | call, without one frame per prefix
+        prefixes = []
+        while self.current_token.type in (TT_MINUS, TT_BANG):
+            prefixes.append(self.current_token)
+            self.eat(self.current_token.type)
+
+        token = self.current_token
+        node_class = LITERALS.get(token.type)
+        if node_class is None and token.type == TT_KEYWORD:
+            node_class = KEYWORD_LITERALS.get(token.value)
+        if node_class is not None:
+            self.eat(token.type)
+            node = node_class(token)
+        elif token.type == TT_LPAREN:
+            self.eat(TT_LPAREN)
+            node = self.expression()
+            if self.current_token.type != TT_RPAREN:
+                raise InvalidSyntaxError(
+                    self.current_token.pos_start,
+                    self.current_token.pos_end,
+                    ErrorDetails.EXPECTED_RPAREN,
+                )
+            self.eat(TT_RPAREN)
+        else:
+            raise InvalidSyntaxError(
+                token.pos_start,
+                token.pos_end,
+                ErrorDetails.EXPECTED_NUMBER,
+            )
+
+        while self.current_token.type == TT_LPAREN:
+            self.eat(TT_LPAREN)
+            node = self.finish_call(node)
+
+        for prefix in reversed(prefixes):
+            node = UnaryOp(prefix, node)
+        return node
+
+    def statement(self):
+        token = self.current_token
+        if token.type == TT_KEYWORD:
+            statement = self.statement_handlers.get(token.value)
+            if statement is not None:
+                self.eat(TT_KEYWORD)
+                return statement()
+        elif token.type == TT_LBRACE:
+            return Block(self.block())
+        return self.expression_stmt()
+
+    def declaration(self):
+        token = self.current_token
+        if token.type == TT_KEYWORD:
+            declaration = self.declaration_handlers.get(token.value)
+            if declaration is not None:
+                self.eat(TT_KEYWORD)
+                return declaration()
+        return self.statement()
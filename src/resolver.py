@@ -0,0 +1,297 @@
+from node_visitor import NodeVisitor
+from parser import Call, Function, Identifier, VarStmt
+
+
+DECLARATIONS = (VarStmt, Function)
+
+
+class Scope:
+    # The slots of one block or function scope by name. sites collects the
+    # nodes that address each slot, so that once a closure captures a slot
+    # they can all be marked boxed.
+    __slots__ = ("slots", "sites", "captured")
+
+    def __init__(self):
+        self.slots = {}
+        self.sites = {}
+        self.captured = set()
+
+    def close(self):
+        for slot in self.captured:
+            for node in self.sites[slot]:
+                node.boxed = True
+
+
+class FunctionScope:
+    # The block scopes of the function being resolved, and the variables of
+    # enclosing functions it captures: upvalues maps each captured variable
+    # to its index in the function's flat list of upvalue cells. pure stays
+    # True while the body only computes a result from its arguments and
+    # the globals it uses.
+    __slots__ = (
+        "enclosing",
+        "scopes",
+        "upvalues",
+        "captures",
+        "pure",
+        "globals",
+        "calls",
+    )
+
+    def __init__(self, enclosing, scopes):
+        self.enclosing = enclosing
+        self.scopes = scopes
+        self.upvalues = {}
+        self.captures = []
+        self.pure = True
+        self.globals = {}
+        self.calls = False
+
+
+class Resolver(NodeVisitor):
+    # Gives every local variable a (depth, slot) address: depth counts the
+    # environments between the use and the declaring one, slot indexes into
+    # that environment's slot list. A local of an enclosing function is an
+    # upvalue of the function using it, addressed by its upvalue index.
+    # Names not declared in any enclosing scope are globals and keep depth
+    # and upvalue None. assigned collects every global assigned anywhere in
+    # the code resolved so far.
+    def __init__(self):
+        self.scopes = []
+        self.function = FunctionScope(None, self.scopes)
+        self.in_function = False
+        self.assigned = set()
+
+    def resolve(self, declarations):
+        for node in declarations:
+            self.visit(node)
+        return declarations
+
+    def declare(self, name, node=None):
+        if not self.scopes:
+            return None
+        scope = self.scopes[-1]
+        slot = scope.slots.get(name)
+        if slot is None:
+            # A redeclaration reuses the slot, so the environment can report
+            # it as already defined when it runs
+            slot = scope.slots[name] = len(scope.slots)
+            scope.sites[slot] = []
+        if node is not None:
+            scope.sites[slot].append(node)
+        return slot
+
+    def find_local(self, scopes, name):
+        depth = 0
+        for scope in reversed(scopes):
+            slot = scope.slots.get(name)
+            if slot is not None:
+                return depth, scope, slot
+            depth += 1
+        return None
+
+    def capture(self, function, name):
+        # Returns the index of name among the upvalues of function, or None
+        # for a global. Each function between the declaring one and this
+        # one captures the variable too, so closures copy cells only from
+        # the function they are created in.
+        enclosing = function.enclosing
+        if enclosing is None:
+            return None
+        found = self.find_local(enclosing.scopes, name)
+        if found is not None:
+            depth, scope, slot = found
+            scope.captured.add(slot)
+            key = (scope, slot)
+        else:
+            slot = self.capture(enclosing, name)
+            if slot is None:
+                return None
+            depth = None
+            key = (None, slot)
+        index = function.upvalues.get(key)
+        if index is None:
+            index = function.upvalues[key] = len(function.captures)
+            function.captures.append((name, depth, slot))
+        return index
+
+    def visit_BinOp(self, node):
+        self.visit(node.left)
+        self.visit(node.right)
+
+    def visit_Logical(self, node):
+        self.visit(node.left)
+        self.visit(node.right)
+
+    def visit_UnaryOp(self, node):
+        self.visit(node.expr)
+
+    def visit_Num(self, node):
+        pass
+
+    def visit_String(self, node):
+        pass
+
+    def visit_Nil(self, node):
+        pass
+
+    def visit_Boolean(self, node):
+        pass
+
+    def visit_Identifier(self, node):
+        name = node.token.value
+        node.boxed = False
+        found = self.find_local(self.scopes, name)
+        if found is not None:
+            node.depth, scope, node.slot = found
+            node.upvalue = None
+            scope.sites[node.slot].append(node)
+            return
+        node.depth = None
+        node.slot = None
+        node.upvalue = self.capture(self.function, name)
+        if node.upvalue is None:
+            self.function.globals[name] = None
+        else:
+            # Captured cells can change between calls
+            self.function.pure = False
+
+    def visit_Assign(self, node):
+        self.visit(node.right)
+        left = node.left
+        self.visit(left)
+        if left.depth is None:
+            self.function.pure = False
+            if left.upvalue is None:
+                self.assigned.add(left.token.value)
+
+    def visit_Call(self, node):
+        self.function.calls = True
+        callee = node.callee
+        self.visit(callee)
+        # Only a function named by a global can be checked for purity, once
+        # the global has a value
+        if type(callee) is not Identifier or callee.depth is not None:
+            self.function.pure = False
+        for argument in node.arguments:
+            self.visit(argument)
+
+    def visit_PrintStmt(self, node):
+        self.function.pure = False
+        self.visit(node.expr)
+
+    def visit_VarStmt(self, node):
+        # The initializer still sees the outer variable of the same name
+        if node.expr:
+            self.visit(node.expr)
+        node.boxed = False
+        node.slot = self.declare(node.token.value, node)
+
+    def visit_Block(self, node):
+        # Blocks that declare nothing get no scope, and so no environment
+        # or frame space of their own when they run
+        if not any(type(stmt) in DECLARATIONS for stmt in node.statements):
+            self.resolve(node.statements)
+            node.size = 0
+            return
+        scope = Scope()
+        self.scopes.append(scope)
+        self.resolve(node.statements)
+        self.scopes.pop()
+        scope.close()
+        node.size = len(scope.slots)
+
+    def visit_IfStmt(self, node):
+        self.visit(node.condition)
+        self.visit(node.then_stmt)
+        if node.else_stmt is not None:
+            self.visit(node.else_stmt)
+
+    def visit_WhileStmt(self, node):
+        self.visit(node.condition)
+        self.visit(node.body)
+
+    def visit_ForStmt(self, node):
+        scope = Scope() if type(node.initializer) is VarStmt else None
+        if scope is not None:
+            self.scopes.append(scope)
+        if node.initializer is not None:
+            self.visit(node.initializer)
+        if node.condition is not None:
+            self.visit(node.condition)
+        if node.increment is not None:
+            self.visit(node.increment)
+        self.visit(node.body)
+        node.size = 0
+        if scope is not None:
+            self.scopes.pop()
+            scope.close()
+            node.size = len(scope.slots)
+
+    def visit_ReturnStmt(self, node):
+        if node.value is not None:
+            self.visit(node.value)
+        # The backends run a call in tail position in place of the
+        # returning call, so tail recursion does not grow the stack
+        node.tail_call = self.in_function and type(node.value) is Call
+
+    def visit_Function(self, node):
+        node.boxed = False
+        node.slot = self.declare(node.name.value, node)
+        # A memoized call would hand out one closure instead of a new one
+        self.function.pure = False
+        # Function bodies run on top of the globals; the locals around the
+        # declaration they use are captured as upvalues instead
+        scope = Scope()
+        enclosing = (self.scopes, self.function, self.in_function)
+        self.scopes = [scope]
+        self.function = FunctionScope(self.function, self.scopes)
+        self.in_function = True
+        try:
+            node.param_slots = tuple(
+                self.declare(param.value) for param in node.params
+            )
+            self.resolve(node.body)
+            node.size = len(scope.slots)
+            node.upvalues = tuple(self.function.captures)
+            node.pure = self.function.pure
+            node.globals = tuple(self.function.globals)
+            node.calls = self.function.calls
+        finally:
+            self.scopes, self.function, self.in_function = enclosing
+        scope.close()
+        node.boxed_params = tuple(
+            slot for slot in dict.fromkeys(node.param_slots) if slot in scope.captured
+        )
+
+
+class FrameLayout:
+    # Lays the nested block scopes of one function out one after another in
+    # a single flat frame, turning resolved (depth, slot) pairs into frame
+    # indexes. Sibling blocks reuse the same part of the frame.
+    def __init__(self):
+        self.scopes = []
+        self.size = 0
+
+    def push(self, size, declared=()):
+        if self.scopes:
+            base, outer_size, _ = self.scopes[-1]
+            base += outer_size
+        else:
+            base = 0
+        self.scopes.append((base, size, set(declared)))
+        self.size = max(self.size, base + size)
+
+    def pop(self):
+        self.scopes.pop()
+
+    def index(self, depth, slot):
+        return self.scopes[-1 - depth][0] + slot
+
+    def declare(self, slot):
+        # The first declaration of a slot in a scope always finds it empty,
+        # only a redeclaration needs to check it
+        base, _, declared = self.scopes[-1]
+        first = slot not in declared
+        declared.add(slot)
+        return base + slot, first
@@ -1,25 +1,56 @@
-import sys
-from lox import Lox
+import argparse
+from environment import UNDEFINED
+from interpreter import stringify
+from lox import Lox, BACKENDS, LEXERS, PARSERS
 
 
-lox = Lox()
+arg_parser = argparse.ArgumentParser(description="Lox interpreter")
+arg_parser.add_argument("script", nargs="?")
+arg_parser.add_argument("--lexer", choices=LEXERS, default="regex")
+arg_parser.add_argument("--parser", choices=PARSERS, default="pratt")
+arg_parser.add_argument("--backend", choices=BACKENDS, default="tree")
+arg_parser.add_argument(
+    "--disassemble", action="store_true", help="print the script's bytecode"
+)
+arg_parser.add_argument(
+    "--emit-python", action="store_true", help="print the script as Python source"
+)
+arg_parser.add_argument("--cache-dir", help="directory for parsed-program caches")
+arg_parser.add_argument(
+    "--max-depth", type=int, help="maximum Lox call depth (vm backend only)"
+)
+args = arg_parser.parse_args()
+if args.max_depth is not None and args.backend != "vm":
+    arg_parser.error("--max-depth requires --backend vm")
+
+lox = Lox(
+    lexer=args.lexer,
+    parser=args.parser,
+    backend=args.backend,
+    cache_dir=args.cache_dir,
+    max_depth=args.max_depth,
+)
 
 while True:
     try:
         repl = True
-        text = None
-        if len(sys.argv) > 1:
+        if args.script:
             repl = False
-            text = open(sys.argv[1], "r").read()
-        else:
-            text = input("> ")
+            if args.disassemble:
+                with open(args.script, "r") as file:
+                    print(lox.disassemble(file.read(), args.script))
+            elif args.emit_python:
+                with open(args.script, "r") as file:
+                    print(lox.transpile(file.read(), args.script))
+            else:
+                lox.run_file(args.script)
+            break
+        text = input("> ")
         if not text:
             continue
-        result = lox.run(text)
-        if not repl:
-            break
-        if result is not None:
-            print(result)
+        result = lox.evaluate(text)
+        if result is not UNDEFINED:
+            print(stringify(result))
 
     except EOFError:
         break
@@ -0,0 +1,86 @@
+import unittest
+from bytecode import (
+    OP_BOX,
+    OP_DEFINE_LOCAL,
+    OP_FUNCTION,
+    OP_GET_LOCAL,
+    OP_GET_UPVALUE,
+    OP_SET_CELL,
+    OP_STORE_LOCAL,
+    OPERANDS,
+    Compiler,
+    disassemble,
+)
+from lexer import RegexLexer
+from parser import PrattParser
+from resolver import Resolver
+
+
+def compile_text(text):
+    tree = PrattParser(RegexLexer("stdin", text)).parse()
+    return Compiler().compile(Resolver().resolve(tree))
+
+
+def instructions(chunk):
+    ip = 0
+    while ip < len(chunk.code):
+        op = chunk.code[ip]
+        yield (op,) + tuple(chunk.code[ip + 1 : ip + 1 + OPERANDS[op]])
+        ip += 1 + OPERANDS[op]
+
+
+class TestCompiler(unittest.TestCase):
+    def test_line_table_matches_code(self):
+        chunk = compile_text("var a = 1;\nprint a + 2;")
+        self.assertEqual(len(chunk.code), len(chunk.tokens))
+
+    def test_nested_blocks_get_separate_slots(self):
+        chunk = compile_text("{ var a = 1; { var b = a; print b; } var c = 3; }")
+        self.assertEqual(3, chunk.frame_size)
+        locals = [
+            instruction
+            for instruction in instructions(chunk)
+            if instruction[0] in (OP_GET_LOCAL, OP_STORE_LOCAL)
+        ]
+        self.assertEqual(
+            [
+                (OP_STORE_LOCAL, 0),
+                (OP_GET_LOCAL, 0),
+                (OP_STORE_LOCAL, 2),
+                (OP_GET_LOCAL, 2),
+                (OP_STORE_LOCAL, 1),
+            ],
+            locals,
+        )
+
+    def test_sibling_blocks_share_slots(self):
+        chunk = compile_text("{ var a = 1; } { var b = 2; }")
+        self.assertEqual(1, chunk.frame_size)
+
+    def test_redeclaration_is_checked(self):
+        chunk = compile_text("{ var a = 1; var a = 2; }")
+        ops = [instruction[0] for instruction in instructions(chunk)]
+        self.assertIn(OP_STORE_LOCAL, ops)
+        self.assertIn(OP_DEFINE_LOCAL, ops)
+
+    def test_closures(self):
+        chunk = compile_text("{ var a = 1; fun f() { return a; } { var b; } a = 2; }")
+        function = chunk.constants[chunk.code[chunk.code.index(OP_FUNCTION) + 1]]
+        self.assertEqual(((True, 0),), function.captures)
+        self.assertIn((OP_GET_UPVALUE, 0), list(instructions(function)))
+        ops = list(instructions(chunk))
+        self.assertEqual((OP_BOX,), ops[1])
+        self.assertIn((OP_SET_CELL, 0), ops)
+
+    def test_disassemble(self):
+        chunk = compile_text("fun f(n) {\n  return n * 2;\n}\nprint f(1);")
+        text = disassemble(chunk)
+        self.assertIn("== <script> ==", text)
+        self.assertIn("FUNCTION             0 (<fn f>)", text)
+        self.assertIn("== f ==", text)
+        self.assertIn("0000    2 GET_LOCAL            0", text)
+        self.assertIn("MULTIPLY", text)
+
+
+if __name__ == "__main__":
+    unittest.main()
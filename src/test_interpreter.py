@@ -1,16 +1,38 @@
 from io import StringIO
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
 from unittest.mock import patch
-from lexer import Lexer, RTError, InvalidSyntaxError, ErrorDetails
-from parser import Parser
-from interpreter import Interpreter
+from lexer import Lexer, RegexLexer, RTError, InvalidSyntaxError, ErrorDetails
+from parser import Parser, PrattParser
+from interpreter import (
+    GENERIC_HANDLERS,
+    MAX_DEOPTS,
+    QUICKEN_THRESHOLD,
+    Interpreter,
+    add_numbers,
+    add_strings,
+    less_numbers,
+)
+from closure_compiler import ClosureInterpreter
+from transpiler import PythonInterpreter
+from vm import VM
+from lox import Lox
 
 
 class TestInterpreter(unittest.TestCase):
+    lexer_class = Lexer
+    parser_class = Parser
+    interpreter_class = Interpreter
+    buffered = False
+    tail_calls = True
+
     def makeInterpreter(self, text):
-        interpreter = Interpreter()
-        lexer = Lexer("stdin", text)
-        parser = Parser(lexer)
+        interpreter = self.interpreter_class()
+        lexer = self.lexer_class("stdin", text)
+        parser = self.parser_class(lexer.tokenize() if self.buffered else lexer)
         return interpreter.interpret(parser)
 
     def test_expression0(self):
@@ -117,47 +139,47 @@ class TestInterpreter(unittest.TestCase):
 
     def test_expression25(self):
         result = self.makeInterpreter("1 == 1;")
-        self.assertEqual(result, "true")
+        self.assertIs(result, True)
 
     def test_expression26(self):
         result = self.makeInterpreter("1 == 2;")
-        self.assertEqual(result, "false")
+        self.assertIs(result, False)
 
     def test_expression27(self):
         result = self.makeInterpreter("1 != 1;")
-        self.assertEqual(result, "false")
+        self.assertIs(result, False)
 
     def test_expression28(self):
         result = self.makeInterpreter("1 != 2;")
-        self.assertEqual(result, "true")
+        self.assertIs(result, True)
 
     def test_expression29(self):
         result = self.makeInterpreter('"a" == "a";')
-        self.assertEqual(result, "true")
+        self.assertIs(result, True)
 
     def test_expression30(self):
         result = self.makeInterpreter('"a" == "b";')
-        self.assertEqual(result, "false")
+        self.assertIs(result, False)
 
     def test_expression31(self):
         result = self.makeInterpreter('"a" != "b";')
-        self.assertEqual(result, "true")
+        self.assertIs(result, True)
 
     def test_expression32(self):
         result = self.makeInterpreter('"a" != "a";')
-        self.assertEqual(result, "false")
+        self.assertIs(result, False)
 
     def test_expression33(self):
         result = self.makeInterpreter("nil == 1;")
-        self.assertEqual(result, "false")
+        self.assertIs(result, False)
 
     def test_expression34(self):
         result = self.makeInterpreter('"a" == true;')
-        self.assertEqual(result, "false")
+        self.assertIs(result, False)
 
     def test_expression34(self):
         result = self.makeInterpreter("false == -1;")
-        self.assertEqual(result, "false")
+        self.assertIs(result, False)
 
     def test_expression35(self):
         result = self.makeInterpreter('"a" + "b";')
@@ -165,27 +187,27 @@ class TestInterpreter(unittest.TestCase):
 
     def test_expression36(self):
         result = self.makeInterpreter("1 > 0;")
-        self.assertEqual(result, "true")
+        self.assertIs(result, True)
 
     def test_expression37(self):
         result = self.makeInterpreter("0.1 >= 0;")
-        self.assertEqual(result, "true")
+        self.assertIs(result, True)
 
     def test_expression38(self):
         result = self.makeInterpreter("1 < 1.1;")
-        self.assertEqual(result, "true")
+        self.assertIs(result, True)
 
     def test_expression39(self):
         result = self.makeInterpreter("1 <= 1;")
-        self.assertEqual(result, "true")
+        self.assertIs(result, True)
 
     def test_expression40(self):
         result = self.makeInterpreter("1 < 1;")
-        self.assertEqual(result, "false")
+        self.assertIs(result, False)
 
     def test_expression41(self):
         result = self.makeInterpreter("1 > 1;")
-        self.assertEqual(result, "false")
+        self.assertIs(result, False)
 
     def test_expression_division_by_zero(self):
         with self.assertRaises(RTError) as e:
@@ -397,6 +419,41 @@ class TestInterpreter(unittest.TestCase):
             f"{ErrorDetails.UNDEFINED_VARIABLE.value} 'b'", e.exception.args[2]
         )
 
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_scope2(self, mock_stdout):
+        text = """
+        var a = "global";
+        {
+            var a = "outer";
+            {
+                print a;
+                var a = a + " shadowed";
+                {
+                    { a = a + " again"; }
+                    print a;
+                }
+            }
+            print a;
+        }
+        print a;
+        """
+        self.makeInterpreter(text)
+        self.assertEqual(
+            mock_stdout.getvalue(),
+            "outer\nouter shadowed again\nouter\nglobal\n",
+        )
+
+    def test_scope_errors2(self):
+        text = """
+        {
+            var a = 1;
+            var a = 2;
+        }
+        """
+        with self.assertRaises(RTError) as e:
+            self.makeInterpreter(text)
+        self.assertEqual(f"Variable 'a' already defined", e.exception.args[2])
+
     def test_arithmetic_ops_errors1(self):
         text = """
         var a;
@@ -954,6 +1011,601 @@ class TestInterpreter(unittest.TestCase):
         self.makeInterpreter(text)
         self.assertEqual(mock_stdout.getvalue(), "no return\nnil\n")
 
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_return4(self, mock_stdout):
+        text = """
+        fun find(limit) {
+            var i = 0;
+            while (true) {
+                {
+                    if (i == limit) {
+                        var found = i * 10;
+                        return found;
+                    } else print i;
+                }
+                i = i + 1;
+            }
+            print "unreachable";
+        }
+        print find(2);
+        print find(0);
+        """
+        self.makeInterpreter(text)
+        self.assertEqual(mock_stdout.getvalue(), "0.0\n1.0\n20.0\n0.0\n")
+
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_return5(self, mock_stdout):
+        text = """
+        fun inner() { while (true) return; }
+        fun outer() {
+            if (false) return 1; else { inner(); print "after inner"; }
+            return 2;
+        }
+        print outer();
+        print inner();
+        """
+        self.makeInterpreter(text)
+        self.assertEqual(mock_stdout.getvalue(), "after inner\n2.0\nnil\n")
+
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_for_loops(self, mock_stdout):
+        text = """
+        fun first(limit) {
+            for (var i = 0;; i = i + 1) if (i * i > limit) return i;
+        }
+        var i = "global";
+        for (var i = 0; i < 2; i = i + 1) { var i = "body"; print i; }
+        for (var j = 0; j < 2;) { print j; j = j + 1; }
+        var k = 0;
+        for (k = 5; k < 7; k = k + 1) {}
+        print i;
+        print k;
+        print first(10);
+        """
+        self.makeInterpreter(text)
+        self.assertEqual(
+            mock_stdout.getvalue(), "body\nbody\n0.0\n1.0\nglobal\n7.0\n4.0\n"
+        )
+
+    def test_for_loop_scope(self):
+        with self.assertRaises(RTError) as e:
+            self.makeInterpreter("for (var i = 0; i < 1; i = i + 1) {} print i;")
+        self.assertEqual(
+            f"{ErrorDetails.UNDEFINED_VARIABLE.value} 'i'", e.exception.args[2]
+        )
+
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_tail_calls(self, mock_stdout):
+        if not self.tail_calls:
+            self.skipTest("backend does not eliminate tail calls")
+        text = """
+        fun count(n, total) {
+            if (n == 0) return total;
+            { return count(n - 1, total + n); }
+        }
+        fun even(n) { while (true) { if (n == 0) return true; return odd(n - 1); } }
+        fun odd(n) { if (n == 0) return false; else return even(n - 1); }
+        fun now() { return clock(); }
+        print count(5000, 0);
+        print even(5001);
+        print now() > 0;
+        """
+        self.makeInterpreter(text)
+        self.assertEqual(mock_stdout.getvalue(), "12502500.0\nfalse\ntrue\n")
+
+    def test_stack_overflow(self):
+        text = """
+        fun f(n) {
+            return f(n + 1) + 1;
+        }
+        f(0);
+        """
+        with self.assertRaises(RTError) as e:
+            self.makeInterpreter(text)
+        self.assertEqual(ErrorDetails.STACK_OVERFLOW, e.exception.args[2])
+        self.assertEqual((2, 23), (e.exception.pos_start.ln, e.exception.pos_start.col))
+
+    def test_function_declaration_errors4(self):
+        text = """
+        fun f(a, a) {}
+        f(1, 2);
+        """
+        with self.assertRaises(RTError) as e:
+            self.makeInterpreter(text)
+        self.assertEqual(f"Variable 'a' already defined", e.exception.args[2])
+
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_closures(self, mock_stdout):
+        text = """
+        fun counter() {
+            var count = 0;
+            fun increment() { count = count + 1; return count; }
+            return increment;
+        }
+        var a = counter();
+        var b = counter();
+        a(); a();
+        print a();
+        print b();
+        fun adder(n) { fun add(x) { return x + n; } return add; }
+        print adder(1)(2);
+        fun outer() {
+            var x = "before";
+            fun middle() { fun inner() { return x; } return inner; }
+            var get = middle();
+            x = "after";
+            return get;
+        }
+        print outer()();
+        """
+        self.makeInterpreter(text)
+        self.assertEqual(mock_stdout.getvalue(), "3.0\n1.0\n3.0\nafter\n")
+
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_closures_capture_each_declaration(self, mock_stdout):
+        text = """
+        var first;
+        var last;
+        for (var i = 0; i < 3; i = i + 1) {
+            var j = i;
+            fun get() { return i + j; }
+            if (j == 0) first = get;
+            last = get;
+        }
+        print first();
+        print last();
+        {
+            fun fib(n) { if (n < 2) return n; return fib(n - 1) + fib(n - 2); }
+            print fib(10);
+        }
+        """
+        self.makeInterpreter(text)
+        # i is one variable for the whole loop, j a new one per iteration
+        self.assertEqual(mock_stdout.getvalue(), "3.0\n5.0\n55.0\n")
+
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_global_defined_after_use(self, mock_stdout):
+        text = """
+        fun get() { return later; }
+        fun set(value) { later = value; }
+        var first = 1;
+        var later = "defined";
+        print get();
+        set("assigned");
+        var last = 2;
+        print later;
+        print get();
+        """
+        self.makeInterpreter(text)
+        self.assertEqual(mock_stdout.getvalue(), "defined\nassigned\nassigned\n")
+
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_deep_nesting(self, mock_stdout):
+        # Deeper than CPython allows in the source the python backend makes
+        chain = " + ".join(["1"] * 300)
+        loops = "while (i < 1) { " * 25 + "i = i + 1; " + "}" * 25
+        self.makeInterpreter(f"print {chain}; var i = 0; {loops} print i;")
+        self.assertEqual(mock_stdout.getvalue(), "300.0\n1.0\n")
+
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_pure_functions_are_memoized(self, mock_stdout):
+        # Without memoization these would make about 10^12 and 10^9 calls
+        text = """
+        fun fib(n) { if (n < 2) return n; return fib(n - 1) + fib(n - 2); }
+        fun paths(x, y) {
+            if (x == 0 or y == 0) return 1;
+            return paths(x - 1, y) + paths(x, y - 1);
+        }
+        print fib(60);
+        print paths(16, 16);
+        """
+        self.makeInterpreter(text)
+        self.assertEqual(mock_stdout.getvalue(), "1548008755920.0\n601080390.0\n")
+
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_impure_functions_are_not_memoized(self, mock_stdout):
+        text = """
+        var k = 1;
+        fun scaled(n) { if (n == 0) return k; return scaled(n - 1) * 2; }
+        print scaled(2);
+        k = 2;
+        print scaled(2);
+        fun base(n) { return n; }
+        fun double(n) { return n * 2; }
+        fun total(n) { if (n == 0) return 0; return base(n) + total(n - 1); }
+        print total(3);
+        base = double;
+        print total(3);
+        fun shout(n) { print n; if (n > 0) shout(n - 1); }
+        shout(0);
+        shout(0);
+        fun same(x, n) { if (n > 0) return same(x, n - 1); return x; }
+        print same(1, 1);
+        print same(true, 1);
+        fun negate(x, n) { if (n > 0) return negate(x, n - 1); return -x; }
+        print negate(0, 1);
+        print negate(-0, 1);
+        """
+        self.makeInterpreter(text)
+        self.assertEqual(
+            mock_stdout.getvalue(),
+            "4.0\n8.0\n6.0\n12.0\n0.0\n0.0\n1.0\ntrue\n-0.0\n0.0\n",
+        )
+
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_memoize(self, mock_stdout):
+        text = """
+        var calls = 0;
+        fun square(n) { calls = calls + 1; return n * n; }
+        var fast = memoize(square);
+        print fast(3) + fast(3) + fast(4);
+        print calls;
+        print square(3);
+        print calls;
+        print memoize(1);
+        """
+        self.makeInterpreter(text)
+        self.assertEqual(mock_stdout.getvalue(), "34.0\n2.0\n9.0\n3.0\n1.0\n")
+
+
+class TestLox(unittest.TestCase):
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_run_file(self, mock_stdout):
+        text = """
+        fun add(a, b) {
+            return a + b;
+        }
+        var x = 0;
+        while (x < 3) {
+            print add(x, 10);
+            x = x + 1;
+        }
+        """
+        with tempfile.NamedTemporaryFile("w", suffix=".lox", delete=False) as f:
+            f.write(text)
+        try:
+            Lox().run_file(f.name)
+        finally:
+            os.unlink(f.name)
+        self.assertEqual(mock_stdout.getvalue(), "10.0\n11.0\n12.0\n")
+
+    def test_repl_prints_lox_values(self):
+        shell = os.path.join(os.path.dirname(os.path.abspath(__file__)), "shell.py")
+        output = subprocess.run(
+            [sys.executable, shell],
+            input=(
+                '1 == 1;\n1 > 2;\n"a" + "b";\n2 * 2;\nnil;\n'
+                "fun f() {}\nf();\nvar a;\na;\nprint 1;\n"
+            ),
+            capture_output=True,
+            text=True,
+        ).stdout
+        self.assertEqual(
+            "> true\n> false\n> ab\n> 4.0\n> nil\n> > nil\n> > nil\n> 1.0\n> ",
+            output,
+        )
+
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_closure_backend(self, mock_stdout):
+        lox = Lox(backend="closure")
+        self.assertIsInstance(lox.interpreter, ClosureInterpreter)
+        lox.run("fun twice(n) { return n * 2; } var x = 1;")
+        for _ in range(2):
+            lox.run("x = twice(x); print x;")
+        self.assertEqual(mock_stdout.getvalue(), "2.0\n4.0\n")
+
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_global_cache_across_runs(self, mock_stdout):
+        for backend in ("tree", "closure", "vm", "python"):
+            lox = Lox(backend=backend)
+            lox.run("fun get() { return g; } fun set() { g = 3; }")
+            for source in ("get();", "set();"):
+                with self.assertRaises(RTError) as e:
+                    lox.run(source)
+                self.assertEqual("Undefined variable 'g'", e.exception.args[2])
+            lox.run("var g = 1; print get(); set(); print get();")
+        self.assertEqual(mock_stdout.getvalue(), "1.0\n3.0\n" * 4)
+
+    def test_memo_info(self):
+        text = """
+        fun fib(n) { if (n < 2) return n; return fib(n - 1) + fib(n - 2); }
+        fun id(x) { return x; }
+        var fast = memoize(id);
+        fib(30);
+        """
+        for backend in ("tree", "closure", "vm", "python"):
+            with self.subTest(backend=backend):
+                lox = Lox(backend=backend, memo_entries=16)
+                lox.run(text)
+                # fib(30) computes each of fib(0) to fib(30) once, and the
+                # second call of fib(n) with n >= 2 is a hit
+                info = lox.memo_info("fib")
+                self.assertEqual((info.hits, info.misses), (28, 31))
+                self.assertEqual((info.evictions, info.entries), (15, 16))
+                lox.run("fast(1); fast(1);")
+                info = lox.memo_info("fast")
+                self.assertEqual((info.hits, info.misses, info.entries), (1, 1, 1))
+                # A function that calls nothing is not worth a table
+                self.assertIsNone(lox.memo_info("id"))
+                self.assertIsNone(lox.memo_info("clock"))
+                self.assertIsNone(lox.memo_info("missing"))
+                self.assertIsNone(Lox(memo_entries=0).memo_info("fib"))
+
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_disk_cache(self, mock_stdout):
+        text = """
+        fun square(n) {
+            return n * n;
+        }
+        print square(3);
+        """
+        with tempfile.TemporaryDirectory() as cache_dir:
+            Lox(cache_dir=cache_dir).run(text)
+            entries = os.listdir(cache_dir)
+            self.assertEqual(len(entries), 1)
+            with patch.object(Lox, "parse", side_effect=AssertionError):
+                Lox(cache_dir=cache_dir).run(text)
+            Lox(cache_dir=cache_dir).run(text.replace("3", "4"))
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+        self.assertEqual(mock_stdout.getvalue(), "9.0\n9.0\n16.0\n")
+
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_memory_cache(self, mock_stdout):
+        lox = Lox(cache_entries=2)
+        for text in ("print 1;", "print 2;", "print 1;", "print 3;", "print 2;"):
+            lox.run(text)
+        info = lox.cache_info()
+        self.assertEqual((info.hits, info.misses, info.evictions), (1, 4, 2))
+        self.assertEqual(info.entries, 2)
+        self.assertEqual(mock_stdout.getvalue(), "1.0\n2.0\n1.0\n3.0\n2.0\n")
+
+    def test_memory_cache_size_limit(self):
+        lox = Lox(cache_size=20)
+        lox.run("var a = 1;")
+        lox.run("var b = 2;")
+        lox.run("var c = 3;")
+        info = lox.cache_info()
+        self.assertEqual((info.entries, info.size, info.evictions), (2, 20, 1))
+
+    def test_disk_cache_corrupt_entry(self):
+        text = "var a = 1;\nvar b = a + nil;\n"
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with self.assertRaises(RTError) as first:
+                Lox(cache_dir=cache_dir).run(text)
+            with self.assertRaises(RTError) as cached:
+                Lox(cache_dir=cache_dir).run(text)
+            self.assertEqual(first.exception.as_string(), cached.exception.as_string())
+            [entry] = os.listdir(cache_dir)
+            with open(os.path.join(cache_dir, entry), "r+b") as file:
+                file.truncate(80)
+            with self.assertRaises(RTError) as reparsed:
+                Lox(cache_dir=cache_dir).run(text)
+            self.assertEqual(first.exception.as_string(), reparsed.exception.as_string())
+
+
+class TestQuickening(unittest.TestCase):
+    def setUp(self):
+        # The calls repeat their arguments, which memoization would answer
+        self.interpreter = Interpreter(memo_entries=0)
+
+    def run_lox(self, text):
+        tree = PrattParser(RegexLexer("stdin", text)).parse()
+        return self.interpreter.execute(self.interpreter.prepare(tree))
+
+    def define(self, text):
+        # Returns the BinOp in the return statement of the declared function
+        tree = PrattParser(RegexLexer("stdin", text)).parse()
+        self.interpreter.execute(self.interpreter.prepare(tree))
+        return tree[0].body[0].value
+
+    def call(self, times, arguments):
+        for _ in range(times):
+            result = self.run_lox(f"f({arguments});")
+        return result
+
+    def test_quickens_stable_types(self):
+        site = self.define("fun f(a, b) { return a + b; }")
+        self.assertIsNone(site.handler)
+        self.call(QUICKEN_THRESHOLD - 1, "1, 2")
+        self.assertIs(GENERIC_HANDLERS[site.op.type], site.handler)
+        self.assertEqual(3, self.call(1, "1, 2"))
+        self.assertIs(add_numbers, site.handler)
+
+    def test_deoptimizes_on_new_types(self):
+        site = self.define("fun f(a, b) { return a + b; }")
+        self.call(QUICKEN_THRESHOLD, "1, 2")
+        self.assertEqual("ab", self.call(1, '"a", "b"'))
+        self.assertIs(GENERIC_HANDLERS[site.op.type], site.handler)
+        self.call(QUICKEN_THRESHOLD, '"a", "b"')
+        self.assertIs(add_strings, site.handler)
+
+    def test_unstable_sites_stay_generic(self):
+        site = self.define("fun f(a, b) { return a < b; }")
+        for _ in range(MAX_DEOPTS):
+            self.call(QUICKEN_THRESHOLD, "1, 2")
+            self.assertIs(less_numbers, site.handler)
+            with self.assertRaises(RTError):
+                self.call(1, "1, nil")
+        self.call(QUICKEN_THRESHOLD * 2, "1, 2")
+        self.assertIs(GENERIC_HANDLERS[site.op.type], site.handler)
+
+    def test_quickened_errors(self):
+        cases = [
+            ("a - b", '1, "x"'),
+            ("a + b", '1, "x"'),
+            ("a / b", "1, 0"),
+            ("a == b", "1, clock"),
+        ]
+        for expr, arguments in cases:
+            with self.subTest(expr=expr):
+                site = self.define(f"fun f(a, b) {{ return {expr}; }}")
+                with self.assertRaises(RTError) as generic:
+                    self.call(1, arguments)
+                self.call(QUICKEN_THRESHOLD, "4, 2")
+                self.assertIsNot(GENERIC_HANDLERS[site.op.type], site.handler)
+                with self.assertRaises(RTError) as quickened:
+                    self.call(1, arguments)
+                self.assertEqual(
+                    generic.exception.as_string(), quickened.exception.as_string()
+                )
+                self.interpreter = Interpreter(memo_entries=0)
+
+
+BACKEND_PROGRAMS = [
+    "print 1 + 2 * 3 - 4 / 8;",
+    'print "a" + "b"; print "a" == nil; print 1 != "1";',
+    "var a = 1; { var a = a + 1; { print a; a = 5; } print a; } print a;",
+    "var i = 0; while (i < 3 and true) { print i; i = i + 1; }",
+    "fun f(n) { if (n < 2) return n; return f(n - 1) + f(n - 2); } print f(10);",
+    "fun f() { return; } var r = f(); print r;",
+    "fun f(n) { while (true) { if (n > 2) { return n; } n = n + 1; } } print f(0);",
+    "fun f() {} print f(); print f; print clock;",
+    "print clock() > 0; clock(1);",
+    "fun f(a, b, c) { var d = a + b; { var e = d + c; return e; } } print f(1, 2, 3);",
+    "print nil or false or 0; print 1 and nil;",
+    "print -1 + !nil;",
+    "print 1 + nil;",
+    "print 1 / 0;",
+    "print 1 < 2 + nil;",
+    "print -nil;",
+    "print undefined;",
+    "undefined = 1;",
+    "{ var a = 1; var a = 2; }",
+    "fun f(a, a) {} f(1, 2);",
+    "fun f(a) {} f();",
+    "fun f(a) {} f(1, 2);",
+    "for (var i = 0; i < 3; i = i + 1) { var j = i * 2; print j; } print i;",
+    "var n = 0; for (;; n = n + 1) if (n > 2) { print n; for (;;) n(); }",
+    "fun g(a) {} fun f() { return g(); } f();",
+    "fun f() { return nil(); } f();",
+    "fun f(n) { if (n > 0) return f(n - 1); return n; } print f(10);",
+    'var s = "x"; s(print_arg());',
+    "fun g() { print 1; return 1 + nil; } fun f() { return g(); } f();",
+    "fun f(a) { fun g() { a = a + 1; return a; } g(); return g; } print f(1)();",
+    "fun f() { var a; fun g() { return a + 1; } return g; } f()();",
+    "{ var a = 1; fun g() { a = a + 1; } g(); print a; { var a = 5; g(); } print a; }",
+    "fun f() { fun g() { return g; } return g; } print f()();",
+    "fun f() { var a = 1; fun a() { return a; } } f();",
+]
+
+
+class TestFramePool(unittest.TestCase):
+    def test_frames_are_reused(self):
+        text = """
+        fun fib(n) {
+            if (n < 2) return n;
+            return fib(n - 1) + fib(n - 2);
+        }
+        print fib(10);
+        """
+        for backend in ("tree", "closure"):
+            with self.subTest(backend=backend):
+                lox = Lox(backend=backend, memo_entries=0)
+                with patch("sys.stdout", new_callable=StringIO) as stdout:
+                    lox.run(text)
+                self.assertEqual("55.0\n", stdout.getvalue())
+                # fib(10) makes 177 calls, at most 10 of them live at once
+                info = lox.pool_info()
+                self.assertEqual((info.hits, info.misses, info.free), (167, 10, 10))
+
+    def test_blocks_and_loops_are_reused(self):
+        text = """
+        for (var i = 0; i < 3; i = i + 1) {
+            var a;
+            print a;
+            a = i;
+        }
+        """
+        for backend in ("tree", "closure"):
+            with self.subTest(backend=backend):
+                lox = Lox(backend=backend)
+                with patch("sys.stdout", new_callable=StringIO) as stdout:
+                    lox.run(text)
+                    lox.run(text)
+                self.assertEqual("nil\n" * 6, stdout.getvalue())
+                info = lox.pool_info()
+                self.assertEqual((info.hits, info.misses, info.free), (6, 2, 2))
+
+    def test_error_leaves_pool_usable(self):
+        lox = Lox()
+        lox.run("fun f(n) { if (n == 0) return n + nil; return f(n - 1); }")
+        with self.assertRaises(RTError):
+            lox.run("f(3);")
+        with patch("sys.stdout", new_callable=StringIO) as stdout:
+            lox.run("fun g(a, b) { return a + b; } print g(1, 2);")
+        self.assertEqual("3.0\n", stdout.getvalue())
+        # The tail calls in f reuse one frame, which the error abandons
+        info = lox.pool_info()
+        self.assertEqual((info.hits, info.misses, info.free), (3, 2, 1))
+
+
+class TestVM(unittest.TestCase):
+    def test_deep_recursion(self):
+        text = """
+        fun depth(n) {
+            if (n == 0) return 0;
+            return depth(n - 1) + 1;
+        }
+        print depth(5000);
+        """
+        with patch("sys.stdout", new_callable=StringIO) as stdout:
+            Lox(backend="vm").run(text)
+        self.assertEqual("5000.0\n", stdout.getvalue())
+        with self.assertRaises(RTError) as e:
+            Lox(backend="vm", max_depth=100).run(text)
+        self.assertEqual(ErrorDetails.STACK_OVERFLOW, e.exception.args[2])
+        self.assertEqual(3, e.exception.pos_start.ln)
+
+
+class TestBackends(unittest.TestCase):
+    def run_program(self, backend, text):
+        with patch("sys.stdout", new_callable=StringIO) as stdout:
+            try:
+                result = Lox(backend=backend).run(text)
+            except RTError as e:
+                result = (e.pos_start.idx, e.pos_end.idx, e.details)
+        return stdout.getvalue(), result
+
+    def test_same_output_and_errors(self):
+        for text in BACKEND_PROGRAMS:
+            expected = self.run_program("tree", text)
+            for backend in ("closure", "vm", "python"):
+                with self.subTest(backend=backend, text=text):
+                    self.assertEqual(expected, self.run_program(backend, text))
+
+
+class TestInterpreterRegexLexer(TestInterpreter):
+    lexer_class = RegexLexer
+
+
+class TestInterpreterTokenBuffer(TestInterpreter):
+    lexer_class = RegexLexer
+    buffered = True
+
+
+class TestInterpreterPrattParser(TestInterpreter):
+    lexer_class = RegexLexer
+    parser_class = PrattParser
+
+
+class TestInterpreterClosureCompiler(TestInterpreter):
+    lexer_class = RegexLexer
+    parser_class = PrattParser
+    interpreter_class = ClosureInterpreter
+
+
+class TestInterpreterVM(TestInterpreter):
+    lexer_class = RegexLexer
+    parser_class = PrattParser
+    interpreter_class = VM
+
+
+class TestInterpreterPython(TestInterpreter):
+    lexer_class = RegexLexer
+    parser_class = PrattParser
+    interpreter_class = PythonInterpreter
+    tail_calls = False
+
 
 if __name__ == "__main__":
     unittest.main()
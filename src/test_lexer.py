@@ -0,0 +1,157 @@
+import os
+import tempfile
+import unittest
+from lexer import (
+    Lexer,
+    RegexLexer,
+    FileLexer,
+    Error,
+    TT_EOF,
+    TT_IDENTIFIER,
+    TT_NUMBER,
+)
+
+
+SOURCES = [
+    "1 + 2 * (3 - 4) / 5;",
+    "var a = 1; a = a + 1; print a;",
+    'print "hello" + " " + "world";',
+    'var s = "multi\nline\nstring"; print s;',
+    "if (a <= b and c >= d or !e) { print a != b; } else { print a == b; }",
+    "fun add(a, b, c) { return a + b + c; }\nadd(1, 2, 3);",
+    "// comment only",
+    "1; // trailing comment\n2;",
+    "for (var i = 0; i < 10; i = i + 1) print i;",
+    "a_1 = b2_c;\n\n\t  x = 0.25;",
+    "1.5.5",
+    "1.",
+    "\n\n  12.",
+    '"unterminated',
+    'print "ok";\n"unterminated\n',
+    "var a = 1;\n  @",
+    "_a",
+    ".5",
+    "a\r\n",
+]
+
+
+def read_tokens(lexer, catch=True):
+    result = []
+    try:
+        while True:
+            token = lexer.get_next_token()
+            result.append((token.type, token.value, token.start, token.end))
+            if token.type == TT_EOF:
+                return result
+    except Error as e:
+        if not catch:
+            raise
+        result.append((type(e).__name__, e.details, e.pos_start.idx))
+        return result
+
+
+def tokenize(lexer):
+    tokens = []
+    try:
+        while True:
+            token = lexer.get_next_token()
+            tokens.append(
+                (
+                    token.type,
+                    token.value,
+                    token.pos_start.idx,
+                    token.pos_start.ln,
+                    token.pos_start.col,
+                )
+            )
+            if token.type == TT_EOF:
+                return tokens
+    except Error as e:
+        tokens.append(
+            (
+                type(e).__name__,
+                e.details,
+                e.pos_start.idx,
+                e.pos_start.ln,
+                e.pos_start.col,
+            )
+        )
+        return tokens
+
+
+class TestRegexLexer(unittest.TestCase):
+    def test_same_tokens_as_lexer(self):
+        for text in SOURCES:
+            with self.subTest(text=text):
+                self.assertEqual(
+                    tokenize(RegexLexer("stdin", text)),
+                    tokenize(Lexer("stdin", text)),
+                )
+
+    def test_token_buffer(self):
+        for lexer_class in (Lexer, RegexLexer):
+            for text in SOURCES:
+                with self.subTest(lexer=lexer_class.__name__, text=text):
+                    self.assertEqual(
+                        read_tokens(lexer_class("stdin", text).tokenize()),
+                        read_tokens(lexer_class("stdin", text)),
+                    )
+
+    def test_token_buffer_lookahead(self):
+        tokens = RegexLexer("stdin", "var a = 1;").tokenize()
+        self.assertEqual(tokens.peek_type(3), TT_NUMBER)
+        self.assertEqual(tokens.get_next_token().value, "var")
+        self.assertEqual(tokens.peek_type(), TT_IDENTIFIER)
+        self.assertEqual(tokens.peek_type(10), TT_EOF)
+        self.assertEqual(tokens.values.count("a"), 1)
+
+    def test_file_lexer(self):
+        for text in SOURCES:
+            with self.subTest(text=text):
+                with tempfile.NamedTemporaryFile("w", suffix=".lox", delete=False) as f:
+                    f.write(text)
+                try:
+                    with open(f.name, "r") as file:
+                        tokens = read_tokens(FileLexer(f.name, file, chunk_size=3))
+                    with open(f.name, "r") as file:
+                        expected = read_tokens(RegexLexer(f.name, file.read()))
+                    self.assertEqual(tokens, expected)
+                finally:
+                    os.unlink(f.name)
+
+    def test_file_lexer_error_line(self):
+        text = "var a = 1;\nvar b = 2;\nprint a + b;  @\nprint b;\n"
+        with tempfile.NamedTemporaryFile("w", suffix=".lox", delete=False) as f:
+            f.write(text)
+        try:
+            with open(f.name, "r") as file:
+                with self.assertRaises(Error) as file_error:
+                    read_tokens(FileLexer(f.name, file, chunk_size=4), catch=False)
+            with self.assertRaises(Error) as text_error:
+                read_tokens(RegexLexer(f.name, text), catch=False)
+            self.assertEqual(
+                file_error.exception.as_string(), text_error.exception.as_string()
+            )
+            self.assertIn("print a + b;  @", file_error.exception.as_string())
+        finally:
+            os.unlink(f.name)
+
+    def test_interning(self):
+        text = 'var name = "literal"; name = "liter" + "al"; print name + "literal";'
+        for lexer_class in (Lexer, RegexLexer):
+            with self.subTest(lexer=lexer_class.__name__):
+                tokens = read_tokens(lexer_class("stdin", text))
+                names = [value for _, value, _, _ in tokens if value == "name"]
+                literals = [value for _, value, _, _ in tokens if value == "literal"]
+                self.assertEqual(len(names), 3)
+                self.assertEqual(len(literals), 2)
+                self.assertEqual(len({id(value) for value in names}), 1)
+                self.assertEqual(len({id(value) for value in literals}), 1)
+
+    def test_empty_input(self):
+        token = RegexLexer("stdin", "").get_next_token()
+        self.assertEqual(token.type, TT_EOF)
+
+
+if __name__ == "__main__":
+    unittest.main()
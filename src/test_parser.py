@@ -0,0 +1,91 @@
+import unittest
+import parser as lox_parser
+from lexer import RegexLexer, Error, Token
+from parser import AST, Stmt, Parser, PrattParser
+
+
+SOURCES = [
+    "1 + 2 * 3 - 4 / 5;",
+    "-1 - -2 * !true;",
+    "!!a == b != c;",
+    "a < b == c >= d;",
+    "a or b and c or d and !e;",
+    "x = y = 1 + 2;",
+    "(a) = 3;",
+    "f(1, g(2), h)(3)();",
+    "-f(1)(2);",
+    "print (1 + 2) * (3 - (4 / 5));",
+    "var a; var b = nil; var c = true; var d = false;",
+    "{ var a = 1; { print a; } }",
+    "if (a) print 1; else if (b) print 2; else { print 3; }",
+    "while (a < 10) a = a + 1;",
+    "for (var i = 0; i < 10; i = i + 1) print i;",
+    "for (;;) {}",
+    "fun f(a, b) { return a + b; } fun g() { return; }",
+    'print "a" + "b";',
+    # errors
+    "1 +",
+    "(1 + 2;",
+    "1 + 2 = 3;",
+    "f() = 1;",
+    "a = ;",
+    "var = 1;",
+    "print 1",
+    "fun (a) {}",
+    "fun f(a b) {}",
+    "if a) print 1;",
+    "for (var i = 0; i < 1; i = i + 1 print i;",
+    "{ print 1;",
+    "print print;",
+    "return 1",
+]
+
+
+def dump(value):
+    if isinstance(value, list):
+        return [dump(item) for item in value]
+    if isinstance(value, Token):
+        return (value.type, value.value, value.start, value.end)
+    if isinstance(value, (AST, Stmt)):
+        fields = []
+        for cls in type(value).__mro__:
+            fields.extend(getattr(cls, "__slots__", ()))
+        return (type(value).__name__,) + tuple(
+            dump(getattr(value, field)) for field in fields
+        )
+    return value
+
+
+def parse(parser_class, text):
+    try:
+        return dump(parser_class(RegexLexer("stdin", text)).parse())
+    except Error as e:
+        return (type(e).__name__, e.details, e.pos_start.idx)
+
+
+class TestAST(unittest.TestCase):
+    def test_nodes_have_no_instance_dict(self):
+        for name in dir(lox_parser):
+            cls = getattr(lox_parser, name)
+            if isinstance(cls, type) and issubclass(cls, (AST, Stmt)):
+                with self.subTest(node=name):
+                    self.assertEqual(cls.__dictoffset__, 0)
+
+
+class TestPrattParser(unittest.TestCase):
+    def test_same_ast_as_parser(self):
+        for text in SOURCES:
+            with self.subTest(text=text):
+                self.assertEqual(parse(PrattParser, text), parse(Parser, text))
+
+    def test_deeply_nested_expression(self):
+        depth = 200
+        text = "(" * depth + "1" + " + 1)" * depth + ";"
+        with self.assertRaises(RecursionError):
+            Parser(RegexLexer("stdin", text)).parse()
+        tree = PrattParser(RegexLexer("stdin", text)).parse()
+        self.assertEqual(len(tree), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+import unittest
+from lexer import RegexLexer
+from parser import AST, Identifier, PrattParser, ReturnStmt, Stmt
+from resolver import Resolver
+
+
+def resolve(text):
+    tree = PrattParser(RegexLexer("stdin", text)).parse()
+    return Resolver().resolve(tree)
+
+
+def walk_nodes(value):
+    if isinstance(value, list):
+        for item in value:
+            yield from walk_nodes(item)
+    elif isinstance(value, (AST, Stmt)):
+        yield value
+        for cls in type(value).__mro__:
+            for field in getattr(cls, "__slots__", ()):
+                yield from walk_nodes(getattr(value, field))
+
+
+def identifiers(tree):
+    return [
+        (node.token.value, node.depth, node.slot)
+        for node in walk_nodes(tree)
+        if isinstance(node, Identifier)
+    ]
+
+
+class TestResolver(unittest.TestCase):
+    def test_globals_have_no_slot(self):
+        tree = resolve("var a = 1; print a;")
+        self.assertIsNone(tree[0].slot)
+        self.assertEqual([("a", None, None)], identifiers(tree))
+
+    def test_tail_calls(self):
+        tree = resolve(
+            "fun f() { return f(); return f() + 1; { return g; } } return f();"
+        )
+        returns = [node for node in walk_nodes(tree) if type(node) is ReturnStmt]
+        self.assertEqual(
+            [True, False, False, False], [node.tail_call for node in returns]
+        )
+
+    def test_for_loop_scope(self):
+        tree = resolve("{ for (var i = 0; i < 3; i = i + 1) { var j = i; } }")
+        loop = tree[0].statements[0]
+        self.assertEqual(1, loop.size)
+        self.assertEqual(1, loop.body.size)
+        self.assertEqual(
+            [("i", 0, 0), ("i", 0, 0), ("i", 0, 0), ("i", 1, 0)], identifiers(tree)
+        )
+
+    def test_block_locals(self):
+        tree = resolve("{ var a = 1; var b = 2; print b; { var c; print a; } }")
+        self.assertEqual(2, tree[0].size)
+        self.assertEqual([0, 1], [stmt.slot for stmt in tree[0].statements[:2]])
+        self.assertEqual([("b", 0, 1), ("a", 1, 0)], identifiers(tree))
+
+    def test_blocks_without_declarations_have_no_scope(self):
+        tree = resolve(
+            "{ var a = 1; { print a; { fun f() {} } } for (a = 0; a; a = nil) {} }"
+        )
+        inner = tree[0].statements[1]
+        self.assertEqual(0, inner.size)
+        self.assertEqual(1, inner.statements[1].size)
+        self.assertEqual(0, tree[0].statements[2].size)
+        self.assertEqual([("a", 0, 0)] * 4, identifiers(tree))
+
+    def test_initializer_sees_outer_variable(self):
+        tree = resolve("{ var a = 1; { var a = a; print a; } }")
+        self.assertEqual([("a", 1, 0), ("a", 0, 0)], identifiers(tree))
+
+    def test_use_before_declaration_is_outer(self):
+        tree = resolve("{ print a; var a = 1; }")
+        self.assertEqual([("a", None, None)], identifiers(tree))
+
+    def test_redeclaration_reuses_slot(self):
+        tree = resolve("{ var a = 1; var a = 2; }")
+        self.assertEqual(1, tree[0].size)
+        self.assertEqual([0, 0], [stmt.slot for stmt in tree[0].statements])
+
+    def test_function_frame(self):
+        tree = resolve("{ var x; fun f(a, b) { var c = a; print x; } }")
+        function = tree[0].statements[1]
+        self.assertEqual(1, function.slot)
+        self.assertEqual((0, 1), function.param_slots)
+        self.assertEqual(3, function.size)
+        # Locals around the function are upvalues, not part of its frame
+        self.assertEqual([("a", 0, 0), ("x", None, None)], identifiers(tree))
+        self.assertEqual((("x", 0, 0),), function.upvalues)
+
+    def test_upvalues(self):
+        tree = resolve(
+            """
+            fun f(a, b) {
+                var c;
+                fun g() {
+                    fun h() { return a + c + a; }
+                    return b;
+                }
+                print c;
+            }
+            """
+        )
+        f = tree[0]
+        g = f.body[1]
+        h = g.body[0]
+        self.assertEqual((0, 1), f.boxed_params)
+        self.assertEqual((("a", 0, 0), ("c", 0, 2), ("b", 0, 1)), g.upvalues)
+        self.assertEqual((("a", None, 0), ("c", None, 1)), h.upvalues)
+        self.assertTrue(f.body[0].boxed)
+        self.assertFalse(g.boxed)
+        reads = [
+            (node.token.value, node.upvalue, node.boxed)
+            for node in walk_nodes(tree)
+            if isinstance(node, Identifier)
+        ]
+        self.assertEqual(
+            [
+                ("a", 0, False),
+                ("c", 1, False),
+                ("a", 0, False),
+                ("b", 2, False),
+                ("c", None, True),
+            ],
+            reads,
+        )
+
+    def test_pure_functions(self):
+        resolver = Resolver()
+        text = """
+        var k = 1;
+        fun fib(n) { if (n < 2) return n; return fib(n - 1) + fib(n - 2); }
+        fun scaled(n) { var a = n; a = a * k; return a; }
+        fun shout(n) { print n; }
+        fun bump() { k = k + 1; }
+        fun apply(f, n) { return f(n); }
+        fun outer(n) { fun inner() { return n; } return inner(); }
+        fun later() { return late(); }
+        """
+        tree = PrattParser(RegexLexer("stdin", text)).parse()
+        functions = resolver.resolve(tree)[1:]
+        outer = functions[-2]
+        self.assertEqual(
+            [True, True, False, False, False, False, True],
+            [function.pure for function in functions],
+        )
+        self.assertEqual(("fib",), functions[0].globals)
+        self.assertEqual(("k",), functions[1].globals)
+        self.assertEqual(("late",), functions[-1].globals)
+        self.assertEqual(
+            [True, False, False, False, True, True, True],
+            [function.calls for function in functions],
+        )
+        self.assertFalse(outer.body[0].pure)
+        self.assertEqual({"k"}, resolver.assigned)
+
+    def test_resolving_twice_gives_same_result(self):
+        tree = resolve("{ var a = 1; { var b = a; print b; } }")
+        before = identifiers(tree)
+        Resolver().resolve(tree)
+        self.assertEqual(before, identifiers(tree))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+from io import StringIO
+from unittest.mock import patch
+from lexer import RegexLexer, RTError
+from parser import PrattParser
+from resolver import Resolver
+from transpiler import PythonInterpreter, PythonProgram, Transpiler
+
+
+def transpile(text):
+    tree = PrattParser(RegexLexer("stdin", text)).parse()
+    return Transpiler().transpile(Resolver().resolve(tree))
+
+
+def run(text):
+    interpreter = PythonInterpreter()
+    tree = PrattParser(RegexLexer("stdin", text)).parse()
+    return interpreter.execute(interpreter.prepare(tree))
+
+
+class TestTranspiler(unittest.TestCase):
+    def test_source_is_kept(self):
+        program = transpile("fun add(a, b) { return a + b; } print add(1, 2);")
+        self.assertTrue(program.source.startswith("def _main():\n"))
+        self.assertIn("def add_fn(a_0, b_1):", program.source)
+        self.assertEqual("<lox>", program.code.co_filename)
+
+    def test_locals_are_python_locals(self):
+        program = transpile("{ var a = 1; { var a = 2; print a; } }")
+        self.assertIn("a_0 = 1.0", program.source)
+        self.assertIn("a_1 = 2.0", program.source)
+
+    def test_captured_locals_are_cells(self):
+        program = transpile("fun f(n) { fun g() { n = n + 1; } return g; }")
+        self.assertIn("n_0 = _Cell(n_0)", program.source)
+        self.assertIn("def g_fn(*, n_u0=n_0):", program.source)
+        self.assertIn("n_u0.value = ", program.source)
+
+    def test_nested_temporaries(self):
+        self.assertEqual(-2.0, run("1 - (2 - (3 - 4));"))
+        self.assertIs(True, run("(1 < 2) == (3 - 1 > 1);"))
+
+    def test_duplicate_parameters(self):
+        with self.assertRaises(RTError) as e:
+            run("fun f(a, a) {} f(1, 2);")
+        self.assertEqual("Variable 'a' already defined", e.exception.details)
+
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_empty_bodies(self, mock_stdout):
+        run("fun f() {} if (f()) {} else {} while (false) {} print f();")
+        self.assertEqual(mock_stdout.getvalue(), "nil\n")
+
+    def test_too_deep_for_python_runs_on_tree_walker(self):
+        interpreter = PythonInterpreter()
+        chain = "print " + " + ".join(["1"] * 300) + ";"
+        for text in ("print 1 + 1;", chain):
+            tree = PrattParser(RegexLexer("stdin", text)).parse()
+            program = interpreter.prepare(tree)
+            self.assertEqual(text == chain, type(program) is not PythonProgram)
+
+    def test_error_position(self):
+        text = "var a = 1;\nprint a / (a - 1);"
+        with self.assertRaises(RTError) as e:
+            run(text)
+        self.assertEqual(text.index("/"), e.exception.pos_start.idx)
+
+
+if __name__ == "__main__":
+    unittest.main()
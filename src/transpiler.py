@@ -0,0 +1,546 @@
+import math
+from environment import Cell
+from interpreter import (
+    EQUALITY_TYPES,
+    Interpreter,
+    already_defined,
+    arithmetic_error,
+    arity_error,
+    is_equal,
+    stack_overflow,
+    stringify,
+    undefined_variable,
+)
+from lexer import (
+    TT_BANG,
+    TT_BANG_EQUAL,
+    TT_EQUAL_EQUAL,
+    TT_KEYWORD,
+    TT_LESS,
+    TT_LESS_EQUAL,
+    TT_PLUS,
+    TT_MINUS,
+    TT_MUL,
+    TT_DIV,
+    TT_GREATER,
+    TT_GREATER_EQUAL,
+    ErrorDetails,
+    RTError,
+    Return,
+)
+from lox_callable import MEMO_ENTRIES, LoxCallable, LoxFunction, NativeFunction
+from node_visitor import NodeVisitor
+from parser import AST, Assign, BinOp, Boolean, Logical, UnaryOp
+from resolver import FrameLayout
+
+ARITHMETIC = {TT_MINUS: "-", TT_MUL: "*"}
+COMPARISONS = {
+    TT_GREATER: ">",
+    TT_GREATER_EQUAL: ">=",
+    TT_LESS: "<",
+    TT_LESS_EQUAL: "<=",
+}
+EQUALITY = {TT_EQUAL_EQUAL: "==", TT_BANG_EQUAL: "!="}
+
+
+def produces_bool(node):
+    # Expressions that always evaluate to True or False can be used as
+    # Python conditions directly
+    if isinstance(node, BinOp):
+        return node.op.type in COMPARISONS or node.op.type in EQUALITY
+    if isinstance(node, UnaryOp):
+        return node.op.type == TT_BANG
+    if isinstance(node, Logical):
+        return produces_bool(node.left) and produces_bool(node.right)
+    return isinstance(node, Boolean)
+
+
+def set_cell(cell, value):
+    cell.value = value
+    return value
+
+
+class PythonProgram:
+    # A transpiled program: the generated source stays around for
+    # inspection next to its code object and the tables it refers to
+    __slots__ = ("source", "code", "tokens", "declarations", "constants")
+
+    def __init__(self, source, tokens, declarations, constants):
+        self.source = source
+        self.code = compile(source, "<lox>", "exec")
+        self.tokens = tokens
+        self.declarations = declarations
+        self.constants = constants
+
+
+class PythonFunction(LoxFunction):
+    def __init__(self, declaration, function):
+        super().__init__(declaration)
+        self.function = function
+
+    def call(self, interpreter, arguments):
+        return self.function(*arguments)
+
+
+class Transpiler(NodeVisitor):
+    # Generates a Python function _main for a resolved program. Globals stay
+    # in the interpreter's globals dict of cells (_G); locals become Python
+    # locals named after the Lox variable and its frame index. Captured
+    # locals hold a Cell, and a function gets the cells it uses as
+    # keyword-only defaults named after the variable and its upvalue index,
+    # which Python evaluates when the def runs, just as a Lox closure is
+    # created. Every runtime check of the tree walker is inlined or calls a
+    # helper with a token from the token table (_T), so errors point at the
+    # same Lox positions.
+    def __init__(self):
+        self.lines = None
+        self.indent = 0
+        self.depth = 0
+        self.layout = None
+        self.in_function = False
+        self.tokens = None
+        self.token_index = None
+        self.declarations = None
+        self.constants = None
+
+    def transpile(self, declarations):
+        source = self.generate(declarations)
+        return PythonProgram(source, self.tokens, self.declarations, self.constants)
+
+    def generate(self, declarations):
+        # Returns the source of _main; the tables it refers to are left on
+        # the transpiler
+        self.lines = ["def _main():"]
+        self.indent = 1
+        self.depth = 0
+        self.layout = FrameLayout()
+        self.in_function = False
+        self.tokens = []
+        self.token_index = {}
+        self.declarations = []
+        self.constants = []
+
+        declarations = list(declarations)
+        for node in declarations[:-1]:
+            self.statement(node)
+        if declarations and isinstance(declarations[-1], AST):
+            self.emit(f"return {self.expression(declarations[-1])}")
+        else:
+            if declarations:
+                self.statement(declarations[-1])
+            self.emit("return None")
+        return "\n".join(self.lines) + "\n"
+
+    def emit(self, line):
+        self.lines.append("    " * self.indent + line)
+
+    def token(self, token):
+        index = self.token_index.get(id(token))
+        if index is None:
+            index = self.token_index[id(token)] = len(self.tokens)
+            self.tokens.append(token)
+        return f"_T[{index}]"
+
+    def local(self, name, index):
+        return f"{name}_{index}"
+
+    def upvalue(self, name, index):
+        return f"{name}_u{index}"
+
+    def temps(self):
+        return f"_a{self.depth}", f"_b{self.depth}"
+
+    def expression(self, node):
+        # Temporaries are numbered by nesting depth: a node's operands are
+        # complete before a sibling reuses the same names
+        self.depth += 1
+        try:
+            return self.visit(node)
+        finally:
+            self.depth -= 1
+
+    def statement(self, node):
+        if isinstance(node, Assign):
+            self.assign_statement(node)
+        elif isinstance(node, AST):
+            self.emit(self.expression(node))
+        else:
+            self.visit(node)
+
+    def body(self, node):
+        self.indent += 1
+        length = len(self.lines)
+        self.statement(node)
+        if len(self.lines) == length:
+            self.emit("pass")
+        self.indent -= 1
+
+    def visit_Num(self, node):
+        value = node.token.value
+        if isinstance(value, str) or math.isfinite(value):
+            return repr(value)
+        self.constants.append(value)
+        return f"_K[{len(self.constants) - 1}]"
+
+    visit_String = visit_Num
+
+    def visit_Nil(self, node):
+        return "None"
+
+    def visit_Boolean(self, node):
+        return repr(node.token.value == "true")
+
+    def visit_Identifier(self, node):
+        if node.upvalue is not None or node.boxed:
+            return f"{self.cell(node)}.value"
+        if node.depth is None:
+            return f"{self.global_cell(node)}.value"
+        # A resolved local is always assigned before it is read
+        return self.local(node.token.value, self.layout.index(node.depth, node.slot))
+
+    def visit_Assign(self, node):
+        left = node.left
+        right = self.expression(node.right)
+        cell = self.cell(left)
+        if cell is not None:
+            return f"_set_cell({cell}, {right})"
+        if left.depth is None:
+            name = repr(left.token.value)
+            return f"_set_global({name}, {right}, {self.token(left.token)})"
+        name = self.local(left.token.value, self.layout.index(left.depth, left.slot))
+        return f"({name} := {right})"
+
+    def cell(self, node):
+        # The Cell an assignment to node stores into, if it is captured
+        if node.upvalue is not None:
+            return self.upvalue(node.token.value, node.upvalue)
+        if node.boxed:
+            return self.captured(node.token.value, node.depth, node.slot)
+        return None
+
+    def global_cell(self, node):
+        # A Cell is never false, so only an undefined name reaches _undefined
+        name = repr(node.token.value)
+        return f"(_G.get({name}) or _undefined({self.token(node.token)}))"
+
+    def captured(self, name, depth, slot):
+        # The cell of a captured variable in the running function
+        if depth is None:
+            return self.upvalue(name, slot)
+        return self.local(name, self.layout.index(depth, slot))
+
+    def assign_statement(self, node):
+        left = node.left
+        right = self.expression(node.right)
+        cell = self.cell(left)
+        if cell is not None:
+            self.emit(f"{cell}.value = {right}")
+        elif left.depth is None:
+            # Python evaluates the value before the target, as Lox does
+            self.emit(f"{self.global_cell(left)}.value = {right}")
+        else:
+            index = self.layout.index(left.depth, left.slot)
+            self.emit(f"{self.local(left.token.value, index)} = {right}")
+
+    def visit_BinOp(self, node):
+        a, b = self.temps()
+        left = self.expression(node.left)
+        right = self.expression(node.right)
+        token = self.token(node.token)
+        op = node.op.type
+        both_numbers = (
+            f"(type({a} := {left}) is float) & (type({b} := {right}) is float)"
+        )
+
+        if op == TT_PLUS:
+            same_type = f"type({a} := {left}) is type({b} := {right})"
+            return (
+                f"({a} + {b} if {same_type}"
+                f" and (type({a}) is float or type({a}) is str)"
+                f" else _add({a}, {b}, {token}))"
+            )
+        if op in ARITHMETIC:
+            operator = ARITHMETIC[op]
+            return f"({a} {operator} {b} if {both_numbers} else _arith({token}))"
+        if op == TT_DIV:
+            return (
+                f"({a} / {b} if {both_numbers} and {b} != 0"
+                f" else _divide({a}, {b}, {token}))"
+            )
+        if op in COMPARISONS:
+            compare = COMPARISONS[op]
+            return f"({a} {compare} {b} if {both_numbers} else _arith({token}))"
+
+        same_type = f"type({a} := {left}) is type({b} := {right})"
+        return (
+            f"({a} {EQUALITY[op]} {b} if {same_type} and type({a}) in _E"
+            f" else _equal({a}, {b}, {token}, {op == TT_EQUAL_EQUAL}))"
+        )
+
+    def visit_UnaryOp(self, node):
+        expr = self.expression(node.expr)
+        if node.op.type == TT_MINUS:
+            a, _ = self.temps()
+            token = self.token(node.expr.token)
+            return f"(-{a} if type({a} := {expr}) is float else _arith({token}))"
+        if produces_bool(node.expr):
+            return f"(not {expr})"
+        a, _ = self.temps()
+        return f"(({a} := {expr}) is None or {a} is False)"
+
+    def visit_Logical(self, node):
+        a, _ = self.temps()
+        left = self.expression(node.left)
+        right = self.expression(node.right)
+        # Python's own and/or only agree with Lox truthiness on booleans
+        if node.op.matches(TT_KEYWORD, "or"):
+            if produces_bool(node.left):
+                return f"({left} or {right})"
+            return (
+                f"({a} if ({a} := {left}) is not None and {a} is not False"
+                f" else {right})"
+            )
+        if produces_bool(node.left):
+            return f"({left} and {right})"
+        return f"({a} if ({a} := {left}) is None or {a} is False else {right})"
+
+    def condition(self, node):
+        expr = self.expression(node)
+        if produces_bool(node):
+            return expr
+        return f"(_c := {expr}) is not None and _c is not False"
+
+    def visit_Call(self, node):
+        # The callee is checked before any argument runs, as in the tree walker
+        callee = self.expression(node.callee)
+        arguments = [self.expression(argument) for argument in node.arguments]
+        callee_token = self.token(node.callee.token)
+        arity_token = self.token(
+            node.arguments[0].token if node.arguments else node.paren
+        )
+        return (
+            f"_call(_callable({callee}, {callee_token}), {arity_token}"
+            + "".join(f", {argument}" for argument in arguments)
+            + ")"
+        )
+
+    def visit_PrintStmt(self, node):
+        self.emit(f"print(_str({self.expression(node.expr)}))")
+
+    def define(self, name, slot, value, token):
+        if slot is None:
+            self.emit(f"_define({name!r}, {value}, {self.token(token)})")
+            return
+        index, first = self.layout.declare(slot)
+        local = self.local(name, index)
+        if first:
+            self.emit(f"{local} = {value}")
+        else:
+            # The first declaration has run by now, so a redeclaration in
+            # the same scope always fails once its value is evaluated
+            self.emit(f"_v = {value}")
+            self.emit(f"raise _already_defined({self.token(token)})")
+
+    def visit_VarStmt(self, node):
+        value = self.expression(node.expr) if node.expr else "None"
+        if node.boxed:
+            value = f"_Cell({value})"
+        self.define(node.token.value, node.slot, value, node.token)
+
+    def visit_Block(self, node):
+        if node.size:
+            self.layout.push(node.size)
+        for stmt in node.statements:
+            self.statement(stmt)
+        if node.size:
+            self.layout.pop()
+
+    def visit_IfStmt(self, node):
+        self.emit(f"if {self.condition(node.condition)}:")
+        self.body(node.then_stmt)
+        if node.else_stmt is not None:
+            self.emit("else:")
+            self.body(node.else_stmt)
+
+    def visit_WhileStmt(self, node):
+        self.emit(f"while {self.condition(node.condition)}:")
+        self.body(node.body)
+
+    def visit_ForStmt(self, node):
+        if node.size:
+            self.layout.push(node.size)
+        if node.initializer is not None:
+            self.statement(node.initializer)
+        if node.condition is not None:
+            self.emit(f"while {self.condition(node.condition)}:")
+        else:
+            self.emit("while True:")
+        self.indent += 1
+        length = len(self.lines)
+        self.statement(node.body)
+        if node.increment is not None:
+            self.statement(node.increment)
+        if len(self.lines) == length:
+            self.emit("pass")
+        self.indent -= 1
+        if node.size:
+            self.layout.pop()
+
+    def visit_ReturnStmt(self, node):
+        value = self.expression(node.value) if node.value is not None else "None"
+        if self.in_function:
+            self.emit(f"return {value}")
+        else:
+            self.emit(f"raise _Return({value})")
+
+    def visit_Function(self, node):
+        name = node.name.value
+        function_name = f"{name}_fn"
+        if node.boxed:
+            # The cell exists before the closure, which may capture it
+            self.define(name, node.slot, "_Cell(None)", node.name)
+        captures = [
+            f"{self.upvalue(upvalue, index)}={self.captured(upvalue, depth, slot)}"
+            for index, (upvalue, depth, slot) in enumerate(node.upvalues)
+        ]
+        if captures:
+            captures.insert(0, "*")
+        enclosing = (self.layout, self.in_function, self.depth)
+        self.layout = FrameLayout()
+        self.in_function = True
+        self.depth = 0
+        try:
+            self.layout.push(node.size)
+            params = [
+                self.local(param.value, slot)
+                for param, slot in zip(node.params, node.param_slots)
+            ]
+            duplicates = len(set(params)) != len(params)
+            if duplicates:
+                # Python rejects repeated parameter names, so bind them one
+                # by one with the same check the environment makes
+                names = [f"_p{i}" for i in range(len(params))]
+                self.emit(f"def {function_name}({', '.join(names + captures)}):")
+                self.indent += 1
+                for i, param in enumerate(node.params):
+                    self.define(param.value, node.param_slots[i], f"_p{i}", param)
+            else:
+                self.emit(f"def {function_name}({', '.join(params + captures)}):")
+                self.indent += 1
+                for slot in node.param_slots:
+                    self.layout.declare(slot)
+            for slot in node.boxed_params:
+                param = params[node.param_slots.index(slot)]
+                self.emit(f"{param} = _Cell({param})")
+            for stmt in node.body:
+                self.statement(stmt)
+            self.emit("return None")
+            self.indent -= 1
+        finally:
+            self.layout, self.in_function, self.depth = enclosing
+
+        self.declarations.append(node)
+        function = f"_function(_D[{len(self.declarations) - 1}], {function_name})"
+        if node.slot is None:
+            function = f"_memoized({function})"
+        if node.boxed:
+            index = self.layout.index(0, node.slot)
+            self.emit(f"{self.local(name, index)}.value = {function}")
+        else:
+            self.define(name, node.slot, function, node.name)
+
+
+class PythonInterpreter(Interpreter):
+    # Runs programs transpiled to Python source, so loops and arithmetic run
+    # on CPython's own (specializing) bytecode interpreter
+    def __init__(self, memo_entries=MEMO_ENTRIES):
+        super().__init__(memo_entries)
+        self.transpiler = Transpiler()
+
+    def interpret_declarations(self, declarations):
+        result = None
+        for node in declarations:
+            self.resolver.visit(node)
+            result = self.execute(self.compile([node]))
+        return result
+
+    def prepare(self, tree):
+        return self.compile(self.resolver.resolve(tree))
+
+    def compile(self, tree):
+        # CPython rejects source nesting parentheses or loops past its fixed
+        # limits, as a long chain of binary operators or deeply nested
+        # loops do. Such programs run on the tree walker instead.
+        try:
+            return self.transpiler.transpile(tree)
+        except (SyntaxError, RecursionError):
+            return tree
+
+    def execute(self, program):
+        if type(program) is not PythonProgram:
+            return super().execute(program)
+        namespace = {
+            "_G": self.globals.values,
+            "_E": EQUALITY_TYPES,
+            "_str": stringify,
+            "_T": program.tokens,
+            "_D": program.declarations,
+            "_K": program.constants,
+            "_Return": Return,
+            "_undefined": self.undefined,
+            "_already_defined": already_defined,
+            "_arith": self.arithmetic,
+            "_add": self.add,
+            "_divide": self.divide,
+            "_equal": self.equal,
+            "_set_global": self.set_global,
+            "_set_cell": set_cell,
+            "_Cell": Cell,
+            "_define": self.globals.define,
+            "_callable": self.callable,
+            "_call": self.call,
+            "_function": PythonFunction,
+            "_memoized": self.memoized,
+        }
+        exec(program.code, namespace)
+        return namespace["_main"]()
+
+    def undefined(self, token):
+        raise undefined_variable(token)
+
+    def arithmetic(self, token):
+        raise arithmetic_error(token)
+
+    def add(self, a, b, token):
+        self.check_types(token, a, b)
+        return a + b
+
+    def divide(self, a, b, token):
+        if not isinstance(a, float) or not isinstance(b, float):
+            raise arithmetic_error(token)
+        raise RTError(token.pos_start, token.pos_end, ErrorDetails.DIVISION_BY_ZERO)
+
+    def equal(self, a, b, token, equal):
+        self.check_types(token, a, b, True)
+        return is_equal(a, b) is equal
+
+    def set_global(self, name, value, token):
+        self.globals.assign(name, value, token)
+        return value
+
+    def callable(self, function, token):
+        if not isinstance(function, LoxCallable):
+            raise RTError(
+                token.pos_start, token.pos_end, ErrorDetails.CALLS_RESTRICTION
+            )
+        return function
+
+    def call(self, function, token, *arguments):
+        if len(arguments) != function.param_count:
+            raise arity_error(token, function.param_count, len(arguments))
+        try:
+            if type(function) is PythonFunction or isinstance(function, NativeFunction):
+                return function.function(*arguments)
+            return function.call(self, list(arguments))
+        except RecursionError:
+            raise stack_overflow(token) from None
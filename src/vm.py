@@ -0,0 +1,410 @@
+from bytecode import (
+    OP_ADD,
+    OP_BOX,
+    OP_CALL,
+    OP_CHECK_CALLABLE,
+    OP_CONSTANT,
+    OP_DEFINE_GLOBAL,
+    OP_DEFINE_LOCAL,
+    OP_DIVIDE,
+    OP_EQUAL,
+    OP_FUNCTION,
+    OP_GET_CELL,
+    OP_GET_GLOBAL,
+    OP_GET_LOCAL,
+    OP_GET_UPVALUE,
+    OP_GREATER,
+    OP_GREATER_EQUAL,
+    OP_HALT,
+    OP_JUMP,
+    OP_JUMP_IF_FALSE,
+    OP_JUMP_IF_FALSE_OR_POP,
+    OP_JUMP_IF_TRUE_OR_POP,
+    OP_LESS,
+    OP_LESS_EQUAL,
+    OP_MULTIPLY,
+    OP_NEGATE,
+    OP_NOT,
+    OP_NOT_EQUAL,
+    OP_POP,
+    OP_PRINT,
+    OP_RETURN,
+    OP_SET_CELL,
+    OP_SET_GLOBAL,
+    OP_SET_LOCAL,
+    OP_SET_UPVALUE,
+    OP_STORE_LOCAL,
+    OP_SUBTRACT,
+    OP_TAIL_CALL,
+    Compiler,
+)
+from environment import UNDEFINED, Cell
+from interpreter import (
+    EQUALITY_TYPES,
+    Interpreter,
+    already_defined,
+    arithmetic_error,
+    arity_error,
+    stack_overflow,
+    stringify,
+)
+from lexer import ErrorDetails, RTError, Return
+from lox_callable import (
+    MEMO_ENTRIES,
+    LoxCallable,
+    LoxFunction,
+    MemoizedFunction,
+    NativeFunction,
+    frame_padding,
+    memo_key,
+)
+
+
+class BytecodeFunction(LoxFunction):
+    def __init__(self, chunk, upvalues=()):
+        super().__init__(chunk.declaration, upvalues)
+        self.chunk = chunk
+        # Frames are flat, so blocks inside the function add to their size
+        self.padding = frame_padding(chunk.declaration.param_slots, chunk.frame_size)
+
+    def call(self, interpreter, arguments):
+        slots = interpreter.make_frame(self, arguments)
+        return interpreter.run(self.chunk, slots, self.upvalues)
+
+
+# Default limit on nested Lox calls in the vm
+MAX_DEPTH = 10000
+
+
+class VM(Interpreter):
+    # Runs compiled Chunks. Lox calls push a frame onto a list instead of
+    # recursing in Python, so the call depth is limited only by max_depth;
+    # every frame owns a flat list of local slots and the upvalue cells of
+    # its function, and all frames share one value stack. A saved frame
+    # also holds the memo table and key its callee's result is stored
+    # under, if any.
+    def __init__(self, max_depth=MAX_DEPTH, memo_entries=MEMO_ENTRIES):
+        super().__init__(memo_entries)
+        self.compiler = Compiler()
+        self.max_depth = max_depth
+
+    def interpret_declarations(self, declarations):
+        result = None
+        for node in declarations:
+            self.resolver.visit(node)
+            chunk = self.compiler.compile([node])
+            result = self.run(chunk, [UNDEFINED] * chunk.frame_size)
+        return result
+
+    def prepare(self, tree):
+        return self.compiler.compile(self.resolver.resolve(tree))
+
+    def execute(self, chunk):
+        return self.run(chunk, [UNDEFINED] * chunk.frame_size)
+
+    def make_frame(self, function, arguments):
+        if function.padding is not None:
+            return arguments + function.padding
+        declaration = function.declaration
+        slots = [UNDEFINED] * function.chunk.frame_size
+        for slot, param, argument in zip(
+            declaration.param_slots, declaration.params, arguments
+        ):
+            if slots[slot] is not UNDEFINED:
+                raise already_defined(param)
+            slots[slot] = argument
+        return slots
+
+    def run(self, chunk, slots, upvalues=()):
+        table = self.globals
+        check_types = self.check_types
+        max_depth = self.max_depth
+        frames = []
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        code = chunk.code
+        constants = chunk.constants
+        caches = chunk.caches
+        ip = 0
+
+        while True:
+            op = code[ip]
+
+            if op == OP_GET_LOCAL:
+                push(slots[code[ip + 1]])
+                ip += 2
+
+            elif op == OP_CONSTANT:
+                push(constants[code[ip + 1]])
+                ip += 2
+
+            elif op == OP_GET_GLOBAL:
+                if table.version == caches[ip + 1]:
+                    push(caches[ip].value)
+                else:
+                    name = constants[code[ip + 1]]
+                    cell = caches[ip] = table.cell(chunk.tokens[ip], name)
+                    caches[ip + 1] = table.version
+                    push(cell.value)
+                ip += 2
+
+            elif op == OP_SET_LOCAL:
+                slots[code[ip + 1]] = stack[-1]
+                ip += 2
+
+            elif op == OP_JUMP_IF_FALSE:
+                value = pop()
+                if value is False or value is None:
+                    ip = code[ip + 1]
+                else:
+                    ip += 2
+
+            elif op == OP_JUMP:
+                ip = code[ip + 1]
+
+            elif op == OP_POP:
+                pop()
+                ip += 1
+
+            elif op == OP_ADD:
+                b = pop()
+                a = stack[-1]
+                if type(a) is not type(b) or (
+                    type(a) is not float and type(a) is not str
+                ):
+                    check_types(chunk.tokens[ip], a, b)
+                stack[-1] = a + b
+                ip += 1
+
+            elif op == OP_SUBTRACT:
+                b = pop()
+                a = stack[-1]
+                if type(a) is not float or type(b) is not float:
+                    raise arithmetic_error(chunk.tokens[ip])
+                stack[-1] = a - b
+                ip += 1
+
+            elif op == OP_MULTIPLY:
+                b = pop()
+                a = stack[-1]
+                if type(a) is not float or type(b) is not float:
+                    raise arithmetic_error(chunk.tokens[ip])
+                stack[-1] = a * b
+                ip += 1
+
+            elif op == OP_DIVIDE:
+                b = pop()
+                a = stack[-1]
+                if type(a) is not float or type(b) is not float:
+                    raise arithmetic_error(chunk.tokens[ip])
+                if b == 0:
+                    token = chunk.tokens[ip]
+                    raise RTError(
+                        token.pos_start, token.pos_end, ErrorDetails.DIVISION_BY_ZERO
+                    )
+                stack[-1] = a / b
+                ip += 1
+
+            elif op == OP_LESS:
+                b = pop()
+                a = stack[-1]
+                if type(a) is not float or type(b) is not float:
+                    raise arithmetic_error(chunk.tokens[ip])
+                stack[-1] = a < b
+                ip += 1
+
+            elif op == OP_LESS_EQUAL:
+                b = pop()
+                a = stack[-1]
+                if type(a) is not float or type(b) is not float:
+                    raise arithmetic_error(chunk.tokens[ip])
+                stack[-1] = a <= b
+                ip += 1
+
+            elif op == OP_GREATER:
+                b = pop()
+                a = stack[-1]
+                if type(a) is not float or type(b) is not float:
+                    raise arithmetic_error(chunk.tokens[ip])
+                stack[-1] = a > b
+                ip += 1
+
+            elif op == OP_GREATER_EQUAL:
+                b = pop()
+                a = stack[-1]
+                if type(a) is not float or type(b) is not float:
+                    raise arithmetic_error(chunk.tokens[ip])
+                stack[-1] = a >= b
+                ip += 1
+
+            elif op == OP_EQUAL or op == OP_NOT_EQUAL:
+                b = pop()
+                a = stack[-1]
+                if type(a) is not type(b):
+                    check_types(chunk.tokens[ip], a, b, True)
+                    stack[-1] = op != OP_EQUAL
+                else:
+                    if type(a) not in EQUALITY_TYPES:
+                        check_types(chunk.tokens[ip], a, b, True)
+                    stack[-1] = (a == b) is (op == OP_EQUAL)
+                ip += 1
+
+            elif op == OP_CALL or op == OP_TAIL_CALL:
+                argc = code[ip + 1]
+                function = stack[-1 - argc]
+                if argc != function.param_count:
+                    raise arity_error(chunk.tokens[ip], function.param_count, argc)
+                arguments = stack[len(stack) - argc :]
+                del stack[len(stack) - argc - 1 :]
+                memo = None
+                if (
+                    type(function) is MemoizedFunction
+                    and type(function.function) is BytecodeFunction
+                ):
+                    # A call looks in the table first and a miss stores its
+                    # result when its frame returns; tail calls run in place
+                    # without the table
+                    if op == OP_CALL and function.enabled(self):
+                        key = memo_key(arguments)
+                        value = function.table.get(key)
+                        if value is not UNDEFINED:
+                            push(value)
+                            ip += 2
+                            continue
+                        memo = (function.table, key)
+                    function = function.function
+                if type(function) is BytecodeFunction:
+                    if op == OP_CALL:
+                        if len(frames) >= max_depth:
+                            raise stack_overflow(chunk.tokens[ip])
+                        frames.append((chunk, slots, upvalues, ip + 2, memo))
+                    upvalues = function.upvalues
+                    if function.padding is not None:
+                        slots = arguments + function.padding
+                    else:
+                        slots = self.make_frame(function, arguments)
+                    chunk = function.chunk
+                    code = chunk.code
+                    constants = chunk.constants
+                    caches = chunk.caches
+                    ip = 0
+                elif isinstance(function, NativeFunction):
+                    push(function.function(*arguments))
+                    ip += 2
+                else:
+                    push(function.call(self, arguments))
+                    ip += 2
+
+            elif op == OP_CHECK_CALLABLE:
+                if not isinstance(stack[-1], LoxCallable):
+                    token = chunk.tokens[ip]
+                    raise RTError(
+                        token.pos_start, token.pos_end, ErrorDetails.CALLS_RESTRICTION
+                    )
+                ip += 1
+
+            elif op == OP_RETURN:
+                if not frames:
+                    if chunk.declaration is None:
+                        raise Return(pop())
+                    return pop()
+                chunk, slots, upvalues, ip, memo = frames.pop()
+                if memo is not None:
+                    memo[0].put(memo[1], stack[-1])
+                code = chunk.code
+                constants = chunk.constants
+                caches = chunk.caches
+
+            elif op == OP_GET_UPVALUE:
+                push(upvalues[code[ip + 1]].value)
+                ip += 2
+
+            elif op == OP_SET_UPVALUE:
+                upvalues[code[ip + 1]].value = stack[-1]
+                ip += 2
+
+            elif op == OP_GET_CELL:
+                push(slots[code[ip + 1]].value)
+                ip += 2
+
+            elif op == OP_SET_CELL:
+                slots[code[ip + 1]].value = stack[-1]
+                ip += 2
+
+            elif op == OP_BOX:
+                stack[-1] = Cell(stack[-1])
+                ip += 1
+
+            elif op == OP_JUMP_IF_FALSE_OR_POP:
+                value = stack[-1]
+                if value is False or value is None:
+                    ip = code[ip + 1]
+                else:
+                    pop()
+                    ip += 2
+
+            elif op == OP_JUMP_IF_TRUE_OR_POP:
+                value = stack[-1]
+                if value is not False and value is not None:
+                    ip = code[ip + 1]
+                else:
+                    pop()
+                    ip += 2
+
+            elif op == OP_NOT:
+                value = stack[-1]
+                stack[-1] = value is False or value is None
+                ip += 1
+
+            elif op == OP_NEGATE:
+                if type(stack[-1]) is not float:
+                    raise arithmetic_error(chunk.tokens[ip])
+                stack[-1] = -stack[-1]
+                ip += 1
+
+            elif op == OP_SET_GLOBAL:
+                if table.version == caches[ip + 1]:
+                    caches[ip].value = stack[-1]
+                else:
+                    name = constants[code[ip + 1]]
+                    cell = caches[ip] = table.cell(chunk.tokens[ip], name)
+                    caches[ip + 1] = table.version
+                    cell.value = stack[-1]
+                ip += 2
+
+            elif op == OP_STORE_LOCAL:
+                slots[code[ip + 1]] = pop()
+                ip += 2
+
+            elif op == OP_DEFINE_LOCAL:
+                if slots[code[ip + 1]] is not UNDEFINED:
+                    raise already_defined(chunk.tokens[ip])
+                slots[code[ip + 1]] = pop()
+                ip += 2
+
+            elif op == OP_DEFINE_GLOBAL:
+                table.define(constants[code[ip + 1]], pop(), chunk.tokens[ip])
+                ip += 2
+
+            elif op == OP_FUNCTION:
+                function_chunk = constants[code[ip + 1]]
+                cells = [
+                    slots[index] if local else upvalues[index]
+                    for local, index in function_chunk.captures
+                ]
+                function = BytecodeFunction(function_chunk, cells)
+                if function_chunk.declaration.slot is None:
+                    function = self.memoized(function)
+                push(function)
+                ip += 2
+
+            elif op == OP_PRINT:
+                print(stringify(pop()))
+                ip += 1
+
+            elif op == OP_HALT:
+                return pop()
+
+            else:
+                raise Exception(f"Unknown opcode {op}")